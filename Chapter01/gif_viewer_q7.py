@@ -14,6 +14,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel,
     QFileDialog, QHBoxLayout, QVBoxLayout, QSizePolicy)
 from PyQt6.QtCore import Qt, QDir, QSize, QSysInfo
 from PyQt6.QtGui import QIcon, QPixmap, QMovie, QAction, QKeySequence
+from profiling import profiler, ProfilerDock
 
 class MainWindow(QMainWindow):
 
@@ -26,10 +27,17 @@ class MainWindow(QMainWindow):
         """Set up the GUI's main window."""        
         self.setMinimumSize(700, 400)
         self.setWindowTitle("GIF and Image Viewer")
+        # Time the slots when profiling is turned on. Slots have to be 
+        # replaced before they are connected
+        profiler.instrument(self, ("displayMediaFile", "openDirectory", 
+            "changeButtonStates"))
 
         # Set up the main window, menu, and dock widget
         self.setUpMainWindow()
         self.displayFilesDock()
+        if profiler.enabled:
+            self.profiler_dock = ProfilerDock(profiler, self)
+            self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.profiler_dock)
         self.createActions()
         self.createMenus()
         self.createToolbar()
@@ -85,6 +93,8 @@ class MainWindow(QMainWindow):
 
         self.view_menu = self.menuBar().addMenu("&View")
         self.view_menu.addAction(self.show_dock_act)      
+        if profiler.enabled:
+            self.view_menu.addAction(self.profiler_dock.toggleViewAction())
 
     def createToolbar(self):
         """Create the application's toolbar for playing GIFs."""
@@ -0,0 +1,367 @@
+"""Image Manager GUI, Part 2
+Benchmarks the MainWindow on the offscreen platform with synthetic libraries
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+
+Run from the ImageManager directory:
+
+    $ python3 benchmarks/benchmark_gui.py --sizes 1000,10000,100000 --output results.json
+    $ python3 benchmarks/benchmark_gui.py --compare benchmarks/baseline.json
+
+Each measurement runs in a fresh process whose settings, catalog and
+thumbnail cache are kept in a profile directory of its own, so the
+user's library is never touched. The generated libraries are kept in
+the work directory and reused by later runs.
+"""
+
+# Import necessary modules
+import os, sys, json, time, random, shutil, argparse, platform, resource, subprocess
+import multiprocessing, statistics, tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = (1000, 10000, 100000)
+IMAGE_SIZE = (320, 240) # Size of the generated images, in pixels
+SELECTION_STEPS = 20 # Images stepped through when measuring the preview
+SELECTION_JUMPS = 5 # Random images selected after stepping through
+TIMEOUT_MS = 600000 # Longest wait for the window to become ready
+
+# Metrics where a higher value is better. Every other metric is a time or
+# an amount of memory, where lower is better
+HIGHER_IS_BETTER = ("import_files_per_s", "import_mb_per_s")
+DEFAULT_THRESHOLD = 0.25 # Allowed relative regression
+NOISE_FLOOR = {"ms": 20.0, "mb": 10.0} # Smaller absolute changes are ignored
+
+def generateImage(arguments):
+    """Write a JPEG whose colours and shapes are derived from 'index', so
+    that no two images have the same contents, and give it a modification
+    time spread over the past years. Runs in a worker process."""
+    from PyQt6.QtCore import QRect
+    from PyQt6.QtGui import QImage, QColor, QPainter
+    image_path, index = arguments
+    generator = random.Random(index)
+    width, height = IMAGE_SIZE
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    image.fill(QColor.fromHsv(index * 37 % 360, 90, 220))
+    painter = QPainter(image)
+    for _ in range(12):
+        painter.fillRect(QRect(generator.randrange(width), generator.randrange(height),
+            generator.randrange(8, width // 2), generator.randrange(8, height // 2)),
+            QColor(generator.randrange(256), generator.randrange(256), generator.randrange(256)))
+    painter.end()
+    image.save(image_path, "JPEG", 85)
+    mtime = time.time() - generator.randrange(5 * 365 * 24 * 3600)
+    os.utime(image_path, (mtime, mtime))
+
+def generateLibrary(directory, count, processes):
+    """Fill 'directory' with 'count' generated images in the sharded layout,
+    unless it holds them from an earlier run. The count is kept next to 
+    the directory, since every file in the directory is shown by the window."""
+    sys.path.insert(0, APP_DIR)
+    from image_manager.library.storage import libraryPath, createShards
+    marker = directory + ".generated"
+    if os.path.exists(marker):
+        with open(marker) as marker_file:
+            if marker_file.read() == f"{count} sharded":
+                return
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    createShards(directory)
+    print(f"Generating {count:,} images in {directory}", file=sys.stderr)
+    jobs = [(libraryPath(directory, f"image_{index:06d}.jpg"), index) for index in range(count)]
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for _ in pool.map(generateImage, jobs, chunksize=256):
+            pass
+    with open(marker, "w") as marker_file:
+        marker_file.write(f"{count} sharded")
+
+def peakRssMb():
+    """Return the peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def percentile(values, fraction):
+    """Return the value below which 'fraction' of 'values' lie."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+class WindowDriver:
+
+    def __init__(self):
+        """Creates the MainWindow in this process and waits for it to reach
+        the states that are measured. Must be run with the working directory
+        set to the directory that holds the Images directory."""
+        from PyQt6.QtWidgets import QApplication
+        from PyQt6.QtCore import QElapsedTimer
+        self.app = QApplication(sys.argv[:1])
+        self.timer = QElapsedTimer()
+        self.timer.start()
+        # The import is part of the startup a user waits for
+        from image_manager.main_window import MainWindow
+        self.window = MainWindow()
+
+    def waitFor(self, condition, timeout_ms=TIMEOUT_MS):
+        """Process events until 'condition' returns True. Returns False on
+        timeout."""
+        from PyQt6.QtCore import QEventLoop, QElapsedTimer
+        waited = QElapsedTimer()
+        waited.start()
+        while not condition():
+            if waited.elapsed() > timeout_ms:
+                return False
+            self.app.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 1)
+            if not condition():
+                time.sleep(0.0005)
+        return True
+
+    def isReady(self):
+        """Return True once the scan has finished and every image in the
+        viewport shows its thumbnail."""
+        window = self.window
+        if "scan_ms" not in window.startup_metrics:
+            return False
+        rows = window.image_view_lv.visibleRows()
+        return all(window.image_model.thumbnail(row) is not None for row in rows)
+
+    def isPreviewReady(self):
+        """Return True once every tile of the preview in view is decoded."""
+        view = self.window.preview_view
+        if view.display_size is None:
+            return False
+        return all(view.loader.tile(key) is not None
+            for key in view.visibleTiles(view.level()))
+
+    def measureStartup(self, prefix):
+        """Return the time until the window is ready and the startup
+        metrics recorded by the window itself."""
+        if not self.waitFor(self.isReady):
+            raise RuntimeError("The window didn't become ready in time")
+        results = {f"{prefix}_startup_ms": self.timer.elapsed()}
+        for name, value in self.window.startup_metrics.items():
+            results[f"{prefix}_{name}"] = value
+        return results
+
+    def measureSelection(self):
+        """Select images one after the other, as with the arrow keys, then
+        jump to random images, and return the time until each preview is
+        fully decoded."""
+        from PyQt6.QtCore import QElapsedTimer
+        view, proxy = self.window.image_view_lv, self.window.proxy_model
+        row_count = proxy.rowCount()
+        generator = random.Random(0)
+        rows = list(range(min(SELECTION_STEPS, row_count)))
+        rows += [generator.randrange(row_count) for _ in range(SELECTION_JUMPS)]
+        latencies = []
+        timer = QElapsedTimer()
+        for row in rows:
+            timer.start()
+            view.setCurrentIndex(proxy.index(row))
+            if not self.waitFor(self.isPreviewReady, 10000):
+                raise RuntimeError(f"The preview of row {row} wasn't decoded in time")
+            latencies.append(timer.nsecsElapsed() / 1e6)
+        return {"selection_preview_median_ms": statistics.median(latencies),
+            "selection_preview_p95_ms": percentile(latencies, 0.95),
+            "selection_preview_max_ms": max(latencies)}
+
+    def measureSort(self):
+        """Sort by every field in both directions and return the slowest
+        sort of each field, including the view's layout and repaint. The
+        viewport is repainted directly, since processing events would also
+        count the background work that is delivered in the meantime."""
+        from PyQt6.QtCore import Qt, QElapsedTimer
+        from image_manager.model_view.models import SORT_FIELDS, SORT_NAME
+        window = self.window
+        results = {}
+        timer = QElapsedTimer()
+        for field in SORT_FIELDS:
+            window.sort_field = field
+            times = []
+            for order in (Qt.SortOrder.DescendingOrder, Qt.SortOrder.AscendingOrder):
+                timer.start()
+                window.sortListItems(order)
+                window.image_view_lv.doItemsLayout()
+                window.image_view_lv.viewport().repaint()
+                times.append(timer.nsecsElapsed() / 1e6)
+            results[f"sort_{field}_ms"] = max(times)
+        window.sort_field = SORT_NAME
+        window.sortListItems(Qt.SortOrder.AscendingOrder)
+        return results
+
+    def measureImport(self, sources):
+        """Import 'sources' into the empty library with the window's import
+        engine and return the throughput."""
+        window = self.window
+        finished = []
+        window.import_engine.finished.connect(finished.append)
+        size = sum(os.path.getsize(source) for source in sources)
+        started = time.perf_counter()
+        window.import_engine.addFiles(sources, window.library_roots[0], False,
+            window.performance_options["import_mode"])
+        if not self.waitFor(lambda: finished):
+            raise RuntimeError("The import didn't finish in time")
+        seconds = time.perf_counter() - started
+        imported = sum(window.import_engine.modes_used.values())
+        if imported != len(sources):
+            raise RuntimeError(f"Only {imported:,} of {len(sources):,} images were imported")
+        return {"import_ms": seconds * 1000, "import_files_per_s": len(sources) / seconds,
+            "import_mb_per_s": size / (1024 * 1024) / seconds}
+
+    def close(self):
+        """Close the window and wait for the catalog to be written, so that
+        the next process starts warm."""
+        from PyQt6.QtCore import QThreadPool
+        self.window.storeDimensions()
+        self.window.close()
+        QThreadPool.globalInstance().waitForDone()
+
+def runScenario(scenario, source_dir):
+    """Run a scenario in this process and print its results as JSON."""
+    sys.path.insert(0, APP_DIR)
+    driver = WindowDriver()
+    if scenario in ("cold", "warm"):
+        results = driver.measureStartup(scenario)
+        if scenario == "warm":
+            results.update(driver.measureSort())
+            results.update(driver.measureSelection())
+    elif scenario == "import":
+        driver.waitFor(lambda: "scan_ms" in driver.window.startup_metrics)
+        results = driver.measureImport(sorted(os.path.join(directory, file_name)
+            for directory, _, file_names in os.walk(source_dir)
+            for file_name in file_names if file_name.endswith(".jpg")))
+    driver.close()
+    results[f"{scenario}_peak_rss_mb"] = peakRssMb()
+    print(json.dumps(results))
+
+def launchScenario(scenario, root, profile, source_dir=None):
+    """Run 'scenario' in a child process with its working directory set to
+    'root' and its settings and caches kept in 'profile'."""
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen", HOME=profile,
+        XDG_CONFIG_HOME=os.path.join(profile, "config"),
+        XDG_DATA_HOME=os.path.join(profile, "data"),
+        XDG_CACHE_HOME=os.path.join(profile, "cache"))
+    command = [sys.executable, os.path.abspath(__file__), "--scenario", scenario]
+    if source_dir is not None:
+        command += ["--source", source_dir]
+    process = subprocess.run(command, cwd=root, env=environment, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"The {scenario} scenario failed:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def benchmarkSize(count, work_dir, processes):
+    """Run every scenario against a library of 'count' images."""
+    root = os.path.join(work_dir, f"library_{count}")
+    images_dir = os.path.join(root, "Images")
+    generateLibrary(images_dir, count, processes)
+    profile = os.path.join(work_dir, f"profile_{count}")
+    shutil.rmtree(profile, ignore_errors=True)
+    os.makedirs(profile)
+
+    results = {}
+    print(f"{count:,} images: cold start", file=sys.stderr)
+    results.update(launchScenario("cold", root, profile))
+    print(f"{count:,} images: warm start, sorting and selection", file=sys.stderr)
+    results.update(launchScenario("warm", root, profile))
+
+    # Import the generated images into an empty library
+    import_root = os.path.join(work_dir, f"import_{count}")
+    import_profile = os.path.join(work_dir, f"import_profile_{count}")
+    for directory in (import_root, import_profile):
+        shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(os.path.join(import_root, "Images"))
+    os.makedirs(import_profile)
+    print(f"{count:,} images: import", file=sys.stderr)
+    results.update(launchScenario("import", import_root, import_profile, images_dir))
+    shutil.rmtree(import_root, ignore_errors=True)
+    results["peak_rss_mb"] = max(value for name, value in results.items()
+        if name.endswith("_peak_rss_mb"))
+    return results
+
+def environmentInfo():
+    """Return a description of the machine and library versions, stored
+    with the results since timings only compare on the same setup."""
+    from PyQt6.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+    return {"python": platform.python_version(), "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR, "platform": platform.platform(),
+        "machine": platform.machine(), "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def compareResults(results, baseline, thresholds, default_threshold):
+    """Return a list of (size, metric, baseline value, value, change)
+    tuples for the metrics that regressed by more than their threshold.
+    Thresholds are relative changes, e.g. 0.25 allows 25% slower."""
+    regressions = []
+    for size, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            base = baseline["results"].get(size, {}).get(metric)
+            if base is None or base <= 0:
+                continue
+            higher_is_better = metric in HIGHER_IS_BETTER
+            change = (base - value) / base if higher_is_better else (value - base) / base
+            unit = metric.rsplit("_", 1)[-1]
+            if abs(value - base) < NOISE_FLOOR.get(unit, 0):
+                continue
+            if change > thresholds.get(metric, default_threshold):
+                regressions.append((size, metric, base, value, change))
+    return regressions
+
+def parseThresholds(values):
+    """Parse 'metric=fraction' arguments into a dictionary."""
+    thresholds = {}
+    for value in values:
+        metric, _, fraction = value.partition("=")
+        thresholds[metric] = float(fraction)
+    return thresholds
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Image Manager's "
+        "MainWindow on the offscreen platform with generated libraries.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma-separated library sizes (default: %(default)s)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(),
+        "image_manager_benchmarks"), help="where the generated libraries are kept "
+        "(default: %(default)s)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE",
+        help="compare the results with a JSON file written by --output")
+    parser.add_argument("--threshold", action="append", default=[], metavar="METRIC=FRACTION",
+        help="allowed regression of a metric, e.g. warm_startup_ms=0.5")
+    parser.add_argument("--default-threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="allowed regression of the other metrics (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+        help="processes used to generate images (default: %(default)s)")
+    # Used by the child processes
+    parser.add_argument("--scenario", choices=("cold", "warm", "import"), help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.scenario is not None:
+        runScenario(arguments.scenario, arguments.source)
+        return 0
+
+    results = {"environment": environmentInfo(), "results": {}}
+    for count in (int(size) for size in arguments.sizes.split(",")):
+        results["results"][str(count)] = benchmarkSize(count, arguments.work_dir,
+            arguments.processes)
+    print(json.dumps(results, indent=2))
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compareResults(results, baseline, parseThresholds(arguments.threshold),
+            arguments.default_threshold)
+        for size, metric, base, value, change in regressions:
+            print(f"Regression: {metric} with {int(size):,} images: {base:,.1f} -> "
+                f"{value:,.1f} ({change:+.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against the baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
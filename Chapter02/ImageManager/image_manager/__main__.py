@@ -0,0 +1,13 @@
+"""Image Manager GUI, Part 2
+Runs the command line interface with 'python -m image_manager'
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+import sys
+from image_manager.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""Image Manager GUI, Part 2
+Command line interface that prepares a library without opening the GUI
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, sys, argparse, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PyQt6.QtCore import QSettings, QSize
+from PyQt6.QtGui import QGuiApplication
+# Import relative modules
+from .library.catalog import ImageCatalog
+from .library.thumbnail_cache import ThumbnailCache, DEFAULT_BUDGET_MB
+from .library.hash_index import ContentHashIndex
+from .library.similarity import PerceptualHashStore, perceptualHash
+from .library.storage import (COPY, IMPORT_MODES, IMAGE_EXTENSIONS, isSharded,
+    createShards, migrateLibrary)
+from .library.exif import extractBatch, captureTime
+from .workers.thumbnails import thumbnailPyramid, THUMBNAIL_SIZE
+
+CHUNK_SIZE = 32 # Number of files sent to a worker process at once
+
+def availableCores():
+    """Return the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def thumbnailBatch(entries):
+    """Decode the thumbnail pyramids of (path, size, mtime) entries and compute
+    their perceptual hashes. Runs in a worker process and returns a list of
+    (entry, encoded levels, width, height, hash) tuples; the levels are None
+    if the image can't be read."""
+    results = []
+    for entry in entries:
+        pyramid, original_size = thumbnailPyramid(entry[0])
+        if not pyramid:
+            results.append((entry, None, 0, 0, None))
+        else:
+            results.append((entry, {level: ThumbnailCache.encodeImage(image)
+                for level, image in pyramid.items()}, original_size.width(),
+                original_size.height(), perceptualHash(pyramid[THUMBNAIL_SIZE])))
+    return results
+
+def chunks(items, size=CHUNK_SIZE):
+    """Split 'items' into lists of at most 'size' items."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+class LibraryTool:
+
+    # The same settings and data files as the GUI
+    settings = QSettings("Custom GUIs", "Image Manager GUI")
+
+    def __init__(self, library, processes, app=None):
+        """Runs the batch commands on the library directory. CPU bound work
+        runs on a pool of 'processes' worker processes, and the results are
+        written to the catalog and thumbnail cache that the GUI reads. 'app'
+        is the QGuiApplication that QImage and QPainter need, kept for as
+        long as the tool."""
+        self.app = app
+        self.library = os.path.abspath(library)
+        self.processes = processes
+        self.catalog = ImageCatalog()
+        self._executor = None
+
+    def executor(self):
+        """Return the pool of worker processes, starting it if needed."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def close(self):
+        """End the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def libraryEntries(self):
+        """Return the (path, size, mtime) entries of the files in the library
+        directory and its subdirectories, as the GUI's scanner reports them."""
+        entries = []
+        directories = [self.library]
+        while directories:
+            with os.scandir(directories.pop()) as directory_entries:
+                for entry in directory_entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            entries.append((os.path.abspath(entry.path), stat.st_size,
+                                stat.st_mtime_ns))
+                    except OSError:
+                        continue
+        return entries
+
+    def prepareLibrary(self):
+        """Create the library directory, or move the files of a library from
+        an older version into subdirectories as the GUI does."""
+        if not os.path.isdir(self.library):
+            os.makedirs(self.library)
+            createShards(self.library)
+        elif not isSharded(self.library):
+            budget_mb = self.settings.value("thumbnails/cache_budget_mb", DEFAULT_BUDGET_MB, type=int)
+            moved = migrateLibrary(self.library, self.catalog,
+                ThumbnailCache(budget_bytes=budget_mb * 1024 * 1024),
+                lambda done, total: print(f"\rMoving files into subdirectories: {done:,} "
+                    f"of {total:,}", end="", flush=True))
+            print(f"\rMoved {moved:,} files into subdirectories")
+
+    def scan(self, arguments):
+        """Bring the catalog up to date with the library directory and read
+        the metadata of new and changed files."""
+        self.prepareLibrary()
+        entries = self.libraryEntries()
+        records = {record[0]: record for record in self.catalog.loadDirectory(self.library)}
+        changed = [entry for entry in entries if records.get(entry[0], (None,) * 3)[:3] != entry]
+        missing = set(records) - {entry[0] for entry in entries}
+        self.catalog.updateFiles(changed)
+        self.catalog.removeFiles(missing)
+        print(f"Scanned {len(entries):,} files: {len(changed):,} new or changed, "
+            f"{len(missing):,} removed")
+
+        # Changed files lost their metadata, so only read the rows without it
+        unread = {record[0] for record in self.catalog.loadDirectory(self.library)
+            if not record[7]}
+        pending = [entry for entry in entries if entry[0] in unread]
+        sizes = {entry[0]: entry for entry in pending}
+        found = 0
+        for results in self.executor().map(extractBatch, chunks([entry[0] for entry in pending])):
+            self.catalog.setMetadata([sizes[image_path] + (captureTime(metadata), metadata)
+                for image_path, metadata in results])
+            found += sum(1 for _, metadata in results if metadata)
+        print(f"Read the metadata of {len(pending):,} files, {found:,} with EXIF or XMP fields")
+        return 0
+
+    def thumbnail(self, arguments):
+        """Store the thumbnails, dimensions and perceptual hashes of the files
+        that are missing any of them."""
+        self.scan(arguments)
+        budget_mb = self.settings.value("thumbnails/cache_budget_mb", DEFAULT_BUDGET_MB, type=int)
+        cache = ThumbnailCache(budget_bytes=budget_mb * 1024 * 1024)
+        store = PerceptualHashStore(self.catalog)
+        records = self.catalog.loadDirectory(self.library)
+        keys = {record[0]: ThumbnailCache.cacheKey(*record[:3]) for record in records}
+        cached = cache.cachedKeys(keys.values()) if not arguments.force else set()
+        pending = [record[:3] for record in records if arguments.force
+            or keys[record[0]] not in cached or record[3] is None or record[6] is None]
+
+        done = failed = 0
+        for results in self.executor().map(thumbnailBatch, chunks(pending)):
+            dimensions, hashes = [], []
+            for entry, levels, width, height, image_hash in results:
+                if levels is None:
+                    failed += 1
+                    continue
+                cache.putEncoded(*entry, levels, QSize(width, height))
+                dimensions.append(entry + (width, height))
+                hashes.append(entry + (image_hash,))
+            self.catalog.setDimensions(dimensions)
+            store.store(hashes)
+            done += len(results)
+            print(f"\rThumbnails: {done:,} of {len(pending):,}", end="", flush=True)
+        print(f"\rStored {len(pending) - failed:,} thumbnails, {failed:,} files couldn't "
+            f"be read, {len(records) - len(pending):,} were already cached")
+        cache.flush()
+        return 0
+
+    def dedup(self, arguments):
+        """List the files of the library that have identical contents."""
+        self.scan(arguments)
+        hash_index = ContentHashIndex(self.catalog, self.processes)
+        groups = hash_index.findLibraryDuplicates()
+        hash_index.close()
+        library = os.path.join(self.library, "")
+        groups = [paths for paths in groups if all(path.startswith(library) for path in paths)]
+        for paths in groups:
+            print(paths[0])
+            for path in paths[1:]:
+                print(f"    same as {path}")
+        print(f"{len(groups):,} groups of identical files, "
+            f"{sum(len(paths) - 1 for paths in groups):,} copies that could be removed")
+        return 0
+
+    def verify(self, arguments):
+        """Check that the catalog and caches match the files on disk. Returns
+        1 if files are missing or changed, 0 otherwise."""
+        entries = {entry[0]: entry for entry in self.libraryEntries()}
+        records = self.catalog.loadDirectory(self.library)
+        budget_mb = self.settings.value("thumbnails/cache_budget_mb", DEFAULT_BUDGET_MB, type=int)
+        cached = ThumbnailCache(budget_bytes=budget_mb * 1024 * 1024).cachedKeys(
+            ThumbnailCache.cacheKey(*record[:3]) for record in records)
+        missing = [record[0] for record in records if record[0] not in entries]
+        changed = [record[0] for record in records
+            if record[0] in entries and entries[record[0]] != tuple(record[:3])]
+        uncatalogued = set(entries) - {record[0] for record in records}
+        counts = {"thumbnails": sum(ThumbnailCache.cacheKey(*record[:3]) in cached
+            for record in records), "dimensions": sum(record[3] is not None for record in records),
+            "perceptual hashes": sum(record[6] is not None for record in records),
+            "metadata": sum(bool(record[7]) for record in records)}
+
+        for image_path in missing:
+            print(f"Missing: {image_path}")
+        for image_path in changed:
+            print(f"Changed: {image_path}")
+        for image_path in sorted(uncatalogued):
+            print(f"Not in the catalog: {image_path}")
+        print(f"{len(records):,} files in the catalog")
+        for name, count in counts.items():
+            print(f"    {count:,} with {name}")
+        if arguments.fix and (missing or changed or uncatalogued):
+            self.catalog.removeFiles(missing)
+            self.catalog.updateFiles([entries[image_path] for image_path in changed]
+                + [entries[image_path] for image_path in uncatalogued])
+            print("Updated the catalog")
+            return 0
+        return 1 if missing or changed or uncatalogued else 0
+
+    def importFiles(self, arguments):
+        """Import files and directories into the library with the GUI's
+        import engine, skipping files that are already in the library."""
+        from .workers.importer import ImportEngine # Needs the event loop created in main()
+        sources = []
+        for source in arguments.sources:
+            if os.path.isdir(source):
+                for directory, _, file_names in os.walk(source):
+                    sources.extend(os.path.join(directory, file_name) for file_name in
+                        sorted(file_names) if os.path.splitext(file_name)[1].lower()
+                        in IMAGE_EXTENSIONS)
+            else:
+                sources.append(source)
+        if not sources:
+            print("No images to import")
+            return 0
+        self.prepareLibrary()
+
+        hash_index = ContentHashIndex(self.catalog)
+        engine = ImportEngine(None, self.processes, hash_index)
+        failures = []
+        engine.import_failed.connect(lambda source, error: failures.append((source, error)))
+        engine.state_changed.connect(lambda: print(
+            "\rImported {files_done:,} of {files_total:,} files".format(**engine.progress()),
+            end="", flush=True))
+        engine.finished.connect(lambda duplicates: (setattr(engine, "result", duplicates),
+            QGuiApplication.quit()))
+        engine.addFiles(sources, self.library, arguments.delete, arguments.mode)
+        QGuiApplication.exec()
+        hash_index.close()
+
+        print()
+        for source, original in engine.result:
+            print(f"Duplicate: {source} (same as {os.path.basename(original)})")
+        for source, error in failures:
+            print(f"Failed: {source}: {error}")
+        imported = sum(engine.modes_used.values())
+        print(f"Imported {imported:,} files, skipped {len(engine.result):,} duplicates, "
+            f"{len(failures):,} failed")
+        return 1 if failures else 0
+
+def parseArguments(argv):
+    """Return the parsed command line."""
+    parser = argparse.ArgumentParser(prog="python -m image_manager",
+        description="Prepare an Image Manager library without opening the GUI. "
+        "Run it from the directory the GUI is started from.")
+    parser.add_argument("--library", default="Images",
+        help="the library directory (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=availableCores(),
+        help="number of worker processes (default: the available cores, %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import files or directories")
+    import_parser.add_argument("sources", nargs="+")
+    import_parser.add_argument("--mode", choices=list(IMPORT_MODES), default=COPY)
+    import_parser.add_argument("--delete", action="store_true",
+        help="delete the originals after copying them")
+    commands.add_parser("scan", help="update the catalog and read the metadata of new files")
+    thumbnail_parser = commands.add_parser("thumbnail",
+        help="store thumbnails, dimensions and perceptual hashes")
+    thumbnail_parser.add_argument("--force", action="store_true",
+        help="decode every image, even if it is cached")
+    commands.add_parser("dedup", help="list files with identical contents")
+    verify_parser = commands.add_parser("verify",
+        help="check the catalog and caches against the files")
+    verify_parser.add_argument("--fix", action="store_true",
+        help="update the catalog to match the files")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run a command and return the exit status."""
+    arguments = parseArguments(sys.argv[1:] if argv is None else argv)
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    tool = LibraryTool(arguments.library, max(1, arguments.processes),
+        QGuiApplication(sys.argv[:1]))
+    command = {"import": tool.importFiles, "scan": tool.scan, "thumbnail": tool.thumbnail,
+        "dedup": tool.dedup, "verify": tool.verify}[arguments.command]
+    try:
+        return command(arguments)
+    finally:
+        tool.close()
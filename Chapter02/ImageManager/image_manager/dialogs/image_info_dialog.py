@@ -7,13 +7,16 @@ Created by: Joshua Willman
 """
 
 # Import necessary modules
+import os
 from PyQt6.QtWidgets import (QLabel, QGroupBox, QDialog, 
     QDialogButtonBox, QVBoxLayout)
+from PyQt6.QtCore import QDateTime, QFileInfo
 
 class ImageInfoDialog(QDialog):
 
     def __init__(self, parent, selected_image): 
-        """Modeless dialog that displays file information for images"""
+        """Modeless dialog that displays file information for images. 
+        'selected_image' is the image's record from the catalog"""
         super().__init__(parent) 
         metadata = self.collectImageMetaData(selected_image)
 
@@ -25,12 +28,14 @@ class ImageInfoDialog(QDialog):
         image_type = QLabel(f"Type: {metadata['extension']}")
         image_size = QLabel(f"Size: {metadata['size']:,} bytes")
         image_location = QLabel(f"Location: {metadata['file_path']}")
+        image_dimensions = QLabel(f"Dimensions: {metadata['dimensions']}")
         date_modified = QLabel(f"""Modified: {metadata['last_modified'].toString('MMMM d, yyyy h:mm:ss ap')}""")
 
         # Organize widgets that display metadata using containers/layouts 
         general_v_box = QVBoxLayout()
         general_v_box.addWidget(image_type)
         general_v_box.addWidget(image_size)
+        general_v_box.addWidget(image_dimensions)
         general_v_box.addWidget(image_location)
 
         general_group_box = QGroupBox("General:")
@@ -42,6 +47,16 @@ class ImageInfoDialog(QDialog):
         extra_group_box = QGroupBox("Extra Info:")
         extra_group_box.setLayout(extra_v_box)
 
+        # Fields read from the image's EXIF metadata, if it has any
+        camera_v_box = QVBoxLayout()
+        for label, value in metadata["camera_fields"]:
+            camera_v_box.addWidget(QLabel(f"{label}: {value}"))
+        if not metadata["camera_fields"]:
+            camera_v_box.addWidget(QLabel("No camera information"))
+
+        camera_group_box = QGroupBox("Camera:")
+        camera_group_box.setLayout(camera_v_box)
+
         self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok)
         self.button_box.accepted.connect(self.accept)
 
@@ -51,20 +66,46 @@ class ImageInfoDialog(QDialog):
         dialog_v_box.addWidget(date_created)    
         dialog_v_box.addWidget(general_group_box)
         dialog_v_box.addWidget(extra_group_box)
+        dialog_v_box.addWidget(camera_group_box)
         dialog_v_box.addStretch(1)
         dialog_v_box.addWidget(self.button_box)
         self.setLayout(dialog_v_box)
     
     def collectImageMetaData(self, image_info):
-        """Collect the metadata for the selected image."""
-        base_name = image_info.baseName() # Without extension
-        file_name = image_info.fileName() # With extension
-        date_created = image_info.birthTime() # Returns QDateTime
+        """Collect the metadata for the selected image. Everything except the 
+        creation time, which isn't stored, comes from the catalog, including 
+        the EXIF fields that were extracted in the background."""
+        file_name = os.path.basename(image_info["path"]) # With extension
+        base_name = file_name.split(".", 1)[0] # Without extension
+        date_created = QFileInfo(image_info["path"]).birthTime() # Returns QDateTime
+
+        extension = os.path.splitext(file_name)[1][1:]
+        size = image_info["size"] # In bytes
+        file_path = os.path.dirname(image_info["path"]) # Doesn't include file name
+        last_modified = QDateTime.fromMSecsSinceEpoch(image_info["mtime"] // 1000000)
+        dimensions = "Unknown"
+        if image_info["width"]:
+            dimensions = f"{image_info['width']} x {image_info['height']} pixels"
 
-        extension = image_info.suffix()
-        size = image_info.size() # In bytes
-        file_path = image_info.absolutePath() # Doesn't include file name
-        last_modified = image_info.lastModified() # Returns QDateTime 
+        exif = image_info["exif"]
+        camera_fields = []
+        if "taken" in exif:
+            taken = QDateTime.fromString(exif["taken"][:19], "yyyy:MM:dd HH:mm:ss")
+            camera_fields.append(("Taken", taken.toString("MMMM d, yyyy h:mm:ss ap") 
+                if taken.isValid() else exif["taken"]))
+        if "camera" in exif:
+            camera_fields.append(("Camera", exif["camera"]))
+        if "lens" in exif:
+            camera_fields.append(("Lens", exif["lens"]))
+        settings = [f"{exif['exposure']} s" if "exposure" in exif else None,
+            f"f/{exif['aperture']:g}" if "aperture" in exif else None,
+            f"ISO {exif['iso']}" if "iso" in exif else None,
+            f"{exif['focal_length']:g} mm" if "focal_length" in exif else None]
+        if any(settings):
+            camera_fields.append(("Exposure", ", ".join(filter(None, settings))))
+        if "latitude" in exif and "longitude" in exif:
+            camera_fields.append(("Location", 
+                f"{exif['latitude']:.5f}, {exif['longitude']:.5f}"))
 
         image_metadata = {
             "base_name": base_name,
@@ -73,5 +114,7 @@ class ImageInfoDialog(QDialog):
             "extension": extension,
             "size": size,
             "file_path": file_path,
-            "last_modified": last_modified}   
+            "last_modified": last_modified,
+            "dimensions": dimensions,
+            "camera_fields": camera_fields}   
         return image_metadata
@@ -7,30 +7,156 @@ Created by: Joshua Willman
 """
 
 # Import necessary modules
-from PyQt6.QtWidgets import (QLabel, QCheckBox, QGroupBox, 
-    QDialog, QDialogButtonBox, QVBoxLayout)
+import os
+from PyQt6.QtWidgets import (QLabel, QCheckBox, QGroupBox, QSpinBox, QComboBox,
+    QDialog, QDialogButtonBox, QVBoxLayout, QHBoxLayout, QFormLayout, QPushButton,
+    QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog, QMessageBox)
+from PyQt6.QtCore import Qt
+# Import relative modules
+from ..library.storage import IMPORT_MODES, SYMLINK
 
 class PreferencesDialog(QDialog):
 
-    def __init__(self, parent, directory, is_checked):
-        """Simple modal Preferences dialog"""
+    def __init__(self, parent, library_roots, is_checked, options):
+        """Simple modal Preferences dialog. 'library_roots' maps the library's
+        directories to a tuple of their number of images and the duration 
+        of their last scan."""
         super().__init__(parent)
         self.setWindowTitle("Preferences")
         self.setModal(True)
-        
-        image_dir_label = QLabel(f"<b>Images Location:</b> {directory.absolutePath()}")
+
+        # The library can span several directories, e.g. on different disks.
+        # Images are imported into the first one, the Images Location
+        self.roots_table = QTableWidget(0, 3)
+        self.roots_table.setHorizontalHeaderLabels(("Folder", "Images", "Last Scan"))
+        self.roots_table.horizontalHeader().setSectionResizeMode(0, 
+            QHeaderView.ResizeMode.Stretch)
+        self.roots_table.verticalHeader().hide()
+        self.roots_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.roots_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.roots_table.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
+        self.roots_table.setMinimumWidth(480)
+        self.roots_table.setMinimumHeight(130)
+        for root, (count, scan_ms) in library_roots.items():
+            self.addRootRow(root, f"{count:,}", "Not found" if not os.path.isdir(root)
+                else "Scanning" if scan_ms is None else f"{scan_ms:,} ms")
+        self.roots_table.itemSelectionChanged.connect(self.updateRootButtons)
+
+        self.add_root_button = QPushButton("Add...", clicked=self.addRoot)
+        self.remove_root_button = QPushButton("Remove", clicked=self.removeRoot)
+        self.remove_root_button.setToolTip("""<p>Remove the selected folder from the 
+            library. Its files are kept. The Images Location can only be removed 
+            after choosing another folder with Import Here.</p>""")
+        self.import_root_button = QPushButton("Import Here", clicked=self.makeImportRoot)
+        self.import_root_button.setToolTip("""<p>Import images into the selected folder. 
+            They are kept in subfolders, and images already in the folder are moved 
+            into them.</p>""")
+        self.updateRootButtons()
+
+        roots_buttons_h_box = QHBoxLayout()
+        for button in (self.add_root_button, self.remove_root_button, self.import_root_button):
+            roots_buttons_h_box.addWidget(button)
+        roots_buttons_h_box.addStretch()
+
+        roots_v_box = QVBoxLayout()
+        roots_v_box.addWidget(self.roots_table)
+        roots_v_box.addLayout(roots_buttons_h_box)
+        roots_v_box.addWidget(QLabel("Images are imported into the first folder, "
+            "the <b>Images Location</b>."))
+
+        roots_group_box = QGroupBox("Library Folders:")
+        roots_group_box.setLayout(roots_v_box)
 
         self.delete_images_checkbox = QCheckBox("Delete Original Images")
         self.delete_images_checkbox.setToolTip("""<p>If checked, images that are copied to the 
             <b>Images Location</b> are also deleted from their original location.</p>""")
         self.delete_images_checkbox.setChecked(is_checked)
 
+        # Images can be referenced instead of copied, which avoids duplicating 
+        # the data when the originals are on the same volume
+        self.import_mode_combo = QComboBox()
+        for mode, description in IMPORT_MODES.items():
+            self.import_mode_combo.addItem(description, mode)
+        self.import_mode_combo.setToolTip("""<p>How imported images are placed in the 
+            <b>Images Location</b>. Symbolic links point at the originals, so the originals 
+            are never deleted in this mode.</p>""")
+        self.import_mode_combo.currentIndexChanged.connect(self.updateDeleteCheckbox)
+        self.import_mode_combo.setCurrentIndex(
+            max(0, self.import_mode_combo.findData(options["import_mode"])))
+        self.updateDeleteCheckbox()
+
         handling_v_box = QVBoxLayout()
         handling_v_box.addWidget(self.delete_images_checkbox)
+        handling_v_box.addWidget(QLabel("Import Mode:"))
+        handling_v_box.addWidget(self.import_mode_combo)
 
         handling_group_box = QGroupBox("Image Handling:")
         handling_group_box.setLayout(handling_v_box)
 
+        # Options for the worker pool that decodes thumbnails. A value of 0 
+        # lets the application pick a value based upon the number of CPU cores
+        self.pool_size_spinbox = QSpinBox()
+        self.pool_size_spinbox.setRange(0, 64)
+        self.pool_size_spinbox.setSpecialValueText("Automatic")
+        self.pool_size_spinbox.setValue(options["pool_size"])
+
+        self.queue_depth_spinbox = QSpinBox()
+        self.queue_depth_spinbox.setRange(0, 1024)
+        self.queue_depth_spinbox.setSpecialValueText("Automatic")
+        self.queue_depth_spinbox.setToolTip("""<p>The number of thumbnails handed to the 
+            worker threads at once. Smaller values let visible images jump ahead sooner.</p>""")
+        self.queue_depth_spinbox.setValue(options["queue_depth"])
+
+        self.cache_budget_spinbox = QSpinBox()
+        self.cache_budget_spinbox.setRange(16, 65536)
+        self.cache_budget_spinbox.setSingleStep(64)
+        self.cache_budget_spinbox.setSuffix(" MB")
+        self.cache_budget_spinbox.setToolTip("""<p>The maximum disk space used by the 
+            thumbnail cache. The least recently used thumbnails are removed first.</p>""")
+        self.cache_budget_spinbox.setValue(options["cache_budget_mb"])
+
+        self.import_workers_spinbox = QSpinBox()
+        self.import_workers_spinbox.setRange(1, 32)
+        self.import_workers_spinbox.setToolTip("""<p>The number of images that are 
+            copied at the same time when importing.</p>""")
+        self.import_workers_spinbox.setValue(options["import_workers"])
+
+        self.prefetch_depth_spinbox = QSpinBox()
+        self.prefetch_depth_spinbox.setRange(0, 16)
+        self.prefetch_depth_spinbox.setSpecialValueText("Off")
+        self.prefetch_depth_spinbox.setToolTip("""<p>The number of images before and after 
+            the selected image that are decoded in advance for the image view.</p>""")
+        self.prefetch_depth_spinbox.setValue(options["prefetch_depth"])
+
+        self.preview_budget_spinbox = QSpinBox()
+        self.preview_budget_spinbox.setRange(16, 4096)
+        self.preview_budget_spinbox.setSingleStep(16)
+        self.preview_budget_spinbox.setSuffix(" MB")
+        self.preview_budget_spinbox.setToolTip("""<p>The maximum memory used by decoded 
+            images in the image view. The least recently used images are removed first.</p>""")
+        self.preview_budget_spinbox.setValue(options["preview_budget_mb"])
+
+        self.decoration_budget_spinbox = QSpinBox()
+        self.decoration_budget_spinbox.setRange(16, 4096)
+        self.decoration_budget_spinbox.setSingleStep(16)
+        self.decoration_budget_spinbox.setSuffix(" MB")
+        self.decoration_budget_spinbox.setToolTip("""<p>The maximum memory used by the 
+            thumbnails in the list. Thumbnails of images that are far from the visible 
+            ones are removed first and loaded again when they are scrolled to.</p>""")
+        self.decoration_budget_spinbox.setValue(options["decoration_budget_mb"])
+
+        performance_form = QFormLayout()
+        performance_form.addRow("Thumbnail Threads:", self.pool_size_spinbox)
+        performance_form.addRow("Thumbnail Queue Depth:", self.queue_depth_spinbox)
+        performance_form.addRow("Thumbnail Cache Size:", self.cache_budget_spinbox)
+        performance_form.addRow("Thumbnail Memory:", self.decoration_budget_spinbox)
+        performance_form.addRow("Import Threads:", self.import_workers_spinbox)
+        performance_form.addRow("Image View Prefetch:", self.prefetch_depth_spinbox)
+        performance_form.addRow("Image View Memory:", self.preview_budget_spinbox)
+
+        performance_group_box = QGroupBox("Performance:")
+        performance_group_box.setLayout(performance_form)
+
         self.button_box = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Cancel)
         self.button_box.accepted.connect(self.accept)
@@ -38,8 +164,76 @@ class PreferencesDialog(QDialog):
 
         # Add a layout to the dialog box
         dialog_v_box = QVBoxLayout()
-        dialog_v_box.addWidget(image_dir_label)
+        dialog_v_box.addWidget(roots_group_box)
         dialog_v_box.addWidget(handling_group_box)
+        dialog_v_box.addWidget(performance_group_box)
         dialog_v_box.addStretch(1)
         dialog_v_box.addWidget(self.button_box)
-        self.setLayout(dialog_v_box)
\ No newline at end of file
+        self.setLayout(dialog_v_box)
+
+    def updateDeleteCheckbox(self):
+        """Disable deleting originals when images are imported as symbolic links."""
+        self.delete_images_checkbox.setEnabled(
+            self.import_mode_combo.currentData() != SYMLINK)
+
+    def addRootRow(self, root, count="", scan_time=""):
+        """Append a row that lists the library folder 'root'."""
+        row = self.roots_table.rowCount()
+        self.roots_table.insertRow(row)
+        self.roots_table.setItem(row, 0, QTableWidgetItem(root))
+        for column, text in ((1, count), (2, scan_time)):
+            item = QTableWidgetItem(text)
+            item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+            self.roots_table.setItem(row, column, item)
+
+    def libraryRoots(self):
+        """Return the list of library folders, the Images Location first."""
+        return [self.roots_table.item(row, 0).text() for row in range(self.roots_table.rowCount())]
+
+    def addRoot(self):
+        """Add a folder the user selects to the library. Folders inside a 
+        library folder, or that contain one, would list images twice."""
+        root = QFileDialog.getExistingDirectory(self, "Add Library Folder")
+        if not root:
+            return
+        root = os.path.abspath(root)
+        for library_root in self.libraryRoots():
+            try:
+                overlaps = os.path.commonpath([root, library_root]) in (root, library_root)
+            except ValueError:
+                overlaps = False # Paths on different drives
+            if overlaps:
+                QMessageBox.warning(self, "Folder Already in Library",
+                    f"<p>{root} overlaps the library folder {library_root}.</p>")
+                return
+        self.addRootRow(root)
+
+    def removeRoot(self):
+        """Remove the selected folder from the library. Its files are kept.
+        The Images Location, in row 0, is never removed: the next folder
+        would take its place and have its images moved into subfolders
+        without the user choosing it with Import Here."""
+        row = self.roots_table.currentRow()
+        if row <= 0:
+            return
+        self.roots_table.removeRow(row)
+        self.updateRootButtons()
+
+    def makeImportRoot(self):
+        """Move the selected folder to the top of the list, which makes it
+        the Images Location."""
+        row = self.roots_table.currentRow()
+        items = [self.roots_table.takeItem(row, column) for column in range(3)]
+        self.roots_table.removeRow(row)
+        self.roots_table.insertRow(0)
+        for column, item in enumerate(items):
+            self.roots_table.setItem(0, column, item)
+        self.roots_table.selectRow(0)
+
+    def updateRootButtons(self):
+        """Enable the buttons that change the selected folder. The Images 
+        Location, in row 0, can't be removed, so the library always has a 
+        folder to import images into."""
+        row = self.roots_table.currentRow() if self.roots_table.selectedItems() else -1
+        self.remove_root_button.setEnabled(row > 0)
+        self.import_root_button.setEnabled(row > 0)
@@ -0,0 +1,56 @@
+"""Image Manager GUI, Part 2
+Custom modeless dialog for displaying similar images
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os
+from PyQt6.QtWidgets import (QLabel, QDialog, QListWidget, QListWidgetItem,
+    QListView, QDialogButtonBox, QVBoxLayout)
+from PyQt6.QtCore import Qt, QSize, pyqtSignal
+
+class SimilarImagesDialog(QDialog):
+
+    image_chosen = pyqtSignal(str) # Path of the image that was double-clicked
+
+    def __init__(self, parent, model, image_path, results, elapsed_ms):
+        """Modeless dialog that lists the images closest to 'image_path'.
+        'results' is a list of (distance, path) tuples sorted by distance."""
+        super().__init__(parent)
+        self.setWindowTitle(f"Images Similar to {os.path.basename(image_path)}")
+        self.resize(560, 420)
+
+        summary_label = QLabel(f"Found {len(results):,} similar images in {elapsed_ms:.1f} ms. "
+            "A distance of 0 means the images look the same.")
+        summary_label.setWordWrap(True)
+
+        self.results_list = QListWidget()
+        self.results_list.setViewMode(QListView.ViewMode.IconMode)
+        self.results_list.setResizeMode(QListView.ResizeMode.Adjust)
+        self.results_list.setIconSize(QSize(80, 80))
+        self.results_list.setGridSize(QSize(110, 120))
+        self.results_list.setTextElideMode(Qt.TextElideMode.ElideMiddle)
+        for distance, result_path in results:
+            row = model.rowForPath(result_path)
+            if row == -1:
+                continue
+            # Reuse the thumbnails that the library model has already loaded
+            icon = model.index(row).data(Qt.ItemDataRole.DecorationRole)
+            item = QListWidgetItem(icon, f"{model.index(row).data()}\nDistance: {distance}")
+            item.setData(Qt.ItemDataRole.UserRole, result_path)
+            self.results_list.addItem(item)
+        self.results_list.itemDoubleClicked.connect(
+            lambda item: self.image_chosen.emit(item.data(Qt.ItemDataRole.UserRole)))
+
+        self.button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        self.button_box.rejected.connect(self.reject)
+
+        # Add a layout to the dialog box
+        dialog_v_box = QVBoxLayout()
+        dialog_v_box.addWidget(summary_label)
+        dialog_v_box.addWidget(self.results_list)
+        dialog_v_box.addWidget(self.button_box)
+        self.setLayout(dialog_v_box)
@@ -0,0 +1,176 @@
+"""Image Manager GUI, Part 2
+SQLite catalog of the images in the library
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, json, sqlite3, threading
+# Import relative modules
+from .thumbnail_cache import dataLocation, ThumbnailCache
+from .search import metadataCondition
+
+CATALOG_VERSION = 1
+
+# Columns that describe the contents of a file. They are cleared when the
+# file's size or modification time changes
+DERIVED_COLUMNS = ("width", "height", "prefix_hash", "full_hash", "phash",
+    "thumbnail_key", "taken", "exif")
+
+class ImageCatalog:
+
+    def __init__(self, location=None):
+        """Stores a row per image with its size and modification time and the
+        information derived from its contents: dimensions, content hashes,
+        the perceptual hash, the key of its cached thumbnail and EXIF fields.
+        The database uses write-ahead logging, so the worker threads that
+        fill in these columns don't block the GUI thread's reads. Each
+        thread opens its own connection."""
+        if location is None:
+            location = os.path.join(dataLocation(), "catalog.sqlite3")
+        self.location = location
+        self._local = threading.local()
+
+        connection = self.connection()
+        connection.execute("""CREATE TABLE IF NOT EXISTS images (
+            path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL,
+            width INTEGER, height INTEGER, prefix_hash TEXT, full_hash TEXT,
+            phash INTEGER, thumbnail_key TEXT, taken INTEGER, exif TEXT)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS images_size ON images (size)")
+        connection.commit()
+        if connection.execute("PRAGMA user_version").fetchone()[0] < CATALOG_VERSION:
+            self._importOldIndexes(connection)
+            connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    def connection(self):
+        """Return the connection that belongs to the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _importOldIndexes(self, connection):
+        """Copy the content hashes and perceptual hashes from the separate
+        databases used before the catalog existed."""
+        content_index = os.path.join(dataLocation(), "content_index.sqlite3")
+        if os.path.exists(content_index):
+            connection.execute("ATTACH DATABASE ? AS old", (content_index,))
+            with connection:
+                connection.execute("""INSERT OR IGNORE INTO images
+                    (path, size, mtime, prefix_hash, full_hash)
+                    SELECT path, size, mtime, prefix_hash, full_hash FROM old.files""")
+            connection.execute("DETACH DATABASE old")
+        perceptual_hashes = os.path.join(dataLocation(), "perceptual_hashes.sqlite3")
+        if os.path.exists(perceptual_hashes):
+            connection.execute("ATTACH DATABASE ? AS old", (perceptual_hashes,))
+            with connection:
+                connection.execute("""UPDATE images SET phash = (SELECT phash FROM old.hashes
+                    WHERE old.hashes.path = images.path AND old.hashes.size = images.size
+                    AND old.hashes.mtime = images.mtime)""")
+            connection.execute("DETACH DATABASE old")
+
+    def loadDirectory(self, directory):
+        """Return a list of (path, size, mtime, width, height, taken, phash,
+        has_metadata) tuples for the images inside 'directory' and its 
+        subdirectories. The paths of a directory form a range of the primary
+        key, so this is a single indexed query."""
+        directory, upper = self._pathRange(directory)
+        return self.connection().execute("""SELECT path, size, mtime, width, height, taken, phash,
+            exif IS NOT NULL FROM images WHERE path >= ? AND path < ?""",
+            (directory, upper)).fetchall()
+
+    def _pathRange(self, directory):
+        """Return the lower and upper bounds of the paths inside 'directory'."""
+        directory = os.path.join(os.path.abspath(directory), "")
+        return directory, directory[:-1] + chr(ord(directory[-1]) + 1)
+
+    def record(self, image_path):
+        """Return a dictionary of the stored columns of 'image_path', or None.
+        The EXIF fields are decoded into a dictionary."""
+        cursor = self.connection().execute("SELECT * FROM images WHERE path = ?",
+            (image_path,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        record = {column[0]: value for column, value in zip(cursor.description, row)}
+        record["exif"] = json.loads(record["exif"]) if record["exif"] else {}
+        return record
+
+    def updateFiles(self, entries, hashes=None):
+        """Add or update (path, size, mtime) entries. The derived columns are
+        kept unless the size or modification time has changed. 'hashes' can
+        map paths to known (prefix_hash, full_hash) tuples."""
+        hashes = hashes or {}
+        unchanged = "size = excluded.size AND mtime = excluded.mtime"
+        kept = ", ".join(f"{column} = CASE WHEN {unchanged} THEN {column} ELSE NULL END"
+            for column in DERIVED_COLUMNS if not column.endswith("_hash"))
+        connection = self.connection()
+        with connection:
+            connection.executemany(f"""INSERT INTO images (path, size, mtime, prefix_hash, full_hash)
+                VALUES (?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET
+                prefix_hash = CASE WHEN {unchanged}
+                    THEN COALESCE(excluded.prefix_hash, prefix_hash) ELSE excluded.prefix_hash END,
+                full_hash = CASE WHEN {unchanged}
+                    THEN COALESCE(excluded.full_hash, full_hash) ELSE excluded.full_hash END,
+                {kept}, size = excluded.size, mtime = excluded.mtime""",
+                [(path, size, mtime) + hashes.get(path, (None, None))
+                    for path, size, mtime in entries])
+
+    def removeFiles(self, paths):
+        """Remove files that are no longer in the library."""
+        connection = self.connection()
+        with connection:
+            connection.executemany("DELETE FROM images WHERE path = ?",
+                [(path,) for path in paths])
+
+    def movePaths(self, moves):
+        """Rename the rows of (old path, new path, size, mtime) tuples for 
+        files that were moved within the library."""
+        connection = self.connection()
+        with connection:
+            connection.executemany("""UPDATE OR REPLACE images SET path = ?, thumbnail_key = 
+                CASE WHEN thumbnail_key IS NULL THEN NULL ELSE ? END WHERE path = ?""",
+                [(new_path, ThumbnailCache.cacheKey(new_path, size, mtime), old_path)
+                    for old_path, new_path, size, mtime in moves])
+
+    def setDimensions(self, records):
+        """Store (path, size, mtime, width, height) tuples, read when the
+        thumbnails were decoded, along with the keys of the thumbnails."""
+        connection = self.connection()
+        with connection:
+            connection.executemany("""UPDATE images SET width = ?, height = ?,
+                thumbnail_key = ? WHERE path = ? AND size = ? AND mtime = ?""",
+                [(width, height, ThumbnailCache.cacheKey(path, size, mtime), path, size, mtime)
+                    for path, size, mtime, width, height in records])
+
+    def setMetadata(self, records):
+        """Store (path, size, mtime, taken, metadata) tuples, where 'taken' is
+        the capture time in nanoseconds or None and 'metadata' is the
+        dictionary of EXIF fields. Files without metadata store an empty
+        dictionary so they aren't read again."""
+        connection = self.connection()
+        with connection:
+            connection.executemany("""INSERT INTO images (path, size, mtime, taken, exif)
+                VALUES (?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET
+                taken = excluded.taken, exif = excluded.exif
+                WHERE size = excluded.size AND mtime = excluded.mtime""",
+                [(path, size, mtime, taken, json.dumps(metadata))
+                    for path, size, mtime, taken, metadata in records])
+
+    def findPaths(self, directory, terms):
+        """Return the set of paths inside 'directory' that match every
+        metadata (field, value) term returned by parseQuery()."""
+        directory, upper = self._pathRange(directory)
+        conditions, parameters = ["path >= ?", "path < ?"], [directory, upper]
+        for field, value in terms:
+            condition, values = metadataCondition(field, value)
+            conditions.append(condition)
+            parameters.extend(values)
+        rows = self.connection().execute(
+            f"SELECT path FROM images WHERE {' AND '.join(conditions)}", parameters)
+        return {row[0] for row in rows}
@@ -0,0 +1,447 @@
+"""Image Manager GUI, Part 2
+Reads EXIF and XMP metadata from image file headers
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, re, struct, time
+from collections import namedtuple
+
+# Number of bytes of each TIFF field type
+FIELD_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8,
+    11: 4, 12: 8, 13: 4}
+FIELD_FORMATS = {3: "H", 4: "I", 8: "h", 9: "i", 11: "f", 12: "d", 13: "I"}
+
+# Tags of interest
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATE_TIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_FOCAL_LENGTH = 0x920A
+TAG_LENS_MODEL = 0xA434
+# Tags that locate embedded previews
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_MP_ENTRY = 0xB002 # Images of a Multi-Picture Format (MPF) JPEG
+JPEG_COMPRESSIONS = (6, 7)
+# Start of frame markers of the JPEG encodings that Qt decodes
+DECODABLE_FRAMES = (0xC0, 0xC1, 0xC2)
+RAF_SIGNATURE = b"FUJIFILMCCD-RAW "
+
+HEADER_BYTES = 512 * 1024 # Bytes read from TIFF based files
+
+# A JPEG stored inside another file. 'size' is its (width, height)
+EmbeddedPreview = namedtuple("EmbeddedPreview", "offset length size")
+
+class TiffReader:
+
+    def __init__(self, data, base=0):
+        """Walks the image file directories (IFDs) of TIFF structured data,
+        which is used by EXIF blocks, TIFF files and most RAW formats.
+        'base' is the offset of the TIFF header in 'data'; offsets stored in
+        the IFDs are relative to it. Raises ValueError for invalid data."""
+        self.data = data
+        self.base = base
+        byte_order = data[base:base + 4]
+        if byte_order == b"II*\0":
+            self.endian = "<"
+        elif byte_order == b"MM\0*":
+            self.endian = ">"
+        else:
+            raise ValueError("Not TIFF data")
+        self.first_ifd = self.unpack("I", 4)[0]
+
+    def unpack(self, field_format, offset, count=1):
+        """Unpack 'count' values at 'offset' from the TIFF header."""
+        start = self.base + offset
+        size = struct.calcsize(field_format) * count
+        if offset < 0 or start + size > len(self.data):
+            raise ValueError("Offset outside of the data")
+        if count > 1:
+            field_format = f"{count}{field_format}"
+        return struct.unpack(self.endian + field_format, self.data[start:start + size])
+
+    def ifd(self, offset):
+        """Return a tuple of a dictionary that maps the tags of the IFD at
+        'offset' to their values and the offset of the next IFD (0 if none).
+        Values that hold a single number are returned as that number,
+        rationals as (numerator, denominator) tuples, text as a string and
+        undefined data as bytes."""
+        entries = {}
+        count = self.unpack("H", offset)[0]
+        for entry_offset in range(offset + 2, offset + 2 + count * 12, 12):
+            tag, field_type, value_count = self.unpack("HHI", entry_offset)
+            size = FIELD_SIZES.get(field_type, 0) * value_count
+            if size == 0:
+                continue
+            value_offset = entry_offset + 8
+            if size > 4:
+                value_offset = self.unpack("I", value_offset)[0]
+            try:
+                entries[tag] = self.value(field_type, value_offset, value_count, size)
+            except ValueError:
+                continue # Skip values that point outside of the data
+        next_offset = self.unpack("I", offset + 2 + count * 12)[0]
+        return entries, next_offset
+
+    def value(self, field_type, offset, count, size):
+        """Decode a value of 'field_type' at 'offset'."""
+        if field_type == 2: # ASCII
+            raw = self.unpack(f"{size}s", offset)[0]
+            return raw.split(b"\0", 1)[0].decode("utf-8", "replace").strip()
+        if field_type in (1, 6, 7): # Bytes and undefined data
+            return self.unpack(f"{size}s", offset)[0]
+        if field_type in (5, 10): # Rationals
+            values = self.unpack("I" if field_type == 5 else "i", offset, count * 2)
+            values = list(zip(values[::2], values[1::2]))
+        else:
+            values = list(self.unpack(FIELD_FORMATS[field_type], offset, count))
+        return values[0] if count == 1 else values
+
+    def ifds(self, limit=16):
+        """Yield (offset, entries) for the chain of IFDs that starts at the
+        first IFD, stopping at 'limit' IFDs in case of a loop."""
+        offset = self.first_ifd
+        while offset and limit > 0:
+            entries, next_offset = self.ifd(offset)
+            yield offset, entries
+            offset, limit = next_offset, limit - 1
+
+def rationalValue(value):
+    """Return a TIFF rational as a float, or None."""
+    if isinstance(value, tuple):
+        return value[0] / value[1] if value[1] else None
+    return float(value) if isinstance(value, (int, float)) else None
+
+def formatExposure(value):
+    """Return an exposure time as text, e.g. '1/250'."""
+    seconds = rationalValue(value)
+    if not seconds:
+        return None
+    if seconds < 1:
+        return f"1/{round(1 / seconds)}"
+    return f"{seconds:g}"
+
+def gpsCoordinate(value, reference):
+    """Convert degrees, minutes and seconds rationals to signed degrees."""
+    if not isinstance(value, list) or len(value) != 3:
+        return None
+    parts = [rationalValue(part) for part in value]
+    if None in parts:
+        return None
+    degrees = parts[0] + parts[1] / 60 + parts[2] / 3600
+    return round(-degrees if reference in ("S", "W") else degrees, 6)
+
+def parseTiffMetadata(data, base=0):
+    """Return a dictionary of the fields of interest in TIFF structured
+    data, such as the contents of an EXIF block."""
+    reader = TiffReader(data, base)
+    _, ifd0 = next(reader.ifds(limit=1), (0, {}))
+    exif, gps = {}, {}
+    if isinstance(ifd0.get(TAG_EXIF_IFD), int):
+        exif, _ = reader.ifd(ifd0[TAG_EXIF_IFD])
+    if isinstance(ifd0.get(TAG_GPS_IFD), int):
+        gps, _ = reader.ifd(ifd0[TAG_GPS_IFD])
+
+    metadata = {}
+    taken = exif.get(TAG_DATE_TIME_ORIGINAL) or ifd0.get(TAG_DATE_TIME)
+    if isinstance(taken, str) and taken:
+        metadata["taken"] = taken
+    make, model = ifd0.get(TAG_MAKE), ifd0.get(TAG_MODEL)
+    if isinstance(model, str) and model:
+        # Most models already start with the make, e.g. 'Canon EOS R5'
+        if isinstance(make, str) and make and not model.lower().startswith(
+            make.split()[0].lower()):
+            model = f"{make} {model}"
+        metadata["camera"] = model
+    if isinstance(exif.get(TAG_LENS_MODEL), str) and exif[TAG_LENS_MODEL]:
+        metadata["lens"] = exif[TAG_LENS_MODEL]
+    exposure = formatExposure(exif.get(TAG_EXPOSURE_TIME))
+    if exposure:
+        metadata["exposure"] = exposure
+    aperture = rationalValue(exif.get(TAG_F_NUMBER))
+    if aperture:
+        metadata["aperture"] = round(aperture, 1)
+    iso = exif.get(TAG_ISO)
+    if isinstance(iso, list):
+        iso = iso[0] if iso else None
+    if isinstance(iso, int) and iso:
+        metadata["iso"] = iso
+    focal_length = rationalValue(exif.get(TAG_FOCAL_LENGTH))
+    if focal_length:
+        metadata["focal_length"] = round(focal_length, 1)
+    if isinstance(ifd0.get(TAG_ORIENTATION), int):
+        metadata["orientation"] = ifd0[TAG_ORIENTATION]
+    latitude = gpsCoordinate(gps.get(2), gps.get(1))
+    longitude = gpsCoordinate(gps.get(4), gps.get(3))
+    if latitude is not None and longitude is not None:
+        metadata["latitude"], metadata["longitude"] = latitude, longitude
+    return metadata
+
+def _xmpValue(xmp, name):
+    """Return the value of the XMP property 'name', written either as an
+    attribute, as an element or as the first item of a list."""
+    match = (re.search(rf'{name}="([^"]*)"', xmp) or
+        re.search(rf"<{name}>([^<]+)</{name}>", xmp) or
+        re.search(rf"<{name}>\s*<rdf:(?:Seq|Bag|Alt)>\s*<rdf:li[^>]*>([^<]*)</rdf:li>", xmp))
+    return match.group(1).strip() if match else None
+
+def _xmpNumber(text):
+    """Convert an XMP number, which may be a fraction such as '28/10'."""
+    try:
+        if "/" in text:
+            numerator, denominator = text.split("/", 1)
+            return float(numerator) / float(denominator)
+        return float(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def _xmpCoordinate(text):
+    """Convert an XMP GPS coordinate such as '37,46.2N' to signed degrees."""
+    match = re.fullmatch(r"(\d+),(\d+(?:\.\d+)?)(?:,(\d+(?:\.\d+)?))?([NSEW])", text or "")
+    if not match:
+        return None
+    degrees = int(match.group(1)) + float(match.group(2)) / 60
+    degrees += float(match.group(3) or 0) / 3600
+    return round(-degrees if match.group(4) in "SW" else degrees, 6)
+
+def parseXmpMetadata(xmp):
+    """Return a dictionary of the fields of interest in an XMP packet."""
+    metadata = {}
+    taken = (_xmpValue(xmp, "exif:DateTimeOriginal") or _xmpValue(xmp, "xmp:CreateDate")
+        or _xmpValue(xmp, "photoshop:DateCreated"))
+    if taken:
+        # XMP dates are written like '2023-05-04T10:11:12', EXIF dates use colons
+        metadata["taken"] = taken[:19].replace("-", ":", 2).replace("T", " ")
+    model = _xmpValue(xmp, "tiff:Model")
+    if model:
+        make = _xmpValue(xmp, "tiff:Make")
+        if make and not model.lower().startswith(make.split()[0].lower()):
+            model = f"{make} {model}"
+        metadata["camera"] = model
+    lens = _xmpValue(xmp, "exifEX:LensModel") or _xmpValue(xmp, "aux:Lens")
+    if lens:
+        metadata["lens"] = lens
+    exposure = _xmpValue(xmp, "exif:ExposureTime")
+    if exposure and _xmpNumber(exposure):
+        metadata["exposure"] = formatExposure(_xmpNumber(exposure))
+    for name, key in (("exif:FNumber", "aperture"), ("exif:FocalLength", "focal_length")):
+        value = _xmpNumber(_xmpValue(xmp, name) or "")
+        if value:
+            metadata[key] = round(value, 1)
+    iso = _xmpValue(xmp, "exif:ISOSpeedRatings") or _xmpValue(xmp, "exifEX:PhotographicSensitivity")
+    if iso and iso.isdigit():
+        metadata["iso"] = int(iso)
+    latitude = _xmpCoordinate(_xmpValue(xmp, "exif:GPSLatitude"))
+    longitude = _xmpCoordinate(_xmpValue(xmp, "exif:GPSLongitude"))
+    if latitude is not None and longitude is not None:
+        metadata["latitude"], metadata["longitude"] = latitude, longitude
+    rating = _xmpValue(xmp, "xmp:Rating")
+    if rating and rating.lstrip("-").isdigit():
+        metadata["rating"] = int(rating)
+    return metadata
+
+def jpegSegments(image_file):
+    """Yield (marker, data) for the APP segments of a JPEG file, stopping at
+    the start of the compressed image data so no pixels are read."""
+    if image_file.read(2) != b"\xff\xd8":
+        return
+    while True:
+        header = image_file.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return
+        marker, length = header[1], struct.unpack(">H", header[2:])[0]
+        if marker == 0xDA or marker == 0xD9: # Start of scan or end of image
+            return
+        if 0xE0 <= marker <= 0xEF:
+            yield marker, image_file.read(length - 2)
+        else:
+            image_file.seek(length - 2, os.SEEK_CUR)
+
+def pngChunks(image_file):
+    """Yield (type, data) for the metadata chunks of a PNG file, stopping at
+    the image data."""
+    if image_file.read(8) != b"\x89PNG\r\n\x1a\n":
+        return
+    while True:
+        header = image_file.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            return
+        if chunk_type in (b"eXIf", b"iTXt"):
+            yield chunk_type, image_file.read(length)
+            image_file.seek(4, os.SEEK_CUR) # CRC
+        else:
+            image_file.seek(length + 4, os.SEEK_CUR)
+
+def extractMetadata(image_path):
+    """Return a dictionary of the EXIF and XMP fields of 'image_path' that
+    the library displays and searches. Only the file's header is read.
+    XMP values are used for fields that EXIF doesn't provide."""
+    exif, xmp = {}, {}
+    try:
+        with open(image_path, "rb") as image_file:
+            signature = image_file.read(8)
+            image_file.seek(0)
+            if signature.startswith(b"\xff\xd8"):
+                for marker, data in jpegSegments(image_file):
+                    if marker == 0xE1 and data.startswith(b"Exif\0\0") and not exif:
+                        exif = parseTiffMetadata(data, 6)
+                    elif marker == 0xE1 and data.startswith(b"http://ns.adobe.com/xap/1.0/\0"):
+                        xmp = parseXmpMetadata(data[29:].decode("utf-8", "replace"))
+            elif signature.startswith(b"\x89PNG"):
+                for chunk_type, data in pngChunks(image_file):
+                    if chunk_type == b"eXIf":
+                        exif = parseTiffMetadata(data)
+                    elif data.startswith(b"XML:com.adobe.xmp\0"):
+                        # Skip the keyword, language and translated keyword fields
+                        xmp = parseXmpMetadata(data[data.find(b"<"):].decode("utf-8", "replace"))
+            elif signature[:4] in (b"II*\0", b"MM\0*"):
+                # TIFF files and TIFF based RAW formats
+                exif = parseTiffMetadata(image_file.read(HEADER_BYTES))
+    except (OSError, ValueError, struct.error):
+        pass
+    return {**xmp, **exif}
+
+def jpegFrameSize(image_file, offset, length):
+    """Return the (width, height) of the JPEG stored at 'offset', or None if
+    there is no JPEG or Qt can't decode its encoding, such as the lossless
+    JPEG used for the sensor data of many RAW files."""
+    image_file.seek(offset)
+    if image_file.read(2) != b"\xff\xd8":
+        return None
+    position = offset + 2
+    while position + 9 <= offset + length:
+        header = image_file.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        marker, segment_length = header[1], struct.unpack(">H", header[2:])[0]
+        if marker in DECODABLE_FRAMES:
+            height, width = struct.unpack(">xHH", image_file.read(5))
+            return (width, height) if width and height else None
+        if 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) or marker in (0xD9, 0xDA):
+            return None # Unsupported frame, or no frame before the image data
+        image_file.seek(segment_length - 2, os.SEEK_CUR)
+        position += 2 + segment_length
+    return None
+
+def _tiffPreviews(reader):
+    """Return a tuple of the (offset, length) locations of the JPEGs that the
+    IFDs of 'reader', including their SubIFDs, refer to and the
+    orientation in the first IFD."""
+    ifds = [entries for _, entries in reader.ifds()]
+    for entries in list(ifds):
+        sub_ifds = entries.get(TAG_SUB_IFDS)
+        for sub_ifd in sub_ifds if isinstance(sub_ifds, list) else [sub_ifds]:
+            if isinstance(sub_ifd, int):
+                try:
+                    ifds.append(reader.ifd(sub_ifd)[0])
+                except (ValueError, struct.error):
+                    continue
+    locations = []
+    for entries in ifds:
+        if TAG_JPEG_OFFSET in entries:
+            location = entries[TAG_JPEG_OFFSET], entries.get(TAG_JPEG_LENGTH)
+        elif entries.get(TAG_COMPRESSION) in JPEG_COMPRESSIONS:
+            # A JPEG in a single strip, as in the first IFD of CR2 files
+            location = entries.get(TAG_STRIP_OFFSETS), entries.get(TAG_STRIP_BYTE_COUNTS)
+        else:
+            continue
+        if all(isinstance(value, int) and value > 0 for value in location):
+            locations.append(location)
+    orientation = ifds[0].get(TAG_ORIENTATION, 1) if ifds else 1
+    return locations, orientation
+
+def _jpegPreviews(image_file):
+    """Return a tuple of the (offset, length) locations of the EXIF
+    thumbnail and the MPF previews of a JPEG file and its orientation."""
+    locations, orientation = [], 1
+    for marker, data in jpegSegments(image_file):
+        start = image_file.tell() - len(data)
+        if marker == 0xE1 and data.startswith(b"Exif\0\0"):
+            reader = TiffReader(data, 6)
+            ifds = [entries for _, entries in reader.ifds(limit=2)]
+            orientation = ifds[0].get(TAG_ORIENTATION, 1) if ifds else 1
+            for entries in ifds[1:]: # IFD1 describes the thumbnail
+                location = entries.get(TAG_JPEG_OFFSET), entries.get(TAG_JPEG_LENGTH)
+                if all(isinstance(value, int) and value > 0 for value in location):
+                    locations.append((start + 6 + location[0], location[1]))
+        elif marker == 0xE2 and data.startswith(b"MPF\0"):
+            # Offsets are relative to the MPF header; the first image,
+            # at offset 0, is the primary image itself
+            reader = TiffReader(data, 4)
+            entries = next(reader.ifds(limit=1), (0, {}))[1].get(TAG_MP_ENTRY)
+            if isinstance(entries, bytes):
+                for index in range(0, len(entries) - 15, 16):
+                    length, offset = struct.unpack(reader.endian + "4xII4x",
+                        entries[index:index + 16])
+                    if offset and length:
+                        locations.append((start + 4 + offset, length))
+    return locations, orientation
+
+def embeddedPreviews(image_path):
+    """Return a tuple of a list of the EmbeddedPreview JPEGs in 'image_path'
+    that Qt can decode, smallest first, and the EXIF orientation that
+    applies to them. Camera JPEGs and most RAW formats carry previews,
+    which are much faster to decode than the image itself. The
+    orientation is None if the previews carry their own metadata. Only
+    the headers are read."""
+    previews, orientation = [], 1
+    try:
+        with open(image_path, "rb") as image_file:
+            signature = image_file.read(len(RAF_SIGNATURE))
+            image_file.seek(0)
+            if signature.startswith(b"\xff\xd8"):
+                locations, orientation = _jpegPreviews(image_file)
+            elif signature[:4] in (b"II*\0", b"MM\0*"):
+                locations, orientation = _tiffPreviews(TiffReader(image_file.read(HEADER_BYTES)))
+            elif signature == RAF_SIGNATURE:
+                # Fujifilm RAW files hold a complete camera JPEG
+                image_file.seek(84)
+                locations, orientation = [struct.unpack(">II", image_file.read(8))], None
+            else:
+                locations = []
+            for offset, length in locations:
+                size = jpegFrameSize(image_file, offset, length)
+                if size is not None:
+                    previews.append(EmbeddedPreview(offset, length, size))
+    except (OSError, ValueError, struct.error):
+        pass
+    if orientation is not None and orientation not in range(1, 9):
+        orientation = 1
+    previews.sort(key=lambda preview: max(preview.size))
+    return previews, orientation
+
+def readPreview(image_path, preview):
+    """Return the bytes of the EmbeddedPreview 'preview' of 'image_path'."""
+    with open(image_path, "rb") as image_file:
+        image_file.seek(preview.offset)
+        return image_file.read(preview.length)
+
+def captureTime(metadata):
+    """Return the capture time in 'metadata' in nanoseconds since the epoch,
+    treating it as local time, or None."""
+    try:
+        return int(time.mktime(time.strptime(metadata["taken"][:19],
+            "%Y:%m:%d %H:%M:%S")) * 1000000000)
+    except (KeyError, ValueError, OverflowError):
+        return None
+
+def extractBatch(image_paths):
+    """Return a list of (path, metadata) tuples. Runs in a worker process."""
+    return [(image_path, extractMetadata(image_path)) for image_path in image_paths]
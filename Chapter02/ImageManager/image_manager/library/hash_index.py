@@ -0,0 +1,215 @@
+"""Image Manager GUI, Part 2
+Persistent content-hash index used to find duplicate images
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, hashlib, threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+PREFIX_SIZE = 64 * 1024 # Bytes read for the prefix hash
+CHUNK_SIZE = 1024 * 1024
+
+def hashFile(file_path, limit=None):
+    """Return the BLAKE2b digest of a file, or of its first 'limit' bytes.
+    hashlib releases the GIL while hashing, so several files can be hashed
+    at the same time on a thread pool."""
+    digest = hashlib.blake2b(digest_size=20)
+    remaining = limit
+    with open(file_path, "rb") as hashed_file:
+        while remaining is None or remaining > 0:
+            chunk = hashed_file.read(CHUNK_SIZE if remaining is None
+                else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+class ContentHashIndex:
+
+    def __init__(self, catalog, max_workers=4):
+        """Uses the sizes stored in the ImageCatalog and, once they have been
+        needed, hashes of the first 64 KB and of the full contents of files.
+        Files can only be identical if their sizes match, so most files never
+        have to be read. Hashes are only computed when sizes collide and full
+        hashes only when the prefix hashes collide as well."""
+        self.catalog = catalog
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        # Files accepted for import that may not be in the library yet
+        self._reserved = defaultdict(list)
+        # Catalog rows can outlive a library folder or a deleted file, so
+        # imports are only compared with the files under these folders
+        # that are not excluded. None compares them with every row
+        self._root_prefixes = None
+        self._excluded = frozenset()
+
+    def updateFiles(self, entries, hashes=None):
+        """Add or update (path, size, mtime) entries in the catalog. 'hashes'
+        can map paths to known (prefix_hash, full_hash) tuples."""
+        self.catalog.updateFiles(entries, hashes)
+
+    def removeFiles(self, paths):
+        """Remove files that are no longer in the library."""
+        self.catalog.removeFiles(paths)
+
+    def setLibraryRoots(self, roots):
+        """Compare imports only with the files under the folders in 'roots'."""
+        self._root_prefixes = tuple(os.path.join(root, "") for root in roots)
+
+    def setExcludedPaths(self, paths):
+        """Don't compare imports with 'paths', e.g. files waiting to be moved
+        to the trash, which are no longer in the library."""
+        self._excluded = frozenset(paths)
+
+    def isInLibrary(self, path):
+        """Return True if the catalog row of 'path' is part of the library."""
+        prefixes = self._root_prefixes
+        return ((prefixes is None or path.startswith(prefixes))
+            and path not in self._excluded)
+
+    def clearReserved(self):
+        """Forget the files that were accepted by earlier calls to
+        findDuplicates(). Call this once an import has finished."""
+        with self._lock:
+            self._reserved.clear()
+
+    def findDuplicates(self, candidates):
+        """Check 'candidates', a list of (path, size) tuples, against the
+        library, against files accepted by earlier calls and against each
+        other. Returns a tuple of a list of (path, original) tuples for
+        duplicates and a dictionary mapping the paths of the accepted files
+        to any (prefix_hash, full_hash) tuples computed for them."""
+        with self._lock:
+            return self._findDuplicates(candidates)
+
+    def _findDuplicates(self, candidates):
+        """Implementation of findDuplicates(). The caller holds the lock so
+        that two batches can't accept copies of the same file."""
+        connection = self.catalog.connection()
+        # Group the candidates and the library's files by size
+        groups = defaultdict(list) # size -> list of [path, is_candidate, prefix, full]
+        for path, size in candidates:
+            groups[size].append([path, True, None, None])
+        sizes = list(groups)
+        for start in range(0, len(sizes), 500):
+            chunk = sizes[start:start + 500]
+            rows = connection.execute("SELECT path, size, prefix_hash, full_hash FROM images "
+                f"WHERE size IN ({', '.join('?' * len(chunk))})", chunk)
+            for path, size, prefix_hash, full_hash in rows:
+                if self.isInLibrary(path):
+                    groups[size].append([path, False, prefix_hash, full_hash])
+        for size in sizes:
+            groups[size].extend(list(member) for member in self._reserved.get(size, ()))
+
+        # Only groups with more than one file need to be hashed
+        colliding = [members for members in groups.values() if len(members) > 1]
+        self._computeHashes([member for members in colliding for member in members], 2, PREFIX_SIZE)
+        full_groups = []
+        for members in colliding:
+            by_prefix = defaultdict(list)
+            for member in members:
+                if member[2] is not None:
+                    by_prefix[member[2]].append(member)
+            full_groups.extend(group for group in by_prefix.values() if len(group) > 1)
+        self._computeHashes([member for group in full_groups for member in group], 3, None)
+
+        # A candidate is a duplicate if a file that comes before it in its group,
+        # either in the library or an earlier candidate, has the same contents
+        duplicates, originals = [], {}
+        for members in groups.values():
+            for path, is_candidate, prefix_hash, full_hash in members:
+                if not is_candidate:
+                    if full_hash is not None:
+                        originals.setdefault(full_hash, path)
+        accepted_hashes = {}
+        for size, members in groups.items():
+            for path, is_candidate, prefix_hash, full_hash in members:
+                if not is_candidate:
+                    continue
+                if full_hash is not None and full_hash in originals:
+                    duplicates.append((path, originals[full_hash]))
+                    continue
+                if full_hash is not None:
+                    originals[full_hash] = path
+                self._reserved[size].append((path, False, prefix_hash, full_hash))
+                accepted_hashes[path] = (prefix_hash, full_hash)
+
+        # Store the hashes that were computed for files already in the library
+        library_hashes = [(member[2], member[3], member[0]) for members in colliding
+            for member in members if not member[1] and member[2] is not None]
+        with connection:
+            connection.executemany("""UPDATE images SET prefix_hash = ?,
+                full_hash = COALESCE(?, full_hash) WHERE path = ?""", library_hashes)
+        return duplicates, accepted_hashes
+
+    def findLibraryDuplicates(self):
+        """Return a list of lists of library paths with identical contents,
+        each sorted by path. As with imports, only files whose sizes
+        collide are hashed, and the hashes are stored for later."""
+        with self._lock:
+            connection = self.catalog.connection()
+            groups = defaultdict(list)
+            for path, size, prefix_hash, full_hash in connection.execute("""SELECT path, size,
+                prefix_hash, full_hash FROM images WHERE size IN (SELECT size FROM images
+                GROUP BY size HAVING COUNT(*) > 1)"""):
+                groups[size].append([path, False, prefix_hash, full_hash])
+            members = [member for group in groups.values() for member in group]
+            self._computeHashes(members, 2, PREFIX_SIZE)
+            by_prefix = defaultdict(list)
+            for size, group in groups.items():
+                for member in group:
+                    if member[2] is not None:
+                        by_prefix[size, member[2]].append(member)
+            colliding = [member for group in by_prefix.values() if len(group) > 1
+                for member in group]
+            self._computeHashes(colliding, 3, None)
+            with connection:
+                connection.executemany("""UPDATE images SET prefix_hash = ?,
+                    full_hash = COALESCE(?, full_hash) WHERE path = ?""",
+                    [(member[2], member[3], member[0]) for member in members
+                        if member[2] is not None])
+            by_contents = defaultdict(list)
+            for member in colliding:
+                if member[3] is not None:
+                    by_contents[member[3]].append(member[0])
+            return sorted(sorted(paths) for paths in by_contents.values() if len(paths) > 1)
+
+    def _computeHashes(self, members, column, limit):
+        """Hash the files of 'members' that are missing a hash in 'column' in
+        parallel. Files that can't be read are dropped from the index."""
+        missing = [member for member in members if member[column] is None]
+        results = self.executor.map(lambda member: self._tryHash(member[0], limit), missing)
+        removed = []
+        for member, digest in zip(missing, results):
+            member[column] = digest
+            if digest is None and not member[1]:
+                removed.append(member[0])
+        if removed:
+            self.removeFiles(removed)
+
+    def _tryHash(self, file_path, limit):
+        """Return the hash of 'file_path', or None if it can't be read."""
+        try:
+            return hashFile(file_path, limit)
+        except OSError:
+            return None
+
+    def isSameFile(self, first_path, second_path):
+        """Return True if two files have the same contents."""
+        try:
+            if os.path.getsize(first_path) != os.path.getsize(second_path):
+                return False
+            return hashFile(first_path) == hashFile(second_path)
+        except OSError:
+            return False
+
+    def close(self):
+        """Stop the hashing threads."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,290 @@
+"""Image Manager GUI, Part 2
+Parsing of the queries typed in the filter bar and the index that answers them
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, re, time, bisect
+from array import array
+from functools import partial
+
+# Fields answered by the SearchIndex in memory. Words without a field
+# search the file names
+INDEX_FIELDS = ("name", "ext", "size", "date")
+# Fields read from the metadata and searched in the catalog with
+# 'field:value'. Text fields match any part of the value, numeric fields
+# accept a comparison, e.g. 'iso:>=800'
+TEXT_FIELDS = ("camera", "lens", "exposure")
+NUMERIC_FIELDS = ("iso", "aperture", "focal_length")
+FIELD_ALIASES = {"f": "aperture", "focal": "focal_length", "taken": "date",
+    "type": "ext"}
+
+COMPARISON_PATTERN = re.compile(r"(<=|>=|<|>|=)?\s*(\d+(?:\.\d+)?|\.\d+)$")
+SIZE_PATTERN = re.compile(r"(\d+(?:\.\d+)?|\.\d+)\s*([kmg]?)b?$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+DATE_FORMATS = ("%Y", "%Y-%m", "%Y-%m-%d")
+
+def parseQuery(text):
+    """Split 'text' into a list of (field, value) terms. Quotes keep spaces
+    in a value, as in camera:"EOS R5". The values of 'ext' are sets of
+    extensions and those of 'size' and 'date' are inclusive (low, high)
+    ranges in bytes and nanoseconds. Returns None if a term can't be
+    understood."""
+    terms = []
+    for match in re.finditer(r'(?:(\w+):)?("[^"]*"|\S+)', text):
+        field, value = match.group(1), match.group(2).strip('"')
+        if field is None:
+            terms.append(("name", value.casefold()))
+            continue
+        field = FIELD_ALIASES.get(field.lower(), field.lower())
+        if field == "ext":
+            value = {extension.lstrip(".").casefold() for extension in value.split(",")}
+        elif field == "size":
+            value = parseRange(value, parseSize,
+                partial(parseSize, widen=False))
+        elif field == "date":
+            value = parseRange(value, parseDate)
+        elif field in NUMERIC_FIELDS:
+            value = value if COMPARISON_PATTERN.match(value) else None
+        elif field not in TEXT_FIELDS + ("gps",):
+            value = None
+        if value is None:
+            return None
+        terms.append((field, value))
+    return terms
+
+def parseSize(text, widen=True):
+    """Return the (low, high) byte range of a size such as '2MB'. Whole
+    numbers of a unit cover every size that is displayed as that number,
+    like a day covers every time during the day, unless 'widen' is False."""
+    match = SIZE_PATTERN.match(text)
+    if match is None:
+        return None
+    number, unit = float(match.group(1)), SIZE_UNITS[match.group(2).lower()]
+    if widen and unit > 1 and number.is_integer():
+        return int(number * unit), int((number + 1) * unit) - 1
+    return int(number * unit), int(number * unit)
+
+def parseDate(text):
+    """Return the (low, high) nanosecond range of a day, month or year such
+    as '2023-05', in local time."""
+    for date_format in DATE_FORMATS:
+        try:
+            start = time.strptime(text, date_format)
+        except ValueError:
+            continue
+        end = list(start)
+        if date_format == "%Y":
+            end[0] += 1
+        elif date_format == "%Y-%m":
+            end[1] += 1
+        else:
+            end[2] += 1
+        end[8] = -1 # Let mktime() work out daylight saving time
+        return (int(time.mktime(start) * 1000000000),
+            int(time.mktime(tuple(end)) * 1000000000) - 1)
+    return None
+
+def parseRange(text, parse, compare=None):
+    """Return the inclusive (low, high) range described by 'text', which is
+    a value, a comparison such as '>2MB' or a range such as '2023..2024'.
+    'parse' returns the (low, high) range covered by a single value, and
+    'compare', if given, the range that comparisons are made against."""
+    match = re.match(r"(<=|>=|<|>)?(.*)$", text)
+    operator, text = match.groups()
+    if ".." in text:
+        low, high = (parse(part) if part else None for part in text.split("..", 1))
+        if (low is None and text[0] != ".") or (high is None and text[-1] != "."):
+            return None
+        return (low[0] if low else 0, high[1] if high else 1 << 62)
+    bounds = (compare or parse)(text) if operator else parse(text)
+    if bounds is None:
+        return None
+    return {None: bounds, ">": (bounds[1] + 1, 1 << 62), ">=": (bounds[0], 1 << 62),
+        "<": (0, bounds[0] - 1), "<=": (0, bounds[1])}[operator]
+
+def metadataCondition(field, value):
+    """Return the SQL condition on the images table, and its parameters,
+    that matches the EXIF 'field' against 'value'."""
+    column = f"json_extract(exif, '$.{field}')"
+    if field in TEXT_FIELDS:
+        return f"{column} LIKE ?", [f"%{value}%"]
+    if field in NUMERIC_FIELDS:
+        operator, number = COMPARISON_PATTERN.match(value).groups()
+        return f"{column} {operator or '='} ?", [float(number)]
+    if field == "gps":
+        has_location = "json_extract(exif, '$.latitude') IS NOT NULL"
+        return (has_location if value.lower() in ("yes", "true", "1")
+            else f"NOT {has_location}"), []
+    raise ValueError(f"Unknown search field: {field}")
+
+def trigrams(text):
+    """Return the set of three character substrings of 'text'."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+
+    def __init__(self):
+        """In-memory index of the file names, extensions, sizes and dates of
+        the images in the library. Each image gets an id when it is added.
+        Names are indexed by their trigrams, so a substring search only
+        looks at the names that contain the rarest trigram of the query,
+        and the sizes and dates are kept in sorted order, so a range is
+        found by bisection. Queries start from whichever of these gives
+        the fewest candidates and check the other terms on those alone.
+        The trigrams and sorted columns are built a step at a time by
+        buildStep(); until they are up to date, queries scan the names or
+        values instead, which gives the same results. A column is only
+        sorted again after a query has needed it, so a stream of updates,
+        such as capture times read in the background, costs nothing until
+        the dates are searched."""
+        self._names = [] # Casefolded file names, None once removed
+        self._extensions = []
+        self._extension_ids = {} # Maps extensions to arrays of ids
+        self._sizes = array("q")
+        self._dates = array("q")
+        self._trigrams = {} # Maps trigrams to arrays of ids
+        self._indexed = 0 # Number of ids whose trigrams are indexed
+        self._sorted = {} # Maps "size" and "date" to (values, ids) arrays
+        self._wanted = set() # Columns to sort by the next build steps
+        self._removed = 0
+
+    def __len__(self):
+        """Return the number of images in the index."""
+        return len(self._names) - self._removed
+
+    def idCount(self):
+        """Return the number of ids handed out, including removed images."""
+        return len(self._names)
+
+    def addEntries(self, entries):
+        """Add (path, size, date) entries and return the id of the first.
+        The ids of the others follow in order."""
+        first_id = len(self._names)
+        for image_path, size, date in entries:
+            name = os.path.basename(image_path).casefold()
+            extension = os.path.splitext(name)[1][1:]
+            extension_ids = self._extension_ids.get(extension)
+            if extension_ids is None:
+                extension_ids = self._extension_ids[extension] = array("l")
+            extension_ids.append(len(self._names))
+            self._names.append(name)
+            self._extensions.append(extension)
+            self._sizes.append(size)
+            self._dates.append(date)
+        if entries:
+            self._sorted.clear()
+        return first_id
+
+    def remove(self, ids):
+        """Remove the images with 'ids'. Their trigram and extension entries
+        are skipped by queries rather than deleted."""
+        for image_id in ids:
+            if self._names[image_id] is not None:
+                self._names[image_id] = None
+                self._removed += 1
+        self._sorted.clear()
+
+    def update(self, image_id, size=None, date=None):
+        """Change the size or date of an image."""
+        if size is not None:
+            self._sizes[image_id] = size
+            self._sorted.pop("size", None)
+        if date is not None:
+            self._dates[image_id] = date
+            self._sorted.pop("date", None)
+
+    def hasPendingWork(self):
+        """Return True if buildStep() has something to do."""
+        return self._indexed < len(self._names) or bool(self._wanted)
+
+    def buildStep(self, limit=2000):
+        """Index the trigrams of up to 'limit' names, or sort a column whose
+        values changed. Return True while there is more to do."""
+        if self._indexed < len(self._names):
+            index = self._trigrams
+            last = min(self._indexed + limit, len(self._names))
+            for image_id in range(self._indexed, last):
+                name = self._names[image_id]
+                if name is None:
+                    continue
+                for trigram in trigrams(name):
+                    postings = index.get(trigram)
+                    if postings is None:
+                        postings = index[trigram] = array("l")
+                    postings.append(image_id)
+            self._indexed = last
+            return True
+        for field, values in (("size", self._sizes), ("date", self._dates)):
+            if field in self._wanted:
+                self._wanted.discard(field)
+                names = self._names
+                ids = sorted(range(len(names)), key=values.__getitem__)
+                if self._removed:
+                    ids = [image_id for image_id in ids if names[image_id] is not None]
+                self._sorted[field] = (array("q", map(values.__getitem__, ids)),
+                    array("l", ids))
+                return True
+        return False
+
+    def query(self, terms):
+        """Return the ids of the images that match every ("name", "ext",
+        "size" or "date") term returned by parseQuery(), in no particular
+        order."""
+        words = [value for field, value in terms if field == "name"]
+        extension_sets = [value for field, value in terms if field == "ext"]
+        ranges = [(field, value) for field, value in terms if field in ("size", "date")]
+
+        # Lists of ids that contain every match of a term. A list is exact
+        # if it holds nothing else: the ids of a three letter word's
+        # trigram, of extensions and of ranges
+        sources = []
+        if self._indexed == len(self._names):
+            for word in words:
+                for trigram in trigrams(word):
+                    sources.append((self._trigrams.get(trigram, ()), len(word) == 3))
+        for extension_set in extension_sets:
+            ids = array("l")
+            for extension in extension_set:
+                ids.extend(self._extension_ids.get(extension, ()))
+            sources.append((ids, True))
+        for field, (low, high) in ranges:
+            if field in self._sorted:
+                values, ids = self._sorted[field]
+                sources.append((ids[bisect.bisect_left(values, low):
+                    bisect.bisect_right(values, high)], True))
+            else:
+                self._wanted.add(field)
+
+        names = self._names
+        if sources:
+            candidates, exact = min(sources, key=lambda source: len(source[0]))
+            if exact and len(terms) == 1:
+                if not self._removed:
+                    return candidates
+                return [image_id for image_id in candidates if names[image_id] is not None]
+            candidates = [image_id for image_id in candidates if names[image_id] is not None]
+        elif words:
+            # Words of one or two letters, which match too many names for
+            # an index to help, or trigrams that are still being indexed
+            word = words.pop()
+            candidates = [image_id for image_id, name in enumerate(names)
+                if name is not None and word in name]
+        else:
+            candidates = [image_id for image_id, name in enumerate(names) if name is not None]
+
+        # Check the remaining terms against the candidates, one term at a time
+        for word in words:
+            candidates = [image_id for image_id in candidates if word in names[image_id]]
+        extensions = self._extensions
+        for extension_set in extension_sets:
+            candidates = [image_id for image_id in candidates
+                if extensions[image_id] in extension_set]
+        for field, (low, high) in ranges:
+            values = self._sizes if field == "size" else self._dates
+            candidates = [image_id for image_id in candidates
+                if low <= values[image_id] <= high]
+        return candidates
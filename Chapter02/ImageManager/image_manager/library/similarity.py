@@ -0,0 +1,184 @@
+"""Image Manager GUI, Part 2
+Perceptual hashes and a BK-tree for finding similar images
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import math, heapq
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage
+
+HASH_SIZE = 32 # Images are reduced to 32x32 pixels before hashing
+DCT_SIZE = 8 # Only the 8x8 lowest frequencies are used, giving 64 bits
+
+# Cosine table for the DCT, computed once: _COSINES[u][x]
+_COSINES = [[math.cos((2 * x + 1) * u * math.pi / (2 * HASH_SIZE))
+    for x in range(HASH_SIZE)] for u in range(DCT_SIZE)]
+
+def perceptualHash(image):
+    """Return the 64-bit perceptual hash (pHash) of a QImage. The image is
+    reduced to 32x32 grayscale pixels and transformed with a DCT. Each bit
+    records whether one of the 64 lowest frequencies is above the median.
+    Since only 8 of the 32 frequencies are needed in each direction, the
+    separable DCT is cheap enough to compute in pure Python."""
+    small = image.convertToFormat(QImage.Format.Format_Grayscale8).scaled(
+        HASH_SIZE, HASH_SIZE, Qt.AspectRatioMode.IgnoreAspectRatio,
+        Qt.TransformationMode.SmoothTransformation)
+    data = small.constBits().asstring(small.sizeInBytes())
+    stride = small.bytesPerLine()
+    pixels = [data[y * stride:y * stride + HASH_SIZE] for y in range(HASH_SIZE)]
+
+    # Transform the rows, then the columns of the result
+    rows = [[sum(c * p for c, p in zip(cosines, row)) for cosines in _COSINES]
+        for row in pixels]
+    coefficients = [sum(_COSINES[v][y] * rows[y][u] for y in range(HASH_SIZE))
+        for v in range(DCT_SIZE) for u in range(DCT_SIZE)]
+
+    # The first coefficient is the average brightness, so leave it out of the median
+    median = sorted(coefficients[1:])[(len(coefficients) - 1) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+def hammingDistance(first_hash, second_hash):
+    """Return the number of bits that differ between two hashes."""
+    return popCount(first_hash ^ second_hash)
+
+# Number of set bits of an int. int.bit_count() is much faster than
+# counting the characters of bin(), but needs Python 3.10
+popCount = getattr(int, "bit_count", lambda value: bin(value).count("1"))
+
+class BKTree:
+
+    def __init__(self):
+        """Burkhard-Keller tree of perceptual hashes. Every child of a node is
+        stored under its Hamming distance to that node. By the triangle
+        inequality, a search within 'radius' of a hash only has to visit
+        children whose distance is within 'radius' of the query's distance
+        to the node, which prunes most of the tree for small radii."""
+        self.root = None # Nodes are [hash, set of paths, {distance: node}]
+        self.hashes = {} # Maps paths to their hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, image_path, image_hash):
+        """Add or replace the hash for 'image_path'."""
+        if image_path in self.hashes:
+            self.remove(image_path)
+        self.hashes[image_path] = image_hash
+        if self.root is None:
+            self.root = [image_hash, {image_path}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hammingDistance(image_hash, node[0])
+            if distance == 0:
+                node[1].add(image_path)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, {image_path}, {}]
+                return
+            node = child
+
+    def remove(self, image_path):
+        """Remove 'image_path'. Its node stays in the tree to keep the
+        structure intact but no longer returns the path."""
+        image_hash = self.hashes.pop(image_path, None)
+        if image_hash is None:
+            return
+        node = self.root
+        while node is not None:
+            distance = hammingDistance(image_hash, node[0])
+            if distance == 0:
+                node[1].discard(image_path)
+                return
+            node = node[2].get(distance)
+
+    def search(self, image_hash, radius):
+        """Return (distance, path) tuples for every hash within 'radius'."""
+        results = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_hash, paths, children = nodes.pop()
+            distance = hammingDistance(image_hash, node_hash)
+            if distance <= radius:
+                results.extend((distance, path) for path in paths)
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes.append(child)
+        return results
+
+    def nearest(self, image_hash, count, max_radius=24):
+        """Return the 'count' closest (distance, path) tuples within
+        'max_radius', sorted by distance. Subtrees are visited best first,
+        by the lowest distance they can hold, and once 'count' images are
+        found the radius shrinks below the farthest of them, so the search
+        stops as soon as no subtree can hold a closer image. The sets and
+        dictionaries of the nodes are copied as they are visited, so hashes
+        may be added on another thread during a search."""
+        if self.root is None or count <= 0:
+            return []
+        results = [] # Max-heap of (-distance, path) of the closest images
+        radius = max_radius
+        nodes = [(0, 0, self.root)] # (lowest possible distance, tie breaker, node)
+        visited = 1
+        while nodes:
+            bound, _, (node_hash, paths, children) = heapq.heappop(nodes)
+            if bound > radius:
+                break
+            distance = popCount(image_hash ^ node_hash)
+            if distance <= radius:
+                for path in tuple(paths):
+                    heapq.heappush(results, (-distance, path))
+                    if len(results) > count:
+                        heapq.heappop(results)
+                if len(results) == count:
+                    radius = min(radius, -results[0][0] - 1)
+            # Every hash under the child at 'child_distance' is that far from
+            # the node, so it is at least |distance - child_distance| away
+            for child_distance, child in list(children.items()):
+                child_bound = max(bound, abs(distance - child_distance))
+                if child_bound <= radius:
+                    heapq.heappush(nodes, (child_bound, visited, child))
+                    visited += 1
+        return sorted((-distance, path) for distance, path in results)
+
+class PerceptualHashStore:
+
+    def __init__(self, catalog):
+        """Stores perceptual hashes in the ImageCatalog. A hash is only valid
+        for the size and modification time it was computed for, so it is
+        only computed once per file."""
+        self.catalog = catalog
+
+    def lookup(self, entries):
+        """Return a tuple of a dictionary mapping paths to stored hashes and a
+        list of the (path, size, mtime) entries that still need a hash."""
+        connection = self.catalog.connection()
+        found, missing = {}, []
+        for image_path, size, mtime in entries:
+            row = connection.execute("SELECT phash FROM images WHERE path = ? "
+                "AND size = ? AND mtime = ? AND phash IS NOT NULL", 
+                (image_path, size, mtime)).fetchone()
+            if row is None:
+                missing.append((image_path, size, mtime))
+            else:
+                found[image_path] = row[0] & 0xFFFFFFFFFFFFFFFF
+        return found, missing
+
+    def store(self, hashes):
+        """Store (path, size, mtime, hash) tuples. SQLite integers are signed,
+        so the hashes are converted to the signed 64-bit range."""
+        connection = self.catalog.connection()
+        with connection:
+            connection.executemany("""INSERT INTO images (path, size, mtime, phash)
+                VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET phash = excluded.phash
+                WHERE size = excluded.size AND mtime = excluded.mtime""",
+                [(image_path, size, mtime, image_hash - (1 << 64) if image_hash >= (1 << 63)
+                    else image_hash) for image_path, size, mtime, image_hash in hashes])
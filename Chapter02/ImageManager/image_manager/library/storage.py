@@ -0,0 +1,172 @@
+"""Image Manager GUI, Part 2
+Functions for placing files in the image library
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, sys, errno, shutil, hashlib
+
+CHUNK_SIZE = 1024 * 1024 # Bytes copied between progress callbacks
+
+# Import modes, in the order they are listed in the Preferences dialog
+COPY, REFLINK, HARDLINK, SYMLINK = "copy", "reflink", "hardlink", "symlink"
+IMPORT_MODES = {
+    COPY: "Copy",
+    REFLINK: "Clone (copy-on-write, falls back to copy)",
+    HARDLINK: "Hard link (falls back to copy)",
+    SYMLINK: "Symbolic link"}
+
+# Extensions of the files that can be imported. Thumbnails of camera RAW
+# files are made from the JPEG previews they carry
+RAW_EXTENSIONS = (".dng", ".cr2", ".nef", ".nrw", ".arw", ".srw", ".pef", ".raf")
+IMAGE_EXTENSIONS = (".png", ".xpm", ".jpg", ".jpeg") + RAW_EXTENSIONS
+
+# Files are kept in subdirectories named after the first hex digits of a hash
+# of their names, which keeps each directory small in large libraries
+SHARD_DIGITS = 2 # 256 subdirectories
+LAYOUT_MARKER = ".sharded" # Hidden file that marks a library as sharded
+MIGRATION_BATCH_SIZE = 500
+
+FICLONE = 0x40049409 # Linux ioctl that clones a file on Btrfs, XFS, etc.
+# Errors that mean the file system or volume can't share data between files
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY,
+    errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK, errno.ENOSYS)
+
+def copyFileObject(source_file, destination_file, on_chunk=None):
+    """Copy the contents of an open file to another in chunks. 'on_chunk' is
+    called with the size of each chunk and may raise to abort the copy."""
+    while True:
+        chunk = source_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        destination_file.write(chunk)
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+
+def _cloneFile(source, destination):
+    """Create 'destination' as a copy-on-write clone of 'source'. Returns
+    False if the platform or file system doesn't support clones."""
+    if sys.platform.startswith("linux"):
+        import fcntl
+        with open(source, "rb") as source_file:
+            with open(destination, "xb") as destination_file:
+                try:
+                    fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                    return True
+                except OSError as error:
+                    if error.errno not in UNSUPPORTED_ERRORS:
+                        raise
+        os.remove(destination)
+    elif sys.platform == "darwin":
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if hasattr(libc, "clonefile"):
+            if libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) == 0:
+                return True
+            error = ctypes.get_errno()
+            if error == errno.EEXIST:
+                raise FileExistsError(error, os.strerror(error), destination)
+            if error not in UNSUPPORTED_ERRORS:
+                raise OSError(error, os.strerror(error), destination)
+    return False
+
+def numberedFileName(file_name, number):
+    """Return 'file_name' with ' (number)' inserted before its extension."""
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem} ({number}){extension}"
+
+def shardName(file_name):
+    """Return the name of the subdirectory that holds 'file_name'. Names are
+    hashed so that files spread evenly, and a file's location is known
+    without listing any directory."""
+    digest = hashlib.md5(file_name.encode("utf-8", "surrogateescape")).hexdigest()
+    return digest[:SHARD_DIGITS]
+
+def libraryPath(library, file_name):
+    """Return the path of 'file_name' in the sharded 'library'."""
+    return os.path.join(library, shardName(file_name), file_name)
+
+def shardDirectories(library):
+    """Return the paths of every subdirectory of the sharded 'library'."""
+    return [os.path.join(library, f"{index:0{SHARD_DIGITS}x}")
+        for index in range(16 ** SHARD_DIGITS)]
+
+def isSharded(library):
+    """Return True if 'library' uses the sharded layout."""
+    return os.path.exists(os.path.join(library, LAYOUT_MARKER))
+
+def createShards(library):
+    """Create the subdirectories of 'library' and mark it as sharded."""
+    for directory in shardDirectories(library):
+        os.makedirs(directory, exist_ok=True)
+    open(os.path.join(library, LAYOUT_MARKER), "a").close()
+
+def migrateLibrary(library, catalog, cache=None, on_progress=None):
+    """Move the files of a library that keeps every file in one directory
+    into its shards. Files are renamed within the file system, so their
+    sizes and modification times stay the same, and the catalog rows and
+    cached thumbnails are moved with them rather than computed again.
+    'on_progress' is called with the number of files moved and the total.
+    Returns the number of files moved."""
+    for directory in shardDirectories(library):
+        os.makedirs(directory, exist_ok=True)
+    with os.scandir(library) as entries:
+        file_names = [entry.name for entry in entries
+            if not entry.name.startswith(".") and entry.is_file()]
+    moved = 0
+    for start in range(0, len(file_names), MIGRATION_BATCH_SIZE):
+        moves = []
+        for file_name in file_names[start:start + MIGRATION_BATCH_SIZE]:
+            source = os.path.join(library, file_name)
+            destination = libraryPath(library, file_name)
+            try:
+                if os.path.lexists(destination):
+                    continue # Left where it is rather than replacing a file
+                os.rename(source, destination)
+                stat = os.stat(destination)
+            except OSError:
+                continue
+            moves.append((source, destination, stat.st_size, stat.st_mtime_ns))
+        catalog.movePaths(moves)
+        if cache is not None:
+            cache.movePaths(moves)
+        moved += len(moves)
+        if on_progress is not None:
+            on_progress(min(start + MIGRATION_BATCH_SIZE, len(file_names)), len(file_names))
+    createShards(library)
+    return moved
+
+def transferFile(source, destination, mode=COPY, on_chunk=None):
+    """Place 'source' in the library as 'destination' using 'mode'. Clones and
+    hard links fall back to a copy when the file system or volume doesn't
+    support them. Raises FileExistsError if 'destination' exists. Returns
+    the mode that was actually used."""
+    if mode == REFLINK and _cloneFile(source, destination):
+        return REFLINK
+    if mode == HARDLINK:
+        try:
+            os.link(source, destination)
+            return HARDLINK
+        except FileExistsError:
+            raise
+        except OSError as error:
+            if error.errno not in UNSUPPORTED_ERRORS:
+                raise
+    if mode == SYMLINK:
+        os.symlink(os.path.abspath(source), destination)
+        return SYMLINK
+
+    with open(source, "rb") as source_file:
+        with open(destination, "xb") as destination_file:
+            try:
+                copyFileObject(source_file, destination_file, on_chunk)
+            except BaseException:
+                # Remove the partially copied file
+                destination_file.close()
+                os.remove(destination)
+                raise
+    shutil.copymode(source, destination)
+    return COPY
@@ -0,0 +1,222 @@
+"""Image Manager GUI, Part 2
+Persistent on-disk thumbnail cache with LRU eviction
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, time, hashlib, sqlite3, threading
+from PyQt6.QtCore import Qt, QBuffer, QByteArray, QIODevice, QSize, QStandardPaths
+from PyQt6.QtGui import QImage
+
+DEFAULT_BUDGET_MB = 2048
+# Longest sides of the thumbnails stored for each image, smallest first
+PYRAMID_LEVELS = (64, 128, 256, 512)
+DEFAULT_LEVEL = 128
+CACHE_VERSION = 1
+
+def dataLocation():
+    """Return the application's data directory, creating it if necessary."""
+    location = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.AppDataLocation)
+    os.makedirs(location, exist_ok=True)
+    return location
+
+class ThumbnailCache:
+
+    def __init__(self, location=None, budget_bytes=DEFAULT_BUDGET_MB * 1024 * 1024):
+        """Stores encoded thumbnails in an SQLite database under the application's
+        data directory. Entries are keyed by the absolute path, size and
+        modification time of the original, so an edited file is a cache miss,
+        and by the pyramid level. Each image has a thumbnail for every level
+        of PYRAMID_LEVELS, so changing the icon size only reads a different
+        level. When the cache grows past 'budget_bytes', the least recently
+        used thumbnails are evicted, which are usually the levels that
+        aren't displayed. The cache can be used from several threads; each
+        thread opens its own connection."""
+        if location is None:
+            location = os.path.join(dataLocation(), "thumbnails.sqlite3")
+        self.location = location
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._accessed = {} # Access times of (key, level) that have not been written yet
+
+        connection = self._connection()
+        if connection.execute("PRAGMA user_version").fetchone()[0] < CACHE_VERSION:
+            self._addLevels(connection)
+        connection.execute("""CREATE TABLE IF NOT EXISTS thumbnails (
+            key TEXT, level INTEGER, path TEXT, width INTEGER, height INTEGER,
+            bytes INTEGER, last_access REAL, data BLOB, PRIMARY KEY (key, level))""")
+        connection.execute("""CREATE INDEX IF NOT EXISTS thumbnails_last_access
+            ON thumbnails (last_access)""")
+        connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        connection.commit()
+        self.total_bytes = connection.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+
+    def _connection(self):
+        """Return the connection that belongs to the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _addLevels(self, connection):
+        """Keep the thumbnails stored before the cache had levels as the
+        default level. The primary key changed, so the table is copied."""
+        if connection.execute("""SELECT 1 FROM sqlite_master
+            WHERE type = 'table' AND name = 'thumbnails'""").fetchone() is None:
+            return
+        with connection:
+            connection.execute("DROP INDEX IF EXISTS thumbnails_last_access")
+            connection.execute("ALTER TABLE thumbnails RENAME TO old_thumbnails")
+            connection.execute("""CREATE TABLE thumbnails (
+                key TEXT, level INTEGER, path TEXT, width INTEGER, height INTEGER,
+                bytes INTEGER, last_access REAL, data BLOB, PRIMARY KEY (key, level))""")
+            connection.execute(f"""INSERT INTO thumbnails SELECT key, {DEFAULT_LEVEL}, path,
+                width, height, bytes, last_access, data FROM old_thumbnails""")
+            connection.execute("DROP TABLE old_thumbnails")
+
+    @staticmethod
+    def cacheKey(image_path, size, mtime):
+        """Return the key for the original's absolute path, size in bytes and
+        modification time in nanoseconds."""
+        key = f"{os.path.abspath(image_path)}\0{size}\0{mtime}"
+        return hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def get(self, image_path, size, mtime, level=DEFAULT_LEVEL):
+        """Return a tuple of the cached QImage of 'level' and the original
+        image's QSize, or None if the thumbnail is not in the cache. If only
+        a larger level is cached, it is scaled down, which is much cheaper
+        than decoding the original again."""
+        key = self.cacheKey(image_path, size, mtime)
+        row = self._connection().execute("""SELECT level, width, height, data
+            FROM thumbnails WHERE key = ? AND level >= ? ORDER BY level LIMIT 1""",
+            (key, level)).fetchone()
+        image = QImage.fromData(row[3]) if row is not None else QImage()
+        with self._lock:
+            if image.isNull():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key, row[0]] = time.time()
+        if image.width() > level or image.height() > level:
+            image = image.scaled(level, level, Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation)
+        return image, QSize(row[1], row[2])
+
+    @staticmethod
+    def encodeImage(image):
+        """Return the bytes stored for 'image'. Images with an alpha channel
+        are stored as PNG, all others as JPEG."""
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        if image.hasAlphaChannel():
+            image.save(buffer, "PNG")
+        else:
+            image.save(buffer, "JPG", 85)
+        buffer.close()
+        return bytes(data)
+
+    def put(self, image_path, size, mtime, levels, original_size):
+        """Encode the thumbnails of 'levels', a dictionary mapping levels to
+        QImages, and store them in the cache."""
+        self.putEncoded(image_path, size, mtime, {level: self.encodeImage(image)
+            for level, image in levels.items()}, original_size)
+
+    def putEncoded(self, image_path, size, mtime, levels, original_size):
+        """Store thumbnails that were already encoded by encodeImage(), e.g.
+        in another process. 'levels' maps levels to the encoded bytes."""
+        key = self.cacheKey(image_path, size, mtime)
+        connection = self._connection()
+        now = time.time()
+        with self._lock:
+            previous = connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails "
+                f"WHERE key = ? AND level IN ({', '.join('?' * len(levels))})",
+                (key, *levels)).fetchone()[0]
+            connection.executemany("""INSERT OR REPLACE INTO thumbnails
+                (key, level, path, width, height, bytes, last_access, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", [(key, level, os.path.abspath(image_path),
+                original_size.width(), original_size.height(), len(data), now, data)
+                for level, data in levels.items()])
+            connection.commit()
+            self.total_bytes += sum(len(data) for data in levels.values()) - previous
+            if self.total_bytes > self.budget_bytes:
+                self._evict(connection)
+
+    def movePaths(self, moves):
+        """Keep the thumbnails of (old path, new path, size, mtime) tuples for
+        files that were moved. The key includes the path, so it changes."""
+        connection = self._connection()
+        with self._lock:
+            connection.executemany("UPDATE OR REPLACE thumbnails SET key = ?, path = ? WHERE key = ?",
+                [(self.cacheKey(new_path, size, mtime), new_path,
+                    self.cacheKey(old_path, size, mtime))
+                    for old_path, new_path, size, mtime in moves])
+            connection.commit()
+
+    def cachedKeys(self, keys):
+        """Return the set of 'keys' that have a cached thumbnail for every
+        level of the pyramid."""
+        keys, found = list(keys), set()
+        connection = self._connection()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(row[0] for row in connection.execute("SELECT key FROM thumbnails "
+                f"WHERE key IN ({', '.join('?' * len(chunk))}) GROUP BY key "
+                "HAVING COUNT(*) = ?", (*chunk, len(PYRAMID_LEVELS))))
+        return found
+
+    def setBudget(self, budget_bytes):
+        """Change the byte budget and evict entries if necessary."""
+        self.budget_bytes = budget_bytes
+        with self._lock:
+            if self.total_bytes > self.budget_bytes:
+                self._evict(self._connection())
+
+    def _evict(self, connection):
+        """Delete the least recently used entries until the cache is 10% below
+        its budget, which avoids evicting on every single insert. The caller
+        must hold the lock."""
+        self._writeAccessTimes(connection)
+        target = self.budget_bytes * 0.9
+        rows = connection.execute(
+            "SELECT key, level, bytes FROM thumbnails ORDER BY last_access")
+        evicted = []
+        for key, level, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key, level))
+            self.total_bytes -= size
+        connection.executemany("DELETE FROM thumbnails WHERE key = ? AND level = ?", evicted)
+        connection.commit()
+
+    def _writeAccessTimes(self, connection):
+        """Write the access times of cache hits. Hits only update memory so
+        that reading a thumbnail never waits for a write."""
+        if self._accessed:
+            connection.executemany("""UPDATE thumbnails SET last_access = ?
+                WHERE key = ? AND level = ?""", [(access_time, key, level)
+                for (key, level), access_time in self._accessed.items()])
+            connection.commit()
+            self._accessed.clear()
+
+    def flush(self):
+        """Write pending access times to disk."""
+        with self._lock:
+            self._writeAccessTimes(self._connection())
+
+    def stats(self):
+        """Return a dictionary of the cache's counters."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                "bytes": self.total_bytes, "budget": self.budget_bytes}
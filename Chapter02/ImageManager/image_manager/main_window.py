@@ -7,16 +7,41 @@ Created by: Joshua Willman
 """
 
 # Import necessary modules
-import sys
+import os, sys, time
+from functools import partial
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, 
-    QDockWidget, QListWidgetItem, QFileDialog, QMessageBox, QScrollArea)
-from PyQt6.QtCore import (Qt, QByteArray, QSize, QPoint, QDir, QFile, 
-    QFileInfo, QSysInfo, QSettings)
-from PyQt6.QtGui import QIcon, QAction, QKeySequence
+    QDockWidget, QFileDialog, QMessageBox, QProgressBar, QToolButton, QLineEdit, QSlider)
+from PyQt6.QtCore import (Qt, QByteArray, QSize, QPoint, QDir, 
+    QSysInfo, QSettings, QTimer, QElapsedTimer, QThreadPool)
+from PyQt6.QtGui import QIcon, QAction, QActionGroup, QKeySequence
 # Import relative modules
-from .widgets.image_viewer import ImageViewerListWidget
+from .widgets.image_viewer import (ImageViewerListView, ICON_SIZE, MIN_ICON_SIZE,
+    MAX_ICON_SIZE)
+from .widgets.tiled_image_view import TiledImageView
+from .model_view.models import ImageLibraryModel, SORT_NAME, SORT_FIELDS
+from .model_view.decorations import DECORATION_BUDGET_MB
+from .model_view.filter_proxy import ImageFilterProxyModel
+from .workers.thumbnails import ThumbnailLoader, placeholderPixmap, nearestLevel
+from .workers.scanner import DirectoryScanner
+from .workers.library_watcher import LibraryWatcher, RECENT_FILE_NS
+from .workers.migration import LibraryMigrator
+from .workers.importer import ImportEngine
+from .widgets.import_panel import ImportProgressPanel
+from .library.thumbnail_cache import ThumbnailCache, DEFAULT_BUDGET_MB
+from .library.storage import (COPY, IMPORT_MODES, IMAGE_EXTENSIONS, isSharded,
+    createShards, shardDirectories)
+from .library.hash_index import ContentHashIndex
+from .library.catalog import ImageCatalog
+from .library.search import parseQuery, INDEX_FIELDS
+from .library.similarity import BKTree, PerceptualHashStore
+from .workers.similarity import PerceptualHashIndexer, SimilarImagesFinder
+from .workers.trash_queue import TrashQueue, UNDO_SECONDS
+from .workers.tiles import TileLoader, TILE_BUDGET_MB, PREFETCH_DEPTH
+from .workers.metadata import MetadataExtractor
 from .dialogs.image_info_dialog import ImageInfoDialog
 from .dialogs.preferences import PreferencesDialog
+from .dialogs.similar_images_dialog import SimilarImagesDialog
+from .profiling import profiler, ProfilerDock
 
 class MainWindow(QMainWindow):
 
@@ -25,40 +50,191 @@ class MainWindow(QMainWindow):
     settings = QSettings("Custom GUIs", "Image Manager GUI")
     #print(settings.fileName()) # NOTE: Uncomment to print the path to settings
 
-    images_path = "Images" # File path to the Images directory
-    image_dir = QDir(images_path)
+    images_path = "Images" # Default Images directory, used until others are chosen
     info_dialog = None # Create variable for modeless dialog
+    migrator = None # Worker that moves images into subdirectories
+    similar_dialog = None # Create variable for modeless dialog
+    # Show memory use in the status bar when IMAGE_MANAGER_DEBUG is set
+    debug_mode = os.environ.get("IMAGE_MANAGER_DEBUG", "") not in ("", "0")
 
     def __init__(self):
         """MainWindow Constructor for Image Manager"""
         super().__init__() # Constructor for QMainWindow
+        # Measure how long it takes until the first images are visible 
+        self.startup_timer = QElapsedTimer()
+        self.startup_timer.start()
+        self.startup_metrics = {}
         self.initializeUI()
 
     def initializeUI(self):
         """Set up the GUI's main window and load initial settings and data."""
         self.setWindowTitle("Image Manager")
         self.setObjectName("ImageManager")
+        # Time the slots that respond to the user when profiling is turned
+        # on. Slots have to be replaced before they are connected
+        profiler.instrument(self, ("updateDockInfo", "prefetchNeighbours", 
+            "filterTextChanged", "applyFilter", "sortListItems", "changeIconSize", 
+            "updateThumbnail", "addScannedImages", "addMetadata", "addPerceptualHashes"))
 
         # Set up the main window, menu, dock widgets, and initialize the GUI's settings
+        self.setUpCatalog()
+        self.setUpThumbnailLoader()
         self.setUpMainWindow()
+        self.setUpStatusBar()
+        self.setUpFilterBar()
         self.displayImagePreviewDock()
+        self.displayImportDock()
+        if profiler.enabled:
+            self.displayProfilerDock()
         self.createActions()
         self.createMenus()
         self.loadStoredImageData()
         self.getInitialSettings()
         self.show() # Display the main window
 
+    def setUpCatalog(self):
+        """Open the catalog that stores what is known about each image, so
+        that the library can be shown without reading the files first."""
+        self.catalog = ImageCatalog()
+        # Image sizes read while decoding thumbnails are written in batches
+        self.pending_dimensions = []
+        self.dimensions_timer = QTimer(self, singleShot=True, interval=1000, 
+            timeout=self.storeDimensions)
+        # EXIF fields are read from the file headers in worker processes
+        self.metadata_extractor = MetadataExtractor(self.catalog, self)
+        self.metadata_extractor.metadata_ready.connect(self.addMetadata)
+
+    def setUpThumbnailLoader(self):
+        """Create the worker pool that decodes thumbnails in the background. 
+        Items are shown with a placeholder icon until their thumbnail is ready.
+        Decoded thumbnails are kept in a persistent cache, so a warm start 
+        doesn't need to open the original images. Each image has thumbnails
+        of several sizes, and the smallest one that fits the icons is loaded."""
+        self.icon_size = self.settings.value("view/icon_size", ICON_SIZE, type=int)
+        self.performance_options = {
+            "pool_size": self.settings.value("thumbnails/pool_size", 0, type=int),
+            "queue_depth": self.settings.value("thumbnails/queue_depth", 0, type=int),
+            "cache_budget_mb": self.settings.value("thumbnails/cache_budget_mb", 
+                DEFAULT_BUDGET_MB, type=int),
+            "decoration_budget_mb": self.settings.value("thumbnails/memory_budget_mb", 
+                DECORATION_BUDGET_MB, type=int),
+            "import_workers": self.settings.value("import/workers", 4, type=int),
+            "import_mode": self.settings.value("import/mode", COPY),
+            "prefetch_depth": self.settings.value("preview/prefetch_depth", 
+                PREFETCH_DEPTH, type=int),
+            "preview_budget_mb": self.settings.value("preview/cache_budget_mb", 
+                TILE_BUDGET_MB, type=int)}
+        self.thumbnail_cache = ThumbnailCache(
+            budget_bytes=self.performance_options["cache_budget_mb"] * 1024 * 1024)
+        self.thumbnail_loader = ThumbnailLoader(self, 
+            self.performance_options["pool_size"], self.performance_options["queue_depth"], 
+            nearestLevel(self.icon_size), self.thumbnail_cache)
+        self.thumbnail_loader.thumbnail_ready.connect(self.updateThumbnail)
+        self.thumbnail_loader.thumbnail_failed.connect(self.markThumbnailFailed)
+        self.thumbnail_loader.queue_changed.connect(self.showThumbnailCacheStats)
+        self.placeholder_icon = QIcon(placeholderPixmap(self.thumbnail_loader.thumbnail_size))
+        self.failed_icon = QIcon(placeholderPixmap(self.thumbnail_loader.thumbnail_size, True))
+
+        # Perceptual hashes are computed from the thumbnails in the background
+        # and kept in a BK-tree, which finds similar images without comparing
+        # the selected image to every image in the library
+        self.similarity_tree = BKTree()
+        self.phash_store = PerceptualHashStore(self.catalog)
+        self.hash_indexer = PerceptualHashIndexer(self.phash_store, self.thumbnail_cache, self)
+        self.hash_indexer.hashes_ready.connect(self.addPerceptualHashes)
+        self.similar_finder = SimilarImagesFinder(self.similarity_tree, self.thumbnail_cache, self)
+        self.similar_finder.found.connect(self.showSimilarImages)
+        self.similar_finder.failed.connect(self.showUnreadableImage)
+        self.similar_request = None # Path of the image the last query was for
+
     def setUpMainWindow(self):
-        """Set up the application's main window containing the QListWidget."""
-        self.image_view_lw = ImageViewerListWidget(self)
-        # Use signals/slots to interact with the list widget 
-        self.image_view_lw.itemSelectionChanged.connect(self.updateDockInfo)
-        self.image_view_lw.itemDoubleClicked.connect(self.displayImageInfoDialog)
-        # Use the list widget's internal model to enable/disable menu items
-        self.image_view_lw.model().rowsInserted.connect(self.manageMenuItems)
-        self.image_view_lw.model().rowsRemoved.connect(self.manageMenuItems)
+        """Set up the application's main window containing the QListView and
+        the model that holds the image library."""
+        self.image_model = ImageLibraryModel(self.thumbnail_loader, self.placeholder_icon, 
+            self.failed_icon, self)
+        profiler.instrument(self.image_model, ("data", "findRows", "sort", "setThumbnail"))
+        # Only the thumbnails on and near the screen are sure to stay in memory
+        self.image_model.decorations.setBudget(
+            self.performance_options["decoration_budget_mb"] * 1024 * 1024)
+        # The view shows the model through a proxy that hides the images 
+        # that don't match the filter bar
+        self.proxy_model = ImageFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.image_model)
+        self.image_view_lv = ImageViewerListView(self)
+        self.image_view_lv.setThumbnailSize(self.icon_size)
+        self.image_view_lv.setModel(self.proxy_model)
+        # Use signals/slots to interact with the list view 
+        self.image_view_lv.selectionModel().selectionChanged.connect(self.updateDockInfo)
+        self.image_view_lv.doubleClicked.connect(self.displayImageInfoDialog)
+        self.image_view_lv.files_dropped.connect(self.importDroppedFiles)
+        # Use the model's signals to enable/disable menu items
+        self.image_model.rowsInserted.connect(self.manageMenuItems)
+        self.image_model.rowsRemoved.connect(self.manageMenuItems)
+
+        # Decode thumbnails for the items in the viewport first. The timer 
+        # collapses bursts of scroll events into a single update
+        self.visible_items_timer = QTimer(self, singleShot=True, interval=50, 
+            timeout=self.prioritizeVisibleThumbnails)
+        self.image_view_lv.verticalScrollBar().valueChanged.connect(
+            self.visible_items_timer.start)
+        self.image_model.rowsInserted.connect(self.visible_items_timer.start)
+        self.proxy_model.modelReset.connect(self.visible_items_timer.start)
+        self.proxy_model.layoutChanged.connect(self.visible_items_timer.start)
+        self.image_view_lv.viewport_resized.connect(self.visible_items_timer.start)
+
+        # Deleted images are held for a short time so the deletion can be undone
+        self.trash_queue = TrashQueue(self)
+        self.trash_queue.flushed.connect(self.removeTrashedImages)
+
+        self.setCentralWidget(self.image_view_lv)
+
+    def setUpStatusBar(self):
+        """Create the widgets that show the progress of scanning the Images 
+        directory. They are hidden until a scan starts."""
+        self.scan_progress_bar = QProgressBar()
+        self.scan_progress_bar.setRange(0, 0) # The total is unknown while scanning
+        self.scan_progress_bar.setMaximumWidth(120)
+        self.scan_progress_label = QLabel()
+        self.scan_cancel_button = QToolButton()
+        self.scan_cancel_button.setText("Cancel")
+
+        for widget in (self.scan_progress_label, self.scan_progress_bar, self.scan_cancel_button):
+            self.statusBar().addPermanentWidget(widget)
+            widget.hide()
+
+        # Slider that changes the size of the icons
+        self.icon_size_slider = QSlider(Qt.Orientation.Horizontal)
+        self.icon_size_slider.setRange(MIN_ICON_SIZE, MAX_ICON_SIZE)
+        self.icon_size_slider.setSingleStep(8)
+        self.icon_size_slider.setPageStep(64)
+        self.icon_size_slider.setMaximumWidth(150)
+        self.icon_size_slider.setToolTip("Icon Size")
+        self.icon_size_slider.setValue(self.icon_size)
+        self.icon_size_slider.valueChanged.connect(self.changeIconSize)
+        self.statusBar().addPermanentWidget(self.icon_size_slider)
 
-        self.setCentralWidget(self.image_view_lw)
+        if self.debug_mode:
+            self.memory_label = QLabel()
+            self.statusBar().addPermanentWidget(self.memory_label)
+            self.memory_timer = QTimer(self, interval=1000, timeout=self.showMemoryUsage)
+            self.memory_timer.start()
+
+    def setUpFilterBar(self):
+        """Create the tool bar with the line edit that filters the images by
+        name, extension, date, size and the fields read from their metadata."""
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText('Filter, e.g. beach ext:jpg,png ' 
+            'date:2023-05..2023-08 size:>2MB camera:"EOS R5" iso:>=800 gps:yes')
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_timer = QTimer(self, singleShot=True, interval=200, 
+            timeout=self.applyFilter)
+        self.filter_edit.textChanged.connect(self.filterTextChanged)
+        self.filter_edit.returnPressed.connect(self.applyFilter)
+
+        self.filter_toolbar = self.addToolBar("Filter")
+        self.filter_toolbar.setObjectName("FilterToolBar")
+        self.filter_toolbar.setMovable(False)
+        self.filter_toolbar.addWidget(self.filter_edit)
 
     def createActions(self):
         """Create the application's menu actions."""
@@ -72,17 +248,40 @@ class MainWindow(QMainWindow):
         self.quit_act.setShortcut(QKeySequence.StandardKey.Quit) # Ctrl+Q
 
         # Create actions for Edit menu
-        self.select_all_act = QAction("Select All", self, triggered=self.image_view_lw.selectAll)
+        self.select_all_act = QAction("Select All", self, triggered=self.image_view_lv.selectAll)
         self.select_all_act.setShortcut(QKeySequence.StandardKey.SelectAll) # Ctrl+A
 
         self.delete_act = QAction("Delete Images", self, triggered=self.deleteImages)
         self.delete_act.setShortcut(QKeySequence.StandardKey.Delete) # Del
         self.delete_act.setEnabled(False)
 
+        self.undo_delete_act = QAction("Undo Delete", self, triggered=self.undoDelete)
+        self.undo_delete_act.setShortcut(QKeySequence.StandardKey.Undo) # Ctrl+Z
+        self.undo_delete_act.setEnabled(False)
+        self.trash_queue.changed.connect(
+            lambda: self.undo_delete_act.setEnabled(self.trash_queue.canUndo()))
+
+        self.find_similar_act = QAction("Find Similar Images", self, 
+            triggered=self.findSimilarImages)
+        self.find_similar_act.setShortcut("Ctrl+F")
+        self.find_similar_act.setEnabled(False)
+
+        self.filter_act = QAction("Filter Images", self, 
+            triggered=lambda: (self.filter_toolbar.show(), self.filter_edit.setFocus(),
+                self.filter_edit.selectAll()))
+        self.filter_act.setShortcut("Ctrl+L")
+
         # Create actions for View menu
         # Handle the visibility of the dock widget that displays images
         self.show_dock_act = self.image_preview_dock.toggleViewAction()
         self.show_dock_act.setText("Show Image View")  
+        self.show_import_dock_act = self.import_dock.toggleViewAction()
+        self.show_import_dock_act.setText("Show Import Progress")
+        self.show_filter_bar_act = self.filter_toolbar.toggleViewAction()
+        self.show_filter_bar_act.setText("Show Filter Bar")
+        if profiler.enabled:
+            self.show_profiler_act = self.profiler_dock.toggleViewAction()
+            self.show_profiler_act.setText("Show Slot Timings")
 
         self.sort_ascend_act = QAction("Sort Ascending", self,
             triggered=lambda: self.sortListItems(Qt.SortOrder.AscendingOrder))
@@ -92,6 +291,17 @@ class MainWindow(QMainWindow):
             triggered=lambda: self.sortListItems(Qt.SortOrder.DescendingOrder))
         self.sort_descend_act.setEnabled(False)
 
+        # Exclusive actions for choosing the field that images are sorted by
+        self.sort_field = self.settings.value("sort/field", SORT_NAME)
+        self.sort_order = Qt.SortOrder(self.settings.value("sort/order", 
+            Qt.SortOrder.AscendingOrder.value, type=int))
+        self.sort_field_group = QActionGroup(self)
+        for field, text in SORT_FIELDS.items():
+            sort_field_act = QAction(text, self.sort_field_group, checkable=True,
+                checked=(field == self.sort_field))
+            sort_field_act.setData(field)
+        self.sort_field_group.triggered.connect(self.changeSortField)
+
         self.fullscreen_act = QAction("Show Fullscreen", self, 
             triggered=self.displayFullScreen, checkable=True)
 
@@ -115,10 +325,20 @@ class MainWindow(QMainWindow):
         self.edit_menu.addAction(self.select_all_act)
         self.edit_menu.addSeparator()
         self.edit_menu.addAction(self.delete_act)  
+        self.edit_menu.addAction(self.undo_delete_act)
+        self.edit_menu.addSeparator()
+        self.edit_menu.addAction(self.find_similar_act)
+        self.edit_menu.addAction(self.filter_act)
 
         self.view_menu = self.menuBar().addMenu("&View")
         self.view_menu.addAction(self.show_dock_act)  
+        self.view_menu.addAction(self.show_import_dock_act)
+        self.view_menu.addAction(self.show_filter_bar_act)
+        if profiler.enabled:
+            self.view_menu.addAction(self.show_profiler_act)
         self.view_menu.addSeparator()
+        self.sort_by_menu = self.view_menu.addMenu("Sort By")
+        self.sort_by_menu.addActions(self.sort_field_group.actions())
         self.view_menu.addAction(self.sort_ascend_act)
         self.view_menu.addAction(self.sort_descend_act)
         self.view_menu.addSeparator()
@@ -129,91 +349,212 @@ class MainWindow(QMainWindow):
 
     def manageMenuItems(self, parent, first, last):
         """Slot to enable/disable menu items if rows have been 
-        added/deleted to QListWidget. The rowsInserted() and 
+        added/deleted to the model. The rowsInserted() and 
         rowsRemoved() that trigger this slot return the 'parent',
         'first', and 'last' values, but they are not used in 
         this method."""
-        if self.image_view_lw.count() == 0:
+        if self.image_model.rowCount() == 0:
             self.delete_act.setEnabled(False)
             self.sort_ascend_act.setEnabled(False)
             self.sort_descend_act.setEnabled(False)
-        elif self.image_view_lw.count() > 0:
+        elif self.image_model.rowCount() > 0:
             self.delete_act.setEnabled(True)
             self.sort_ascend_act.setEnabled(True)
             self.sort_descend_act.setEnabled(True)   
 
     def displayImagePreviewDock(self):
-        """Dock widget that displays a selected image in a scrollable 
-        area and uses its file name as the dock's title."""
+        """Dock widget that displays a selected image in a view that can be 
+        panned and zoomed, and uses its file name as the dock's title."""
         self.image_preview_dock = QDockWidget()
         self.image_preview_dock.setObjectName("PreviewDock")
         self.image_preview_dock.setWindowTitle("Show Image View")
         self.image_preview_dock.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea)
 
-        self.display_image_label = QLabel()
-        self.display_image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        self.view_scroll_area = QScrollArea()
-        self.view_scroll_area.setMinimumWidth(300)
-        self.view_scroll_area.setWidgetResizable(True)
+        # The tile loader also prefetches the images next to the selected 
+        # one, so stepping through the images doesn't wait for decoding
+        self.tile_loader = TileLoader(self, 
+            self.performance_options["preview_budget_mb"] * 1024 * 1024)
+        self.preview_view = TiledImageView(loader=self.tile_loader)
+        self.preview_view.setMinimumWidth(300)
+        self.preview_row = -1
 
-        self.image_preview_dock.setWidget(self.view_scroll_area)
+        self.image_preview_dock.setWidget(self.preview_view)
         # Set initial location of dock widget in the main window
         self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.image_preview_dock)   
 
+    def displayImportDock(self):
+        """Dock widget that displays the progress of imports. Imports run in 
+        the background, so the dock doesn't block the rest of the GUI."""
+        self.hash_index = ContentHashIndex(self.catalog)
+        self.import_engine = ImportEngine(self, self.performance_options["import_workers"],
+            self.hash_index)
+        # Files waiting to be trashed are no longer originals of imports
+        self.trash_queue.changed.connect(
+            lambda: self.hash_index.setExcludedPaths(self.trash_queue.pendingPaths()))
+        self.import_engine.file_imported.connect(self.addImportedImage)
+        self.import_engine.import_failed.connect(self.collectFailedImport)
+        self.import_engine.finished.connect(self.finishImport)
+        self.import_engine.state_changed.connect(self.stopEnumerationsIfCancelled)
+        # Imported images are added to the model in batches
+        self.imported_entries = []
+        self.failed_imports = [] # (source path, error message) of files not copied
+        self.drop_enumerators = [] # Workers that list the folders dropped on the view
+        self.import_flush_timer = QTimer(self, singleShot=True, interval=100, 
+            timeout=self.flushImportedImages)
+
+        self.import_dock = QDockWidget()
+        self.import_dock.setObjectName("ImportDock")
+        self.import_dock.setWindowTitle("Import Progress")
+        self.import_dock.setAllowedAreas(Qt.DockWidgetArea.BottomDockWidgetArea)
+        self.import_dock.setWidget(ImportProgressPanel(self.import_engine))
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.import_dock)
+        self.import_dock.hide()
+
+    def displayProfilerDock(self):
+        """Dock widget that displays how often the instrumented slots and 
+        model methods were called and how long they took."""
+        self.profiler_dock = ProfilerDock(profiler, self)
+        self.profiler_dock.setAllowedAreas(Qt.DockWidgetArea.BottomDockWidgetArea)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.profiler_dock)
+
     def updateDockInfo(self):
         """Slot to update the image that the dock widget displays."""
         # Only display an image if one item is selected
-        if (len(self.image_view_lw.selectedItems()) == 0 or 
-            len(self.image_view_lw.selectedItems()) > 1):
+        selected_rows = self.image_view_lv.selectedRows()
+        self.find_similar_act.setEnabled(len(selected_rows) == 1)
+        if len(selected_rows) == 0 or len(selected_rows) > 1:
             self.image_preview_dock.setWindowTitle("Show Image View")
-            self.display_image_label.clear()
+            self.preview_view.clear()
         else:
-            curr_item = self.image_view_lw.currentItem()
-            self.image_preview_dock.setWindowTitle(curr_item.text())
+            curr_index = self.image_model.index(selected_rows[0])
+            self.image_preview_dock.setWindowTitle(curr_index.data())
             self.show_dock_act.setText("Show Image View") 
 
-            # Get the current height of the dock widget
-            dock_height = self.image_preview_dock.height()
-            # Get the size of the original image/item
-            icon_size = curr_item.icon().availableSizes()[0]
-            icon_width = icon_size.width()
+            # Display the thumbnail at once while the part of the image in 
+            # view is decoded in tiles on a worker thread
+            image_path = self.image_model.path(curr_index.row())
+            icon = self.image_model.thumbnail(curr_index.row())
+            preview_image = None
+            if icon is not None:
+                level = self.thumbnail_loader.thumbnail_size
+                preview_image = icon.pixmap(level, level).toImage()
+            self.preview_view.setImage(image_path, preview_image)
+            self.prefetchNeighbours(self.proxy_model.mapFromSource(curr_index).row())
 
-            # Return a pixmap from the item's icon and display in the scroll area
-            pixmap = curr_item.icon().pixmap(QSize(icon_width, dock_height)) 
-            self.display_image_label.setPixmap(pixmap)
-            self.view_scroll_area.setWidget(self.display_image_label) 
+    def prefetchNeighbours(self, row):
+        """Prefetch the previews of the images before and after 'row' of the 
+        view, i.e. in the current sort order and among the images that match
+        the filter, starting with the direction the user is moving in."""
+        depth = self.performance_options["prefetch_depth"]
+        forward = row >= self.preview_row
+        self.preview_row = row
+        neighbour_rows = []
+        for distance in range(1, depth + 1):
+            ahead, behind = row + distance, row - distance
+            neighbour_rows.extend((ahead, behind) if forward else (behind, ahead))
+        self.tile_loader.prefetch([self.image_model.path(self.proxy_model.sourceRow(neighbour_row)) 
+            for neighbour_row in neighbour_rows 
+            if 0 <= neighbour_row < self.proxy_model.rowCount()], self.preview_view.size())
         
     def importImages(self):
-        """Import the images a user selects, remove duplicates, and add
-        items to the QListWidget."""
-        duplicate_images = [] # Store the names of duplicate images
+        """Hand the images a user selects to the import engine, which copies 
+        them on worker threads. Images are added to the model as they are 
+        copied and duplicates and failures are reported in finishImport()."""
+        patterns = " ".join(f"*{extension} *{extension.upper()}" for extension in IMAGE_EXTENSIONS)
         image_paths, _ = QFileDialog.getOpenFileNames(self, 
-            "Select Image Files", "", "Images (*.png *.xpm *.jpg *.jpeg)")
+            "Select Image Files", "", f"Images ({patterns})")
+
+        if image_paths and self.isImportLocationAvailable():
+            self.import_engine.addFiles(image_paths, self.library_roots[0], 
+                self.is_delete_checked, self.performance_options["import_mode"])
+            self.import_dock.show()
+
+    def isImportLocationAvailable(self):
+        """Return True if the Images Location exists, otherwise warn the user."""
+        if os.path.isdir(self.library_roots[0]):
+            return True
+        QMessageBox.warning(self, "Images Location Not Found",
+            """<p>The Images Location cannot be found. Restart the application to
+            recreate the directory.</p>""")
+        return False
 
+    def importDroppedFiles(self, paths):
+        """Import the files and folders dropped onto the list view. Folders 
+        are listed recursively on worker threads and their images are handed
+        to the import engine batch by batch as they are found, so the first
+        images appear while the rest of a large tree is still being listed.
+        The engine is held open until every folder has been listed, so the
+        whole drop is reported as one import."""
+        if not self.isImportLocationAvailable():
+            return
+        import_root = self.library_roots[0]
+        image_paths = [path for path in paths if os.path.isfile(path) 
+            and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS]
         if image_paths:
-            if self.image_dir.exists():
-                for image_path in image_paths:
-                    # Pass image path to QFileInfo object
-                    image_info = QFileInfo(image_path) 
-                    file_name = image_info.fileName()
-                    item_name = image_info.baseName()
-
-                    # Copy the files into the Images directory, check for files 
-                    # with the same name
-                    new_name = self.image_dir.absolutePath() + f"/{file_name}"
-                    file_exists = QFile.copy(image_path, new_name)
-                    if file_exists == False:
-                        duplicate_images.append(image_path)
-                    else:
-                        self.createListItems(image_path, item_name, image_info, new_name)
-                        if self.is_delete_checked == True: # Handle deleting images
-                            QFile.moveToTrash(image_path) 
-            else:
-                QMessageBox.warning(self, "Images Location Not Found",
-                    """<p>The Images Location cannot be found. Restart the application to
-                    recreate the directory.</p>""")
+            self.import_engine.addFiles(image_paths, import_root, 
+                self.is_delete_checked, self.performance_options["import_mode"])
+        for folder in filter(os.path.isdir, paths):
+            enumerator = DirectoryScanner(folder, self, recursive=True, 
+                extensions=IMAGE_EXTENSIONS)
+            enumerator.batch_ready.connect(partial(self.importScannedFiles, import_root))
+            enumerator.finished.connect(partial(self.finishEnumeration, enumerator))
+            self.drop_enumerators.append(enumerator)
+            self.import_engine.hold()
+            enumerator.start()
+        if image_paths or self.drop_enumerators:
+            self.import_dock.show()
+
+    def importScannedFiles(self, import_root, entries):
+        """Slot that hands a batch of images found in a dropped folder to 
+        the import engine. Their sizes are known from the scan."""
+        self.import_engine.addFiles([entry[0] for entry in entries], import_root,
+            self.is_delete_checked, self.performance_options["import_mode"],
+            [entry[1] for entry in entries])
+
+    def stopEnumerationsIfCancelled(self):
+        """Slot that stops listing dropped folders when the import is 
+        cancelled. The images found so far can still be resumed."""
+        if self.import_engine.isCancelled():
+            for enumerator in self.drop_enumerators:
+                enumerator.cancel()
+
+    def finishEnumeration(self, enumerator, found, cancelled):
+        """Slot called when a dropped folder has been listed."""
+        self.drop_enumerators.remove(enumerator)
+        enumerator.deleteLater()
+        if found == 0 and not cancelled:
+            self.statusBar().showMessage(f"No images found in {enumerator.directory}", 5000)
+        self.import_engine.release()
+
+    def addImportedImage(self, source, entry):
+        """Slot that collects imported images until the next batch is added."""
+        self.imported_entries.append(entry)
+        if not self.import_flush_timer.isActive():
+            self.import_flush_timer.start()
 
+    def collectFailedImport(self, source, error):
+        """Slot that collects the files that could not be copied until the 
+        import finishes."""
+        self.failed_imports.append((source, error))
+
+    def flushImportedImages(self):
+        """Add the images imported since the last batch to the model. A sync
+        that was running when the import started may have added some of 
+        them already."""
+        entries, self.imported_entries = self.imported_entries, []
+        new_entries, changed_entries = self.mergeEntries(entries)
+        self.hash_indexer.addEntries(new_entries + changed_entries)
+        self.metadata_extractor.addEntries(new_entries + changed_entries)
+
+    def finishImport(self, duplicate_images):
+        """Slot called when the import engine has copied every file."""
+        self.flushImportedImages()
+        for root in self.sync_pending:
+            self.library_watchers[root].scheduleSync()
+        modes_used = ", ".join(f"{count:,} {IMPORT_MODES[mode].split(' (')[0].lower()}" 
+            for mode, count in self.import_engine.modes_used.items())
+        if modes_used:
+            self.statusBar().showMessage(f"Imported images: {modes_used}", 5000)
         # Display a custom dialog to inform the user of duplicate images
         if len(duplicate_images) != 0:
             duplicates_dialog = QMessageBox(self)
@@ -222,96 +563,589 @@ class MainWindow(QMainWindow):
             duplicates_dialog.setText("""<p>Some images were not imported because 
                 they already exist.</p>""")
 
-            details = '\n'.join([item for item in duplicate_images])
+            details = '\n'.join([f"{source} (same as {os.path.basename(original)})" 
+                for source, original in duplicate_images])
             duplicates_dialog.setDetailedText(details)
             duplicates_dialog.exec()
 
             duplicate_images.clear() # Clear the list 
+        # Display the files that could not be copied, e.g. unreadable ones
+        if len(self.failed_imports) != 0:
+            failures_dialog = QMessageBox(self)
+            failures_dialog.setIcon(QMessageBox.Icon.Warning)
+            failures_dialog.setWindowTitle("Import Failed")
+            failures_dialog.setText(f"""<p>{len(self.failed_imports):,} image(s) 
+                could not be imported.</p>""")
+
+            details = '\n'.join([f"{source}: {error}" 
+                for source, error in self.failed_imports])
+            failures_dialog.setDetailedText(details)
+            self.failed_imports.clear()
+            failures_dialog.exec()
         # Check if window is still in focus. If not, give it focus
         if self.isActiveWindow() == False:
             self.activateWindow()
 
-    def createListItems(self, image_path, item_name, image_info, new_name=None):
-        """Simple method for creating QListWidgetItem objects. 
-        'image_path': the path to the file.
-        'item_name': the base name used for QListWidgetItem objects.
-        'image_info': the QFileInfo object.
-        'new_name': used when importing new photos, making sure the program
-        points to the new image location."""
-        list_item = QListWidgetItem(QIcon(image_path), item_name)
-        self.image_view_lw.setIconSize(QSize(80, 80))
-        self.image_view_lw.addItem(list_item)
-        if new_name != None:
-            image_info.setFile(new_name)
-        self.image_view_lw.images_info_list.append(image_info) 
+    def updateThumbnail(self, image_path, image, original_size):
+        """Slot that replaces an item's placeholder icon with its thumbnail.
+        The thumbnail is decoded in the background when the view first asks
+        the model for the item's icon."""
+        if self.image_model.setThumbnail(image_path, image, original_size):
+            entry = self.image_model.entry(self.image_model.rowForPath(image_path))
+            self.pending_dimensions.append(entry + (original_size.width(), original_size.height()))
+            self.dimensions_timer.start()
+        if "time_to_first_thumbnail_ms" not in self.startup_metrics:
+            row = self.image_model.rowForPath(image_path)
+            if row in self.image_view_lv.visibleRows():
+                self.recordStartupMetric("time_to_first_thumbnail_ms")
+
+    def markThumbnailFailed(self, image_path):
+        """Slot called when the thumbnail of 'image_path' can't be decoded,
+        e.g. because the file is damaged."""
+        self.image_model.setThumbnailFailed(image_path)
+
+    def storeDimensions(self):
+        """Write the image sizes collected from thumbnails to the catalog."""
+        records, self.pending_dimensions = self.pending_dimensions, []
+        QThreadPool.globalInstance().start(partial(self.catalog.setDimensions, records))
+
+    def recordStartupMetric(self, name):
+        """Store the time since the window was created under 'name'. The 
+        values are kept in the settings so that startup regressions can be 
+        tracked across runs."""
+        elapsed = self.startup_timer.elapsed()
+        self.startup_metrics[name] = elapsed
+        self.settings.setValue(f"metrics/{name}", elapsed)
+
+    def showThumbnailCacheStats(self, pending):
+        """Display the thumbnail cache's hit/miss counters in the status bar 
+        once all of the queued thumbnails have been loaded."""
+        if pending == 0:
+            stats = self.thumbnail_cache.stats()
+            self.statusBar().showMessage(f"Thumbnail cache: {stats['hits']:,} hits, " 
+                f"{stats['misses']:,} misses, {stats['bytes'] / 1048576:.1f} MB used")
+
+    def prioritizeVisibleThumbnails(self):
+        """Move the thumbnails of the items in the viewport to the front
+        of the thumbnail loader's queue. The thumbnails of the items a
+        screen above and below are kept in memory, or loaded after the
+        visible ones, so that scrolling a little doesn't show placeholders."""
+        self.image_model.setResidentRows(self.image_view_lv.visibleRows(margin=1))
+        rows = self.image_view_lv.visibleRows()
+        self.thumbnail_loader.prioritize([self.image_model.path(row) for row in rows])
+
+    def showMemoryUsage(self):
+        """Display the memory used by the thumbnails in the list. Only used 
+        in debug mode."""
+        stats = self.image_model.decorations.stats()
+        self.memory_label.setText(f"Thumbnails in memory: {stats['icons']:,} "
+            f"({stats['bytes'] / 1048576:.1f} of {stats['budget'] / 1048576:.0f} MB), "
+            f"{stats['evicted']:,} evicted")
+
+    def changeIconSize(self, size):
+        """Display the icons at 'size' pixels. The view scales the current
+        thumbnails, which are only loaded again if a different level of the
+        thumbnail pyramid fits the new size. The levels are all stored in
+        the thumbnail cache, so the original images aren't decoded."""
+        self.icon_size = size
+        self.image_view_lv.setThumbnailSize(size)
+        level = nearestLevel(size)
+        if level != self.thumbnail_loader.thumbnail_size:
+            self.thumbnail_loader.setThumbnailSize(level)
+            self.image_model.placeholder_icon = QIcon(placeholderPixmap(level))
+            self.image_model.failed_icon = QIcon(placeholderPixmap(level, True))
+            self.image_model.reloadThumbnails()
+        self.visible_items_timer.start()
 
     def sortListItems(self, order): 
-        """First, sort the items in the QListWidget using sortItems(). Then handle 
-        sorting the QFileInfo objects in the images_info_list using Python's sort() to 
-        match how the QListWidget sorts items."""
-        self.image_view_lw.sortItems(order)
-        if order == Qt.SortOrder.AscendingOrder:
-            self.image_view_lw.images_info_list.sort(key=lambda item: (item.baseName().upper(), item.baseName()[0].islower()))
-        elif order == Qt.SortOrder.DescendingOrder:
-            self.image_view_lw.images_info_list.sort(reverse=True, key=lambda item: (item.baseName().upper(), item.baseName()[0].islower()))
+        """Sort the images in the model by the current sort field. The model 
+        rearranges its rows and the view keeps the current selection."""
+        self.sort_order = order
+        self.settings.setValue("sort/order", order.value)
+        self.image_model.sort(0, order, self.sort_field)
+
+    def changeSortField(self, action):
+        """Slot that sorts the images by the field of the chosen action."""
+        self.sort_field = action.data()
+        self.settings.setValue("sort/field", self.sort_field)
+        if self.image_model.rowCount() > 0:
+            self.sortListItems(self.sort_order)
 
     def deleteImages(self):
-        """Delete images from the QListWidget and from where images
+        """Delete images from the model and from where images
         are stored on disk."""
-        number_of_photos = len(self.image_view_lw.selectedItems())
+        selected_rows = self.image_view_lv.selectedRows()
+        number_of_photos = len(selected_rows)
         answer = QMessageBox.warning(self, "Delete Image(s)", 
             f"Are you sure you want to delete {number_of_photos} image(s)?", 
             QMessageBox.StandardButton.No | QMessageBox.StandardButton.Yes, 
             QMessageBox.StandardButton.No)
 
         if answer == QMessageBox.StandardButton.Yes:
-            for item in self.image_view_lw.selectedItems():
-                index = self.image_view_lw.indexFromItem(item).row()
-                # Get the image's information before deletion
-                image_info = self.image_view_lw.images_info_list[index] 
-
-                # Remove items from the Images directory, from the list widget, 
-                # and the images_info_list that stores QFileInfo objects
-                QFile.moveToTrash(image_info.absoluteFilePath()) 
-                self.image_view_lw.takeItem(index)
-                del self.image_view_lw.images_info_list[index] 
-                del item        
+            # Remove the selection from the model in contiguous ranges. The 
+            # files are moved to the trash in the background once the 
+            # deletion can no longer be undone
+            removed = self.image_model.removeRowList(selected_rows)
+            self.trash_queue.enqueue(removed)
+            self.statusBar().showMessage(f"Deleted {len(removed):,} image(s). "
+                f"Press {self.undo_delete_act.shortcut().toString()} within "
+                f"{UNDO_SECONDS} seconds to undo.", UNDO_SECONDS * 1000)
+
+    def undoDelete(self):
+        """Put the most recently deleted images back into the model."""
+        removed = self.trash_queue.undo()
+        if removed is None:
+            return
+        self.image_model.insertEntries(removed)
+        self.statusBar().showMessage(f"Restored {len(removed):,} image(s)", 3000)
+
+    def removeTrashedImages(self, trashed, failed):
+        """Slot that removes images from the catalog and the similarity 
+        index after their files were moved to the trash."""
+        QThreadPool.globalInstance().start(partial(self.catalog.removeFiles, trashed))
+        for image_path in trashed:
+            self.similarity_tree.remove(image_path)
+        if failed:
+            self.statusBar().showMessage(f"{len(failed):,} image(s) could not be "
+                "moved to the trash", 5000)
 
     def loadStoredImageData(self):
-        """Load images from the Images directory. The Images directory is 
-        created the first time running the application."""
-        if not(self.image_dir.exists()):
-            QDir().mkdir(self.images_path)
-        elif self.image_dir.exists():
-            # Create a list of the files in the Images directory
-            images = self.image_dir.entryInfoList(QDir.Filter.AllEntries | QDir.Filter.NoDotAndDotDot)
-            for image in images: 
-                # Imported files are QFileInfo objects
-                item_name = image.baseName()
-                path = image.absoluteFilePath()
-                self.createListItems(path, item_name, image) 
-
-    def displayImageInfoDialog(self, item): 
+        """Load the images of the library roots. The first root is the Images
+        directory that images are imported to; it defaults to the Images
+        directory in the working directory until other roots are chosen in
+        the Preferences dialog."""
+        self.library_roots = [] # Absolute paths, the import location first
+        self.scanners = {} # The DirectoryScanner of each root
+        self.library_watchers = {} # The LibraryWatcher of each root
+        # Each root is scanned on its own thread, so a slow disk or network 
+        # mount doesn't hold up the others
+        self.scan_pool = QThreadPool(self)
+        self.scanned_paths = {} # Paths seen by the running scan of each root
+        self.scan_found = {} # Number of files found so far by each scan
+        self.progress_roots = set() # Roots whose scans show their progress
+        self.recent_roots = set() # Roots whose scans saw files being written
+        self.sync_pending = set() # Roots whose sync waits for a scan or import
+        roots = self.settings.value("library/roots", [], type=list)
+        self.setLibraryRoots(roots or [QDir(self.images_path).absolutePath()])
+
+    def setLibraryRoots(self, roots):
+        """Display the images of the directories in 'roots'. The images of 
+        roots that are no longer in the list are removed from the view, and
+        roots that were added are loaded and scanned."""
+        removed = [root for root in self.library_roots if root not in roots]
+        added = [root for root in roots if root not in self.library_roots]
+        if roots[0] in self.library_roots[1:] and not isSharded(roots[0]):
+            # A root that becomes the import location has its images moved
+            # into subdirectories first, so it is loaded again
+            removed.append(roots[0])
+            added.insert(0, roots[0])
+        self.library_roots = list(roots)
+        self.hash_index.setLibraryRoots(self.library_roots)
+        running = 0 # Scans of removed roots keep their thread until they stop
+        for root in removed:
+            scanner = self.scanners.pop(root, None)
+            if scanner is not None:
+                self.scan_cancel_button.clicked.disconnect(scanner.cancel)
+                if scanner.isRunning():
+                    scanner.cancel()
+                    running += 1
+            if root in self.library_watchers:
+                self.library_watchers.pop(root).deleteLater()
+            self.sync_pending.discard(root)
+            self.progress_roots.discard(root)
+        self.scan_pool.setMaxThreadCount(max(1, len(roots) + running))
+        if removed:
+            prefixes = tuple(os.path.join(root, "") for root in removed)
+            removed_rows = self.image_model.removeRowList([row for row in 
+                range(self.image_model.rowCount()) 
+                if self.image_model.path(row).startswith(prefixes)])
+            for _, entry in removed_rows:
+                self.similarity_tree.remove(entry[0])
+            if not self.progress_roots:
+                self.hideScanProgress()
+        for root in added:
+            self.loadLibraryRoot(root)
+        if "catalog_ms" not in self.startup_metrics:
+            self.recordStartupMetric("catalog_ms")
+
+    def loadLibraryRoot(self, root, migrate=True):
+        """Load the images of 'root'. The images stored in the catalog are 
+        displayed right away. The directory is then scanned on a worker 
+        thread to add, update and remove images that changed since the last
+        run, so the window stays responsive. The import location is created
+        the first time running the application and keeps its images in 
+        subdirectories; if it keeps them in the directory itself, as in 
+        older versions, they are moved first. Other roots are scanned as 
+        they are and skipped if they can't be found, e.g. on a disk that 
+        isn't connected."""
+        if not os.path.isdir(root):
+            if root != self.library_roots[0]:
+                self.statusBar().showMessage(f"Library folder not found: {root}", 5000)
+                return
+            QDir().mkpath(root)
+            createShards(root)
+        elif root == self.library_roots[0] and not isSharded(root) and migrate:
+            self.migrateLibrary(root)
+            return
+        records = self.catalog.loadDirectory(root)
+        self.image_model.appendEntries(records)
+        self.addPerceptualHashes([(record[0], record[6] & 0xFFFFFFFFFFFFFFFF) 
+            for record in records if record[6] is not None])
+        self.hash_indexer.addEntries([record[:3] for record in records 
+            if record[6] is None])
+        self.metadata_extractor.addEntries([record[:3] for record in records 
+            if not record[7]])
+        if records and self.settings.contains("sort/field"):
+            self.sortListItems(self.sort_order)
+        self.startScan(root, show_progress=True)
+        self.watchLibraryRoot(root)
+
+    def migrateLibrary(self, root):
+        """Move the images of a library from an older version into the 
+        subdirectories on a worker thread, then load the library. Imports 
+        wait until the images have been moved."""
+        self.import_act.setEnabled(False)
+        self.migrator = LibraryMigrator(root, self.catalog, self.thumbnail_cache, self)
+        self.migrator.progress.connect(self.updateMigrationProgress)
+        self.migrator.finished.connect(self.finishMigration)
+        self.migrator.failed.connect(self.finishMigration)
+        self.scan_progress_label.setText("Moving images into subfolders")
+        for widget in (self.scan_progress_label, self.scan_progress_bar):
+            widget.show()
+        self.migrator.start()
+
+    def updateMigrationProgress(self, moved, total):
+        """Slot that displays how many images have been moved."""
+        self.scan_progress_bar.setRange(0, total)
+        self.scan_progress_bar.setValue(moved)
+        self.scan_progress_label.setText(f"Moving images into subfolders: {moved:,} of {total:,}")
+
+    def finishMigration(self, result):
+        """Slot that loads the library once its images have been moved. If 
+        moving failed, the library is loaded as it is and migrated again 
+        on the next start."""
+        self.scan_progress_bar.setRange(0, 0)
+        self.import_act.setEnabled(True)
+        if isinstance(result, str):
+            self.statusBar().showMessage(f"Images could not be moved: {result}", 5000)
+        if self.migrator.library in self.library_roots:
+            self.loadLibraryRoot(self.migrator.library, migrate=False)
+
+    def startScan(self, root, show_progress=False):
+        """Scan 'root' on a worker thread. Each batch is compared with the 
+        model, so only the images that were added, changed or removed since
+        the last scan update it."""
+        scanner = self.scanners.get(root)
+        if scanner is None:
+            scanner = DirectoryScanner(root, self, recursive=True)
+            scanner.batch_ready.connect(partial(self.addScannedImages, scanner))
+            scanner.progress.connect(partial(self.updateScanProgress, scanner))
+            scanner.finished.connect(partial(self.finishScan, scanner))
+            self.scan_cancel_button.clicked.connect(scanner.cancel)
+            self.scanners[root] = scanner
+
+        self.scanned_paths[root] = set()
+        self.scan_found[root] = 0
+        self.recent_roots.discard(root)
+        if show_progress:
+            self.progress_roots.add(root)
+            for widget in (self.scan_progress_label, self.scan_progress_bar, 
+                self.scan_cancel_button):
+                widget.show()
+        scanner.start(self.scan_pool)
+
+    def watchLibraryRoot(self, root):
+        """Watch 'root' so that images added, removed or replaced by other 
+        programs show up without restarting. Bursts of changes, e.g. from 
+        copying a folder into the directory, are collapsed into a single 
+        scan. The subdirectories of the import location are watched too; 
+        of other roots only the top directory is watched, since watching 
+        every folder of a large tree is expensive."""
+        directories = [root] + (shardDirectories(root) if isSharded(root) else [])
+        self.library_watchers[root] = LibraryWatcher(directories, self)
+        self.library_watchers[root].sync_requested.connect(partial(self.syncLibrary, root))
+
+    def syncLibrary(self, root):
+        """Slot that scans 'root' after its files changed. The sync waits 
+        while the root is being scanned, or while the import engine is 
+        copying files into the import location, which it adds to the model
+        itself."""
+        scanner = self.scanners.get(root)
+        if ((scanner is not None and scanner.isRunning()) or 
+            (root == self.library_roots[0] and self.import_engine.isActive())):
+            self.sync_pending.add(root)
+            return
+        self.sync_pending.discard(root)
+        if root in self.library_roots:
+            self.startScan(root)
+
+    def mergeEntries(self, entries):
+        """Add the (path, size, mtime) entries that aren't in the model and 
+        update the rows whose files have changed. Returns a tuple of the 
+        lists of new and changed entries."""
+        new_entries, changed_entries = [], []
+        for entry in entries:
+            row = self.image_model.rowForPath(entry[0])
+            if row == -1:
+                new_entries.append(entry)
+            elif self.image_model.entry(row) != entry:
+                self.image_model.updateEntry(row, entry[1], entry[2])
+                changed_entries.append(entry)
+        self.image_model.appendEntries(new_entries)
+        return new_entries, changed_entries
+
+    def addScannedImages(self, scanner, entries):
+        """Slot that compares a batch of scanned images with the model. New 
+        images are added, changed images are updated, and the catalog is 
+        updated in the background. Deleted images whose files haven't been
+        moved to the trash yet are skipped, as are the batches of roots that
+        were removed."""
+        root = scanner.directory
+        if self.scanners.get(root) is not scanner:
+            return
+        if "first_batch_ms" not in self.startup_metrics:
+            self.recordStartupMetric("first_batch_ms")
+        trashed_paths = self.trash_queue.pendingPaths()
+        if trashed_paths:
+            entries = [entry for entry in entries if entry[0] not in trashed_paths]
+        self.scanned_paths[root].update(entry[0] for entry in entries)
+        # Files modified in the last seconds may still be being written
+        recent = time.time_ns() - RECENT_FILE_NS
+        if any(entry[2] > recent for entry in entries):
+            self.recent_roots.add(root)
+        new_entries, changed_entries = self.mergeEntries(entries)
+        if new_entries or changed_entries:
+            QThreadPool.globalInstance().start(partial(self.catalog.updateFiles, 
+                new_entries + changed_entries))
+            self.hash_indexer.addEntries(new_entries + changed_entries)
+            self.metadata_extractor.addEntries(new_entries + changed_entries)
+
+    def updateScanProgress(self, scanner, found):
+        """Slot that displays the number of images found so far by the scans
+        that show their progress."""
+        if self.scanners.get(scanner.directory) is not scanner:
+            return
+        self.scan_found[scanner.directory] = found
+        total = sum(self.scan_found.get(root, 0) for root in self.progress_roots)
+        folders = f" in {len(self.progress_roots)} folders" if len(self.progress_roots) > 1 else ""
+        self.scan_progress_label.setText(f"Scanning: {total:,} images{folders}")
+
+    def hideScanProgress(self):
+        """Hide the widgets that show the progress of scans."""
+        for widget in (self.scan_progress_label, self.scan_progress_bar, 
+            self.scan_cancel_button):
+            widget.hide()
+
+    def finishScan(self, scanner, found, cancelled):
+        """Slot that removes the images of a root that are no longer in its
+        directory. The progress widgets are hidden once every scan that 
+        shows them has finished, and the time each root took is displayed."""
+        root = scanner.directory
+        if self.scanners.get(root) is not scanner:
+            return
+        if root in self.progress_roots:
+            self.progress_roots.discard(root)
+            if not self.progress_roots:
+                if "scan_ms" not in self.startup_metrics:
+                    self.recordStartupMetric("scan_ms")
+                self.hideScanProgress()
+                self.statusBar().showMessage("Scanned " + ", ".join(
+                    f"{os.path.basename(scanned_root)}: {root_scanner.found:,} images "
+                    f"in {root_scanner.scan_ms:,} ms" for scanned_root, root_scanner in 
+                    self.scanners.items() if root_scanner.scan_ms is not None), 5000)
+        if root in self.sync_pending:
+            self.library_watchers[root].scheduleSync()
+        elif root in self.recent_roots:
+            self.library_watchers[root].scheduleRecheck()
+        scanned_paths = self.scanned_paths.pop(root, set())
+        if cancelled:
+            self.statusBar().showMessage(f"Scan cancelled after {found:,} images", 5000)
+            return
+        # Images in the catalog that are no longer in the directory. Images 
+        # imported while scanning may not have been seen by the scan
+        prefix = os.path.join(root, "")
+        missing_rows = [row for row in range(self.image_model.rowCount()) 
+            if self.image_model.path(row).startswith(prefix)
+            and self.image_model.path(row) not in scanned_paths
+            and not os.path.exists(self.image_model.path(row))]
+        removed = self.image_model.removeRowList(missing_rows)
+        missing_paths = [entry[0] for row, entry in removed]
+        for image_path in missing_paths:
+            self.similarity_tree.remove(image_path)
+        QThreadPool.globalInstance().start(partial(self.catalog.removeFiles, missing_paths))
+
+    def libraryStatistics(self):
+        """Return a dictionary that maps each library root to a tuple of the
+        number of images it holds in the view and the duration of its last
+        scan in milliseconds, None if it hasn't been scanned."""
+        counts = dict.fromkeys(self.library_roots, 0)
+        prefixes = [(os.path.join(root, ""), root) for root in self.library_roots]
+        for row in range(self.image_model.rowCount()):
+            image_path = self.image_model.path(row)
+            root = next((root for prefix, root in prefixes if image_path.startswith(prefix)), None)
+            if root is not None:
+                counts[root] += 1
+        return {root: (count, self.scanners[root].scan_ms if root in self.scanners else None)
+            for root, count in counts.items()}
+
+    def addPerceptualHashes(self, hashes):
+        """Slot that adds (path, hash) tuples computed in the background to
+        the BK-tree, skipping images that were deleted in the meantime."""
+        for image_path, image_hash in hashes:
+            if self.image_model.rowForPath(image_path) != -1:
+                self.similarity_tree.add(image_path, image_hash)
+
+    def findSimilarImages(self):
+        """Rank the library by perceptual-hash distance to the selected image
+        and display the closest images in a modeless dialog."""
+        selected_rows = self.image_view_lv.selectedRows()
+        if len(selected_rows) != 1:
+            return
+        # The query runs in the background. An image the indexer hasn't 
+        # reached yet is hashed there too
+        entry = self.image_model.entry(selected_rows[0])
+        self.similar_request = entry[0]
+        self.similar_finder.find(entry)
+
+    def showSimilarImages(self, image_path, results, elapsed_ms):
+        """Slot that displays the images closest to 'image_path' in a 
+        modeless dialog, unless another image was chosen in the meantime."""
+        if image_path != self.similar_request:
+            return
+        self.similar_request = None
+        if self.similar_dialog != None:
+            self.similar_dialog.close()
+        self.similar_dialog = SimilarImagesDialog(self, self.image_model, 
+            image_path, results, elapsed_ms)
+        self.similar_dialog.image_chosen.connect(self.selectImage)
+        self.similar_dialog.show()
+
+    def showUnreadableImage(self, image_path):
+        """Slot called when the image to find similar images for can't be read."""
+        if image_path == self.similar_request:
+            self.similar_request = None
+            self.statusBar().showMessage(f"Cannot read {os.path.basename(image_path)}", 5000)
+
+    def selectImage(self, image_path):
+        """Select the image at 'image_path' and scroll to it. The filter is 
+        cleared if it hides the image."""
+        row = self.image_model.rowForPath(image_path)
+        if row != -1:
+            index = self.proxy_model.mapFromSource(self.image_model.index(row))
+            if not index.isValid():
+                self.filter_edit.clear()
+                self.applyFilter()
+                index = self.proxy_model.mapFromSource(self.image_model.index(row))
+            self.image_view_lv.setCurrentIndex(index)
+            self.image_view_lv.scrollTo(index)
+
+    def displayImageInfoDialog(self, index): 
         """Display image metadata in a modeless dialog box. 'index' is the index of 
         the item that is clicked on."""
-        index = self.image_view_lw.indexFromItem(item).row()
+        image_info = self.catalog.record(index.data(ImageLibraryModel.PathRole))
+        if image_info is None:
+            return
         if self.info_dialog == None: 
-            self.info_dialog = ImageInfoDialog(self, self.image_view_lw.images_info_list[index])
+            self.info_dialog = ImageInfoDialog(self, image_info)
         elif self.info_dialog != None:
             self.info_dialog.close()
-            self.info_dialog = ImageInfoDialog(self, self.image_view_lw.images_info_list[index])
+            self.info_dialog = ImageInfoDialog(self, image_info)
         self.info_dialog.show()         
 
+    def filterTextChanged(self, text):
+        """Slot that filters the images on every keystroke while the query 
+        only uses the model's search index. Queries on metadata fields go to 
+        the catalog, so they wait until typing pauses."""
+        terms = parseQuery(text)
+        if terms is not None and all(field in INDEX_FIELDS for field, _ in terms):
+            self.applyFilter()
+        else:
+            self.filter_timer.start()
+
+    def applyFilter(self):
+        """Show only the images that match the query in the filter bar. Name, 
+        extension, date and size terms are answered by the model's search 
+        index; metadata terms by one catalog query. The proxy model calls 
+        the filter function again whenever the rows change."""
+        self.filter_timer.stop()
+        text = self.filter_edit.text().strip()
+        if not text:
+            self.proxy_model.setFilterFunction(None)
+            return
+        terms = parseQuery(text)
+        if terms is None:
+            self.statusBar().showMessage(f"Can't understand the filter \"{text}\"", 5000)
+            return
+        timer = QElapsedTimer()
+        timer.start()
+        self.filter_terms = terms
+        index_terms = [term for term in terms if term[0] in INDEX_FIELDS]
+        metadata_terms = [term for term in terms if term[0] not in INDEX_FIELDS]
+        paths = None
+        if metadata_terms:
+            paths = set().union(*(self.catalog.findPaths(root, metadata_terms) 
+                for root in self.library_roots))
+
+        def matchingRows():
+            rows = self.image_model.findRows(index_terms)
+            if paths is not None:
+                rows = [row for row in rows if self.image_model.path(row) in paths]
+            return rows
+        self.proxy_model.setFilterFunction(matchingRows)
+        self.statusBar().showMessage(f"{self.proxy_model.rowCount():,} of " 
+            f"{self.image_model.rowCount():,} images match the filter " 
+            f"({timer.elapsed()} ms)", 5000)
+
+    def addMetadata(self, times):
+        """Slot that receives the capture times of images whose metadata has 
+        been read. A filter on dates or metadata fields is run again, since 
+        more images may match it now."""
+        self.image_model.setCaptureTimes(times)
+        if self.proxy_model.isFiltered() and any(field not in ("name", "ext", "size") 
+            for field, _ in self.filter_terms):
+            self.filter_timer.start()
+
     def showPreferencesDialog(self):
         """Display the application's preferences dialog. Save the value of the 
-        delete_images_checkbox in the settings."""
-        prefs_dialog = PreferencesDialog(self, self.image_dir, self.is_delete_checked)
+        delete_images_checkbox and the performance options in the settings."""
+        prefs_dialog = PreferencesDialog(self, self.libraryStatistics(), 
+            self.is_delete_checked, self.performance_options)
         response = prefs_dialog.exec()
 
         if response == 1: # QDialog.DialogCode.Accepted == 1
             self.settings.setValue("delete_images", prefs_dialog.delete_images_checkbox.isChecked())
             self.is_delete_checked = self.settings.value("delete_images", type=bool)
 
+            library_roots = prefs_dialog.libraryRoots()
+            if library_roots != self.library_roots:
+                self.settings.setValue("library/roots", library_roots)
+                self.setLibraryRoots(library_roots)
+
+            self.performance_options["pool_size"] = prefs_dialog.pool_size_spinbox.value()
+            self.performance_options["queue_depth"] = prefs_dialog.queue_depth_spinbox.value()
+            self.performance_options["cache_budget_mb"] = prefs_dialog.cache_budget_spinbox.value()
+            self.performance_options["decoration_budget_mb"] = prefs_dialog.decoration_budget_spinbox.value()
+            self.performance_options["import_workers"] = prefs_dialog.import_workers_spinbox.value()
+            self.performance_options["import_mode"] = prefs_dialog.import_mode_combo.currentData()
+            self.performance_options["prefetch_depth"] = prefs_dialog.prefetch_depth_spinbox.value()
+            self.performance_options["preview_budget_mb"] = prefs_dialog.preview_budget_spinbox.value()
+            self.settings.setValue("thumbnails/pool_size", self.performance_options["pool_size"])
+            self.settings.setValue("thumbnails/queue_depth", self.performance_options["queue_depth"])
+            self.settings.setValue("thumbnails/cache_budget_mb", self.performance_options["cache_budget_mb"])
+            self.settings.setValue("thumbnails/memory_budget_mb", self.performance_options["decoration_budget_mb"])
+            self.settings.setValue("import/workers", self.performance_options["import_workers"])
+            self.settings.setValue("import/mode", self.performance_options["import_mode"])
+            self.settings.setValue("preview/prefetch_depth", self.performance_options["prefetch_depth"])
+            self.settings.setValue("preview/cache_budget_mb", self.performance_options["preview_budget_mb"])
+            self.thumbnail_loader.setPoolSize(self.performance_options["pool_size"])
+            self.thumbnail_loader.setQueueDepth(self.performance_options["queue_depth"])
+            self.thumbnail_cache.setBudget(self.performance_options["cache_budget_mb"] * 1024 * 1024)
+            self.image_model.decorations.setBudget(
+                self.performance_options["decoration_budget_mb"] * 1024 * 1024)
+            self.image_model.evictDecorations()
+            self.import_engine.setMaxWorkers(self.performance_options["import_workers"])
+            self.tile_loader.setBudget(self.performance_options["preview_budget_mb"] * 1024 * 1024)
+
     def displayFullScreen(self, state):
         """Check the state of checkable fullscreen_act. If True, show the 
         main window as fullscreen."""
@@ -350,10 +1184,22 @@ class MainWindow(QMainWindow):
         self.settings.setValue("position", self.pos())
         self.settings.setValue("size", self.size())
         self.settings.setValue("window_state", self.saveState())
+        self.settings.setValue("view/icon_size", self.icon_size)
 
     def closeEvent(self, event):
         """Save the application's settings in the closeEvent()."""
         self.saveSettings()
+        self.trash_queue.flush(wait=True)
+        for scanner in list(self.scanners.values()) + self.drop_enumerators:
+            scanner.cancel()
+        self.import_engine.cancel()
+        self.import_engine.pool.waitForDone()
+        self.hash_index.close()
+        self.hash_indexer.stop()
+        self.similar_finder.pool.waitForDone()
+        self.metadata_extractor.stop()
+        self.tile_loader.shutdown()
+        self.thumbnail_loader.shutdown()
         event.setAccepted(True)
 
 # NOTE: Left here for your reference and should you decide to run the application
@@ -0,0 +1,99 @@
+"""Image Manager GUI, Part 2
+Memory-budgeted store for the thumbnail icons shown by the list view
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from collections import OrderedDict
+from PyQt6.QtGui import QIcon
+
+DECORATION_BUDGET_MB = 64 # Default memory limit for thumbnail icons
+
+class DecorationCache:
+
+    def __init__(self, budget_bytes=DECORATION_BUDGET_MB * 1024 * 1024):
+        """Keeps the thumbnail icons of the model's rows and how much memory
+        their pixmaps use. Each icon is stored in a slot and rows refer to
+        it by the slot's handle. Slots are kept in least recently used
+        order, and evict() frees the oldest ones once the icons use more
+        than 'budget_bytes', except those of the rows that are on screen
+        or close to it. Evicted thumbnails are loaded again from the
+        thumbnail cache when their rows are displayed."""
+        self.budget_bytes = budget_bytes
+        self._icons = [] # QIcon objects referenced by the handles
+        self._paths = [] # Image path of each slot
+        self._sizes = [] # Bytes used by each slot's pixmap
+        self._free_slots = []
+        self._recent = OrderedDict() # Handles in use, least recently used first
+        self.bytes_used = 0
+        self.evicted = 0 # Number of icons evicted so far
+
+    def __len__(self):
+        """Return the number of icons in memory."""
+        return len(self._recent)
+
+    def add(self, image_path, pixmap):
+        """Store the thumbnail 'pixmap' of 'image_path' and return its handle."""
+        size = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        icon = QIcon(pixmap)
+        if self._free_slots:
+            handle = self._free_slots.pop()
+            self._icons[handle], self._paths[handle], self._sizes[handle] = icon, image_path, size
+        else:
+            handle = len(self._icons)
+            self._icons.append(icon)
+            self._paths.append(image_path)
+            self._sizes.append(size)
+        self._recent[handle] = None
+        self.bytes_used += size
+        return handle
+
+    def replace(self, handle, pixmap):
+        """Replace the icon of 'handle' with a new thumbnail."""
+        size = pixmap.width() * pixmap.height() * pixmap.depth() // 8
+        self.bytes_used += size - self._sizes[handle]
+        self._icons[handle], self._sizes[handle] = QIcon(pixmap), size
+        self._recent.move_to_end(handle)
+
+    def icon(self, handle):
+        """Return the QIcon of 'handle' and mark it as recently used."""
+        self._recent.move_to_end(handle)
+        return self._icons[handle]
+
+    def release(self, handle):
+        """Free the slot referenced by 'handle', if any."""
+        if handle >= 0 and self._icons[handle] is not None:
+            self.bytes_used -= self._sizes[handle]
+            self._icons[handle] = self._paths[handle] = None
+            self._sizes[handle] = 0
+            del self._recent[handle]
+            self._free_slots.append(handle)
+
+    def setBudget(self, budget_bytes):
+        """Change the memory limit. Call evict() to apply it."""
+        self.budget_bytes = budget_bytes
+
+    def evict(self, resident_paths):
+        """Free the least recently used icons until the budget is met, except
+        those of 'resident_paths'. Return the paths of the evicted icons."""
+        evicted = []
+        if self.bytes_used <= self.budget_bytes:
+            return evicted
+        for handle in list(self._recent):
+            if self.bytes_used <= self.budget_bytes:
+                break
+            image_path = self._paths[handle]
+            if image_path in resident_paths:
+                continue
+            self.release(handle)
+            evicted.append(image_path)
+        self.evicted += len(evicted)
+        return evicted
+
+    def stats(self):
+        """Return a dictionary with the memory use and eviction counter."""
+        return {"icons": len(self._recent), "bytes": self.bytes_used,
+            "budget": self.budget_bytes, "evicted": self.evicted}
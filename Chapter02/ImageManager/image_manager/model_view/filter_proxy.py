@@ -0,0 +1,185 @@
+"""Image Manager GUI, Part 2
+Proxy model that shows the images matching the filter bar
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import bisect
+from array import array
+from PyQt6.QtCore import QObject, QModelIndex, QPersistentModelIndex, QAbstractProxyModel
+
+class ImageFilterProxyModel(QAbstractProxyModel):
+
+    def __init__(self, parent=None):
+        """Proxy that shows a subset of the rows of an ImageLibraryModel.
+        Unlike QSortFilterProxyModel, it doesn't call a method for every row:
+        the filter function returns the accepted source rows at once, e.g.
+        from a catalog query. Without a filter, rows map one-to-one and the
+        source's changes are passed through unchanged."""
+        super().__init__(parent)
+        self._filter = None # Callable returning the accepted source rows
+        self._rows = None # Accepted source rows in order, None without a filter
+        self._proxy_rows = None # Source rows to proxy rows, -1 if hidden, built lazily
+        self._saved_indexes = []
+        self._removed_range = (0, 0) # Proxy rows of the source rows being removed
+
+    def setSourceModel(self, model):
+        """Follow the structural changes of 'model'."""
+        super().setSourceModel(model)
+        model.rowsAboutToBeInserted.connect(self._sourceRowsAboutToBeInserted)
+        model.rowsInserted.connect(self._sourceRowsInserted)
+        model.rowsAboutToBeRemoved.connect(self._sourceRowsAboutToBeRemoved)
+        model.rowsRemoved.connect(self._sourceRowsRemoved)
+        model.dataChanged.connect(self._sourceDataChanged)
+        model.layoutAboutToBeChanged.connect(self._sourceLayoutAboutToBeChanged)
+        model.layoutChanged.connect(self._sourceLayoutChanged)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self._sourceModelReset)
+
+    def setFilterFunction(self, function):
+        """Show only the source rows returned by 'function', in ascending
+        order, or every row if it is None. The function is called again
+        after rows are added or moved."""
+        self.beginResetModel()
+        self._filter = function
+        self._applyFilter()
+        self.endResetModel()
+
+    def isFiltered(self):
+        """Return True if some rows may be hidden."""
+        return self._filter is not None
+
+    def _applyFilter(self):
+        """Rebuild the mappings between source and proxy rows."""
+        self._proxy_rows = None
+        self._rows = None if self._filter is None else array("l", self._filter())
+
+    def rowCount(self, parent=QModelIndex()):
+        """Return the number of rows shown."""
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        if self._rows is None:
+            return self.sourceModel().rowCount()
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        """The model has a single column."""
+        return 0 if parent.isValid() else 1
+
+    def index(self, row, column=0, parent=QModelIndex()):
+        """Return the index of 'row'."""
+        if parent.isValid() or column != 0 or not 0 <= row < self.rowCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        """Items have no parent. Without an index, return the QObject parent."""
+        if index is None:
+            return QObject.parent(self)
+        return QModelIndex()
+
+    def mapToSource(self, proxy_index):
+        """Return the source index of 'proxy_index'."""
+        if not proxy_index.isValid():
+            return QModelIndex()
+        row = proxy_index.row() if self._rows is None else self._rows[proxy_index.row()]
+        return self.sourceModel().index(row, 0)
+
+    def mapFromSource(self, source_index):
+        """Return the proxy index of 'source_index', which is invalid if the
+        row is hidden."""
+        if not source_index.isValid():
+            return QModelIndex()
+        row = source_index.row()
+        if self._rows is not None:
+            if self._proxy_rows is None:
+                self._proxy_rows = array("l", [-1]) * self.sourceModel().rowCount()
+                for proxy_row, source_row in enumerate(self._rows):
+                    self._proxy_rows[source_row] = proxy_row
+            row = self._proxy_rows[row] if row < len(self._proxy_rows) else -1
+        return self.createIndex(row, 0) if row >= 0 else QModelIndex()
+
+    def sourceRow(self, row):
+        """Return the source row of the proxy 'row'."""
+        return row if self._rows is None else self._rows[row]
+
+    # Source rows are passed through while nothing is filtered. Otherwise
+    # the inserted rows that match the filter are inserted among the shown
+    # rows, and the shown rows that are removed are removed, so the view
+    # keeps its selection and scroll position. Only filter changes reset
+    def _sourceRowsAboutToBeInserted(self, parent, first, last):
+        if self._filter is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+
+    def _sourceRowsInserted(self, parent, first, last):
+        if self._filter is None:
+            self.endInsertRows()
+            return
+        # Shift the shown rows after the insertion first, so they map to the
+        # right source rows while the new rows that match are inserted. The
+        # new rows all go to the same position
+        count = last - first + 1
+        position = bisect.bisect_left(self._rows, first)
+        self._rows[position:] = array("l", (row + count for row in self._rows[position:]))
+        self._proxy_rows = None
+        accepted = array("l", self._filter())
+        accepted = accepted[bisect.bisect_left(accepted, first):bisect.bisect_right(accepted, last)]
+        if accepted:
+            self.beginInsertRows(QModelIndex(), position, position + len(accepted) - 1)
+            self._rows[position:position] = accepted
+            self._proxy_rows = None
+            self.endInsertRows()
+
+    def _sourceRowsAboutToBeRemoved(self, parent, first, last):
+        if self._filter is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            return
+        # The shown rows of a block of source rows are a block of proxy rows
+        low = bisect.bisect_left(self._rows, first)
+        high = bisect.bisect_right(self._rows, last)
+        self._removed_range = (low, high)
+        if high > low:
+            self.beginRemoveRows(QModelIndex(), low, high - 1)
+
+    def _sourceRowsRemoved(self, parent, first, last):
+        if self._filter is None:
+            self.endRemoveRows()
+            return
+        count = last - first + 1
+        low, high = self._removed_range
+        self._rows[low:] = array("l", (row - count for row in self._rows[high:]))
+        self._proxy_rows = None
+        if high > low:
+            self.endRemoveRows()
+
+    def _sourceModelReset(self):
+        self._applyFilter()
+        self.endResetModel()
+
+    def _sourceDataChanged(self, top_left, bottom_right, roles=[]):
+        """Pass on changes to the rows that are shown."""
+        rows = [self.mapFromSource(self.sourceModel().index(row, 0)).row()
+            for row in range(top_left.row(), bottom_right.row() + 1)]
+        rows = [row for row in rows if row >= 0]
+        if rows:
+            self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), roles)
+
+    def _sourceLayoutAboutToBeChanged(self, parents=[], hint=None):
+        """Remember the source rows of the persistent indexes, such as the
+        selection, before the source rows move."""
+        self.layoutAboutToBeChanged.emit()
+        self._saved_indexes = [(index, QPersistentModelIndex(self.mapToSource(index)))
+            for index in self.persistentIndexList()]
+
+    def _sourceLayoutChanged(self, parents=[], hint=None):
+        """Apply the filter to the new order and move the persistent indexes
+        to the new rows of their source rows."""
+        self._applyFilter()
+        saved_indexes, self._saved_indexes = self._saved_indexes, []
+        self.changePersistentIndexList([index for index, _ in saved_indexes],
+            [self.mapFromSource(self.sourceModel().index(source.row(), 0))
+                if source.isValid() else QModelIndex() for _, source in saved_indexes])
+        self.layoutChanged.emit()
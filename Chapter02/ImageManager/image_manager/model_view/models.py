@@ -0,0 +1,390 @@
+"""Image Manager GUI, Part 2
+List model that stores the image library in compact columns
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, locale
+from array import array
+from PyQt6.QtCore import Qt, QModelIndex, QAbstractListModel, QTimer
+from PyQt6.QtGui import QPixmap
+# Import relative modules
+from ..library.search import SearchIndex
+from .decorations import DecorationCache
+
+# Values stored in the thumbnail handle column that are not slot numbers
+NO_THUMBNAIL = -1
+THUMBNAIL_REQUESTED = -2
+THUMBNAIL_FAILED = -3 # The image can't be read, until the file changes
+
+# Fields the images can be sorted by
+SORT_NAME = "name"
+SORT_DATE_TAKEN = "date_taken"
+SORT_MODIFIED = "modified"
+SORT_SIZE = "size"
+SORT_DIMENSIONS = "dimensions"
+SORT_FIELDS = {
+    SORT_NAME: "Name",
+    SORT_DATE_TAKEN: "Date Taken",
+    SORT_MODIFIED: "Date Modified",
+    SORT_SIZE: "File Size",
+    SORT_DIMENSIONS: "Dimensions"}
+
+def baseName(image_path):
+    """Return the file name without any of its extensions, which matches
+    the value returned by QFileInfo.baseName()."""
+    return os.path.basename(image_path).split(".", 1)[0]
+
+def collationKey(image_path):
+    """Return a key that sorts file names in the user's locale, ignoring
+    case first and using it only to break ties."""
+    name = baseName(image_path)
+    return (locale.strxfrm(name.casefold()), locale.strxfrm(name))
+
+class ImageLibraryModel(QAbstractListModel):
+
+    # Role that returns the absolute path of an image
+    PathRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, thumbnail_loader, placeholder_icon, failed_icon, parent=None):
+        """Model for the images in the library. Rather than creating an object
+        per image, each attribute is kept in its own column: a list of paths
+        and typed arrays for the sizes, modification times and thumbnail
+        handles. A handle refers to an icon in a DecorationCache, which
+        keeps the icons within a memory budget. Thumbnails are requested
+        the first time the view asks for the decoration of a row, which
+        only happens for rows on screen, and again after they have been
+        evicted. Images that can't be read show 'failed_icon' instead.
+        The collation key of each name is computed once when the row is
+        added, so sorting never has to look at the files again. Each row
+        also has an id in a SearchIndex, which the filter bar queries."""
+        super().__init__(parent)
+        self.thumbnail_loader = thumbnail_loader
+        self.placeholder_icon = placeholder_icon
+        self.failed_icon = failed_icon
+
+        self._paths = []
+        self._sizes = array("q") # In bytes
+        self._mtimes = array("q") # In nanoseconds
+        self._taken = array("q") # In nanoseconds, the mtime until it is known
+        self._pixels = array("q") # Width * height, 0 until it is known
+        self._name_keys = [] # Locale collation keys of the names
+        self._thumbs = array("l") # Thumbnail handles
+        self._ids = array("l") # Ids of the rows in the search index
+        self.decorations = DecorationCache()
+        self._resident = set() # Paths of the rows on or near the screen
+        self._rows = None # Maps paths to rows, rebuilt after rows move
+        self._id_rows = None # Maps search index ids to rows, rebuilt after rows move
+        self._sort = None # (order, field) of the last sort, applied to restored rows
+        self.search_index = SearchIndex()
+        # Builds the search index a step at a time while the GUI is idle
+        self.index_timer = QTimer(self, interval=0, timeout=self._buildSearchIndex)
+
+    def rowCount(self, parent=QModelIndex()):
+        """Return the number of images in the library."""
+        if parent.isValid():
+            return 0
+        return len(self._paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        """Return the data for the image at index based upon the given role.
+        Names and icons are computed when they are asked for rather than
+        being stored for every row."""
+        if not index.isValid():
+            return None
+        row = index.row()
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            return baseName(self._paths[row])
+
+        if role == Qt.ItemDataRole.DecorationRole:
+            handle = self._thumbs[row]
+            if handle >= 0:
+                return self.decorations.icon(handle)
+            if handle == NO_THUMBNAIL:
+                self._thumbs[row] = THUMBNAIL_REQUESTED
+                self.thumbnail_loader.requestThumbnail(self._paths[row], visible=True)
+            if handle == THUMBNAIL_FAILED:
+                return self.failed_icon
+            return self.placeholder_icon
+
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return os.path.basename(self._paths[row])
+
+        if role == self.PathRole:
+            return self._paths[row]
+        return None
+
+    def path(self, row):
+        """Return the absolute path of the image in 'row'."""
+        return self._paths[row]
+
+    def thumbnail(self, row):
+        """Return the thumbnail QIcon of 'row', or None if it isn't loaded."""
+        handle = self._thumbs[row]
+        return self.decorations.icon(handle) if handle >= 0 else None
+
+    def rowForPath(self, image_path):
+        """Return the row of 'image_path', or -1 if it isn't in the model."""
+        if self._rows is None:
+            self._rows = {path: row for row, path in enumerate(self._paths)}
+        return self._rows.get(image_path, -1)
+
+    def appendEntries(self, entries):
+        """Append a batch of (path, size, mtime) tuples with a single
+        insertion, which avoids relaying out the view for every image.
+        Entries loaded from the catalog can also carry the width, height
+        and capture time: (path, size, mtime, width, height, taken)."""
+        if not entries:
+            return
+        first = len(self._paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+        first_id = self.search_index.addEntries([(entry[0], entry[1],
+            entry[5] if len(entry) >= 6 and entry[5] else entry[2]) for entry in entries])
+        self._ids.extend(range(first_id, first_id + len(entries)))
+        self._id_rows = None
+        for entry in entries:
+            image_path, size, mtime = entry[:3]
+            width, height, taken = entry[3:6] if len(entry) >= 6 else (None, None, None)
+            if self._rows is not None:
+                self._rows[image_path] = len(self._paths)
+            self._paths.append(image_path)
+            self._sizes.append(size)
+            self._mtimes.append(mtime)
+            self._taken.append(taken or mtime)
+            self._pixels.append((width or 0) * (height or 0))
+            self._name_keys.append(collationKey(image_path))
+            self._thumbs.append(NO_THUMBNAIL)
+        self.endInsertRows()
+        self.index_timer.start()
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        """Remove 'count' rows starting with 'row'."""
+        if count <= 0 or row < 0 or row + count > len(self._paths):
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        for handle in self._thumbs[row:row + count]:
+            self.decorations.release(handle)
+        for image_path in self._paths[row:row + count]:
+            self.thumbnail_loader.cancel(image_path)
+        self.search_index.remove(self._ids[row:row + count])
+        del self._paths[row:row + count]
+        del self._sizes[row:row + count]
+        del self._mtimes[row:row + count]
+        del self._taken[row:row + count]
+        del self._pixels[row:row + count]
+        del self._name_keys[row:row + count]
+        del self._thumbs[row:row + count]
+        del self._ids[row:row + count]
+        self._rows = None
+        self._id_rows = None
+        self.endRemoveRows()
+        return True
+
+    def removeRowList(self, rows):
+        """Remove the rows in the sorted list 'rows'. Adjacent rows are grouped
+        into ranges that are removed with one call each, starting from the
+        bottom so the rows still to be removed don't shift. Return a list
+        of (row, (path, size, mtime, taken, pixels)) tuples, holding every
+        stored column, that insertEntries() can use to put the images back."""
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        removed = [(row, (self._paths[row], self._sizes[row], self._mtimes[row],
+            self._taken[row], self._pixels[row])) for row in rows]
+        for first, last in reversed(ranges):
+            self.removeRows(first, last - first + 1)
+        return removed
+
+    def insertEntries(self, entries):
+        """Insert the (row, (path, size, mtime, taken, pixels)) tuples returned
+        by removeRowList(), sorted by row. Adjacent rows are inserted
+        together. The rows may have moved since they were removed, so the
+        last sort is applied again afterwards."""
+        ranges = []
+        for row, entry in entries:
+            if ranges and ranges[-1][0] + len(ranges[-1][1]) == row:
+                ranges[-1][1].append(entry)
+            else:
+                ranges.append((row, [entry]))
+        for first, range_entries in ranges:
+            first = min(first, len(self._paths))
+            last = first + len(range_entries) - 1
+            self.beginInsertRows(QModelIndex(), first, last)
+            self._paths[first:first] = [entry[0] for entry in range_entries]
+            self._sizes[first:first] = array("q", (entry[1] for entry in range_entries))
+            self._mtimes[first:first] = array("q", (entry[2] for entry in range_entries))
+            self._taken[first:first] = array("q", (entry[3] for entry in range_entries))
+            self._pixels[first:first] = array("q", (entry[4] for entry in range_entries))
+            self._name_keys[first:first] = [collationKey(entry[0]) for entry in range_entries]
+            self._thumbs[first:first] = array("l", [NO_THUMBNAIL] * len(range_entries))
+            first_id = self.search_index.addEntries([(entry[0], entry[1], entry[3])
+                for entry in range_entries])
+            self._ids[first:first] = array("l", range(first_id, first_id + len(range_entries)))
+            self._rows = None
+            self._id_rows = None
+            self.endInsertRows()
+        self.index_timer.start()
+        if self._sort is not None and ranges:
+            self.sort(0, *self._sort)
+
+    def updateEntry(self, row, size, mtime):
+        """Record that the file in 'row' has changed. Its thumbnail is
+        decoded again the next time the row is displayed."""
+        self._sizes[row] = size
+        self._mtimes[row] = mtime
+        self._taken[row] = mtime
+        self._pixels[row] = 0
+        self.search_index.update(self._ids[row], size, mtime)
+        self.decorations.release(self._thumbs[row])
+        self._thumbs[row] = NO_THUMBNAIL
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def entry(self, row):
+        """Return the (path, size, mtime) tuple of 'row'."""
+        return (self._paths[row], self._sizes[row], self._mtimes[row])
+
+    def setCaptureTimes(self, times):
+        """Store (path, capture time) tuples read from the images' metadata,
+        used when sorting by date taken. Times that are None are skipped."""
+        for image_path, taken in times:
+            row = self.rowForPath(image_path)
+            if row != -1 and taken is not None:
+                self._taken[row] = taken
+                self.search_index.update(self._ids[row], date=taken)
+
+    def findRows(self, terms):
+        """Return the rows that match the ("name", "ext", "size" or "date")
+        terms returned by parseQuery(), in ascending order. Dates are
+        capture times, or modification times until the capture time is
+        known."""
+        if not terms:
+            return list(range(len(self._paths)))
+        if self._id_rows is None:
+            self._id_rows = array("l", bytes(self.search_index.idCount() * array("l").itemsize))
+            for row, image_id in enumerate(self._ids):
+                self._id_rows[image_id] = row
+        rows = sorted(map(self._id_rows.__getitem__, self.search_index.query(terms)))
+        if self.search_index.hasPendingWork():
+            self.index_timer.start()
+        return rows
+
+    def _buildSearchIndex(self):
+        """Take one step of building the search index."""
+        if not self.search_index.buildStep():
+            self.index_timer.stop()
+
+    def setThumbnail(self, image_path, image, original_size=None):
+        """Store the thumbnail for 'image_path' and update the view. The
+        size of the original image is kept for sorting by dimensions.
+        Return True if the size was not known before."""
+        row = self.rowForPath(image_path)
+        if row == -1:
+            return False
+        new_size = False
+        if original_size is not None and original_size.isValid():
+            new_size = self._pixels[row] == 0
+            self._pixels[row] = original_size.width() * original_size.height()
+        pixmap = QPixmap.fromImage(image)
+        handle = self._thumbs[row]
+        if handle >= 0:
+            self.decorations.replace(handle, pixmap)
+        else:
+            self._thumbs[row] = self.decorations.add(image_path, pixmap)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+        if image_path in self._resident:
+            self.evictDecorations()
+        return new_size
+
+    def setThumbnailFailed(self, image_path):
+        """Show the failed icon for 'image_path', whose thumbnail couldn't be
+        decoded. It isn't requested again until the file changes. A row
+        that still has an icon, e.g. of another size, keeps it."""
+        row = self.rowForPath(image_path)
+        if row == -1 or self._thumbs[row] >= 0:
+            return
+        self._thumbs[row] = THUMBNAIL_FAILED
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def setResidentRows(self, rows):
+        """Keep the thumbnails of 'rows', the rows on screen and those a
+        short scroll away, in memory and evict the others if needed.
+        Thumbnails of the rows near the screen are requested so that they
+        are ready when scrolled to. A thumbnail of another row can only
+        arrive while this set is out of date, right after a scroll, so it
+        doesn't cause an eviction that could remove the newly visible rows."""
+        self._resident = {self._paths[row] for row in rows}
+        for row in rows:
+            if self._thumbs[row] == NO_THUMBNAIL:
+                self._thumbs[row] = THUMBNAIL_REQUESTED
+                self.thumbnail_loader.requestThumbnail(self._paths[row])
+        self.evictDecorations()
+
+    def evictDecorations(self):
+        """Free the least recently used thumbnails of the rows that are not
+        resident while the icons use more memory than the budget. The rows
+        request their thumbnails again when they are displayed."""
+        for image_path in self.decorations.evict(self._resident):
+            row = self.rowForPath(image_path)
+            if row != -1:
+                self._thumbs[row] = NO_THUMBNAIL
+
+    def reloadThumbnails(self):
+        """Load the thumbnails again, e.g. from another pyramid level after
+        the icon size has changed. Rows on or near the screen keep their
+        current icon until the new one arrives, the others drop it."""
+        for row, handle in enumerate(self._thumbs):
+            if handle < 0:
+                continue
+            if self._paths[row] in self._resident:
+                self.thumbnail_loader.requestThumbnail(self._paths[row])
+            else:
+                self.decorations.release(handle)
+                self._thumbs[row] = NO_THUMBNAIL
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder, field=SORT_NAME):
+        """Sort the images by one of the SORT_FIELDS, using the name to order
+        images with equal values. Only the stored columns are compared. Rows
+        are rearranged in place and persistent indexes, such as the
+        selection, are updated. The sort is remembered for insertEntries()."""
+        self._sort = (order, field)
+        keys = self._name_keys
+        if field != SORT_NAME:
+            values = {SORT_DATE_TAKEN: self._taken, SORT_MODIFIED: self._mtimes,
+                SORT_SIZE: self._sizes, SORT_DIMENSIONS: self._pixels}[field]
+            keys = list(zip(values, keys))
+        order_rows = sorted(range(len(self._paths)), key=keys.__getitem__,
+            reverse=(order == Qt.SortOrder.DescendingOrder))
+        self.applyRowOrder(order_rows)
+
+    def applyRowOrder(self, order_rows):
+        """Rearrange the rows so that new row n holds old row order_rows[n]."""
+        self.layoutAboutToBeChanged.emit()
+        self._paths = [self._paths[row] for row in order_rows]
+        self._sizes = array("q", (self._sizes[row] for row in order_rows))
+        self._mtimes = array("q", (self._mtimes[row] for row in order_rows))
+        self._taken = array("q", (self._taken[row] for row in order_rows))
+        self._pixels = array("q", (self._pixels[row] for row in order_rows))
+        self._name_keys = [self._name_keys[row] for row in order_rows]
+        self._thumbs = array("l", (self._thumbs[row] for row in order_rows))
+        self._ids = array("l", (self._ids[row] for row in order_rows))
+        self._rows = None
+        self._id_rows = None
+
+        # Map the persistent indexes from their old rows to the new rows
+        new_rows = array("l", bytes(len(order_rows) * array("l").itemsize))
+        for new_row, old_row in enumerate(order_rows):
+            new_rows[old_row] = new_row
+        old_indexes = self.persistentIndexList()
+        self.changePersistentIndexList(old_indexes,
+            [self.index(new_rows[index.row()]) for index in old_indexes])
+        self.layoutChanged.emit()
@@ -1,5 +1,5 @@
 """Image Manager GUI, Part 2
-Custom QListWidget
+Custom QListView
 
 Building Custom UIs with PyQt with Packt Publishing
 Chapter 2 - Building the Foundation for GUIs
@@ -7,28 +7,42 @@ Created by: Joshua Willman
 """
 
 # Import necessary modules
-from PyQt6.QtWidgets import (QMenu, QListWidget, QListView, 
-    QAbstractItemView) 
-from PyQt6.QtCore import Qt, QSize
+from PyQt6.QtWidgets import QMenu, QListView, QAbstractItemView
+from PyQt6.QtCore import Qt, QSize, pyqtSignal
 
-class ImageViewerListWidget(QListWidget):
+ICON_SIZE = 80 # Default size of the icons, in pixels
+MIN_ICON_SIZE, MAX_ICON_SIZE = 48, 512
+GRID_MARGIN = 30 # Room around each icon for its name
 
-    images_info_list = [] # List that holds QFileInfo instances
+class ImageViewerListView(QListView):
+
+    viewport_resized = pyqtSignal()
+    files_dropped = pyqtSignal(list) # Paths of the local files and folders dropped
 
     def __init__(self, parent):
-        """Subclassed QListWidget that displays images"""
+        """Subclassed QListView that displays images"""
         super().__init__(parent)
         self.parent = parent
         self.setViewMode(QListView.ViewMode.IconMode)
         self.setTextElideMode(Qt.TextElideMode.ElideMiddle)
         self.setResizeMode(QListView.ResizeMode.Adjust)
-        self.setGridSize(QSize(110, 110))
+        self.setThumbnailSize(ICON_SIZE)
+        # Every item has the same size, so the view doesn't need to ask the
+        # model for the size of each item when laying them out
+        self.setUniformItemSizes(True)
         self.setLayoutMode(QListView.LayoutMode.Batched)
         self.setBatchSize(20) # Default is 100
 
-        # Methods handling item selection and drag/drop 
+        # Methods handling item selection and drag/drop. Files and folders 
+        # dropped onto the view are imported
         self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
-        self.setDragDropMode(QAbstractItemView.DragDropMode.NoDragDrop)      
+        self.setDragDropMode(QAbstractItemView.DragDropMode.DropOnly)
+
+    def setThumbnailSize(self, size):
+        """Display the icons at 'size' pixels. The cells of the grid grow
+        with the icons."""
+        self.setIconSize(QSize(size, size))
+        self.setGridSize(QSize(size + GRID_MARGIN, size + GRID_MARGIN))
 
     def contextMenuEvent(self, event):
         """A simple context menu for managing images."""
@@ -37,4 +51,53 @@ class ImageViewerListWidget(QListWidget):
         context_menu.addAction(self.parent.sort_descend_act)
         context_menu.addSeparator()
         context_menu.addAction(self.parent.delete_act)
-        context_menu.exec(self.mapToGlobal(event.pos()))
\ No newline at end of file
+        context_menu.addSeparator()
+        context_menu.addAction(self.parent.find_similar_act)
+        context_menu.exec(self.mapToGlobal(event.pos()))
+
+    def dragEnterEvent(self, event):
+        """Accept drags that carry local files or folders."""
+        if any(url.isLocalFile() for url in event.mimeData().urls()):
+            event.acceptProposedAction()
+        else:
+            event.ignore()
+
+    def dragMoveEvent(self, event):
+        """Files can be dropped anywhere in the view, not only onto items."""
+        self.dragEnterEvent(event)
+
+    def dropEvent(self, event):
+        """Emit the paths of the dropped files and folders. The model is not
+        involved, since the files are imported by the main window."""
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        if paths:
+            event.acceptProposedAction()
+            self.files_dropped.emit(paths)
+
+    def resizeEvent(self, event):
+        """Notify the main window that different items may now be visible."""
+        super().resizeEvent(event)
+        self.viewport_resized.emit()
+
+    def selectedRows(self):
+        """Return the source model rows of the selected items in ascending
+        order."""
+        return sorted(self.model().sourceRow(index.row())
+            for index in self.selectionModel().selectedIndexes())
+
+    def visibleRows(self, margin=0):
+        """Return the source model rows in the viewport, and in 'margin'
+        viewport heights above and below it. Items are laid out left to
+        right in cells of gridSize(), so the rows can be computed from the
+        scroll offset without asking the view about each item."""
+        if self.model() is None or self.model().rowCount() == 0:
+            return []
+        grid = self.gridSize()
+        viewport_rect = self.viewport().rect()
+        columns = max(1, viewport_rect.width() // grid.width())
+        extra = int(margin * viewport_rect.height())
+        top_line = max(0, self.verticalOffset() - extra) // grid.height()
+        bottom_line = (self.verticalOffset() + viewport_rect.height() + extra) // grid.height()
+        first_row = top_line * columns
+        last_row = min((bottom_line + 1) * columns, self.model().rowCount())
+        return [self.model().sourceRow(row) for row in range(first_row, last_row)]
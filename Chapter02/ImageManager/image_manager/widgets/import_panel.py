@@ -0,0 +1,90 @@
+"""Image Manager GUI, Part 2
+Non-modal panel that displays the progress of an import
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from collections import deque
+from PyQt6.QtWidgets import (QWidget, QLabel, QProgressBar, QPushButton,
+    QHBoxLayout, QVBoxLayout)
+from PyQt6.QtCore import QTimer, QElapsedTimer
+
+class ImportProgressPanel(QWidget):
+
+    def __init__(self, engine, parent=None):
+        """Displays the number of imported files and the transfer rates of an
+        ImportEngine. The engine's counters are sampled with a timer rather
+        than on every copied chunk, and the rates are averaged over the last
+        few seconds."""
+        super().__init__(parent)
+        self.engine = engine
+        self.samples = deque(maxlen=10) # (elapsed ms, bytes done, files done)
+        self.elapsed_timer = QElapsedTimer()
+
+        self.progress_bar = QProgressBar()
+        self.status_label = QLabel("No import running")
+        self.rate_label = QLabel()
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.engine.cancel)
+        self.resume_button = QPushButton("Resume")
+        self.resume_button.clicked.connect(self.engine.resume)
+
+        buttons_h_box = QHBoxLayout()
+        buttons_h_box.addWidget(self.rate_label, 1)
+        buttons_h_box.addWidget(self.cancel_button)
+        buttons_h_box.addWidget(self.resume_button)
+
+        panel_v_box = QVBoxLayout()
+        panel_v_box.addWidget(self.status_label)
+        panel_v_box.addWidget(self.progress_bar)
+        panel_v_box.addLayout(buttons_h_box)
+        self.setLayout(panel_v_box)
+
+        self.update_timer = QTimer(self, interval=500, timeout=self.updateProgress)
+        self.engine.state_changed.connect(self.updateState)
+        self.updateState()
+
+    def updateState(self):
+        """Start or stop sampling and enable the buttons that apply."""
+        active = self.engine.isActive()
+        cancelled = self.engine.isCancelled()
+        self.cancel_button.setEnabled(active and not cancelled)
+        self.resume_button.setEnabled(not active and self.engine.canResume())
+        if active and not self.update_timer.isActive():
+            self.samples.clear()
+            self.elapsed_timer.start()
+            self.update_timer.start()
+        elif not active and self.update_timer.isActive():
+            self.update_timer.stop()
+        self.updateProgress()
+
+    def updateProgress(self):
+        """Display the counters and the bytes/files per second."""
+        progress = self.engine.progress()
+        files_done, files_total = progress["files_done"], progress["files_total"]
+        self.progress_bar.setRange(0, max(1, files_total))
+        self.progress_bar.setValue(files_done)
+
+        if self.engine.isCancelled():
+            state = "Cancelling" if self.engine.isActive() else "Cancelled"
+        elif self.engine.isActive():
+            state = "Importing"
+        else:
+            state = "Finished"
+        self.status_label.setText(f"{state}: {files_done:,} of {files_total:,} files, "
+            f"{progress['bytes_done'] / 1048576:,.1f} of "
+            f"{progress['bytes_total'] / 1048576:,.1f} MB")
+
+        if self.elapsed_timer.isValid():
+            self.samples.append((self.elapsed_timer.elapsed(),
+                progress["bytes_done"], files_done))
+        if len(self.samples) > 1:
+            (start_ms, start_bytes, start_files) = self.samples[0]
+            (end_ms, end_bytes, end_files) = self.samples[-1]
+            seconds = max(end_ms - start_ms, 1) / 1000
+            self.rate_label.setText(f"{(end_bytes - start_bytes) / 1048576 / seconds:,.1f} MB/s, "
+                f"{(end_files - start_files) / seconds:,.1f} files/s")
@@ -0,0 +1,209 @@
+"""Image Manager GUI, Part 2
+Custom widget that displays large images from decoded tiles
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from PyQt6.QtWidgets import QWidget
+from PyQt6.QtCore import Qt, QPointF, QRectF
+from PyQt6.QtGui import QPainter, QPixmap, QTransform
+# Import relative modules
+from ..workers.tiles import (TileLoader, orientationTransform, levelForZoom,
+    tileSpan, tileRect)
+
+MAX_ZOOM = 4.0 # Largest zoom factor, 400%
+
+class TiledImageView(QWidget):
+
+    def __init__(self, parent=None, loader=None):
+        """Widget that displays an image with pan and zoom. Only the tiles
+        in view are decoded, at the level that matches the zoom factor, on
+        a worker thread. Until they are ready, the image's thumbnail is
+        stretched to fill the image, so even very large images appear at
+        once. Drag to pan, use the mouse wheel to zoom and double-click to
+        switch between fitting the image and 100%."""
+        super().__init__(parent)
+        self.loader = loader if loader is not None else TileLoader(self)
+        self.loader.tile_ready.connect(self.update)
+        self.preview = None # Thumbnail QPixmap in display orientation
+        self.orientation = QTransform()
+        self.display_size = None # QSizeF of the image after orientation
+        self.zoom = 1.0
+        self.origin = QPointF() # Widget position of the image's top-left corner
+        self.fit_mode = True
+        self._drag_position = None
+        self.setMinimumSize(100, 100)
+
+    def setImage(self, image_path, preview_image=None):
+        """Display 'image_path'. 'preview_image' is an optional QImage, such
+        as the thumbnail, shown while the tiles are decoded."""
+        header = self.loader.setImage(image_path)
+        image_size = header.size
+        if not image_size.isValid():
+            self.clear()
+            return
+        self.orientation = orientationTransform(header.transformation, image_size)
+        self.display_size = self.orientation.mapRect(
+            QRectF(0, 0, image_size.width(), image_size.height())).size()
+        self.preview = None
+        if preview_image is not None and not preview_image.isNull():
+            self.preview = QPixmap.fromImage(preview_image)
+        self.fitToView()
+
+    def clear(self):
+        """Stop displaying an image."""
+        self.loader.clear()
+        self.preview = None
+        self.display_size = None
+        self.update()
+
+    def fitZoom(self):
+        """Return the zoom factor that fits the image in the widget without
+        enlarging small images."""
+        return min(self.width() / self.display_size.width(),
+            self.height() / self.display_size.height(), 1.0)
+
+    def fitToView(self):
+        """Zoom so that the whole image is visible."""
+        if self.display_size is None:
+            return
+        self.fit_mode = True
+        self.zoom = self.fitZoom()
+        self.clampOrigin()
+        self.updateTiles()
+
+    def setZoom(self, zoom, anchor):
+        """Change the zoom factor, keeping the image point under the widget
+        position 'anchor' in place."""
+        if self.display_size is None:
+            return
+        zoom = max(self.fitZoom(), min(zoom, MAX_ZOOM))
+        image_point = (anchor - self.origin) / self.zoom
+        self.zoom = zoom
+        self.origin = anchor - image_point * zoom
+        self.fit_mode = False
+        self.clampOrigin()
+        self.updateTiles()
+
+    def clampOrigin(self):
+        """Center the image along sides where it is smaller than the widget
+        and keep it from being panned out of view along the others."""
+        x, y = self.origin.x(), self.origin.y()
+        scaled_width = self.display_size.width() * self.zoom
+        scaled_height = self.display_size.height() * self.zoom
+        if scaled_width <= self.width():
+            x = (self.width() - scaled_width) / 2
+        else:
+            x = min(0, max(self.width() - scaled_width, x))
+        if scaled_height <= self.height():
+            y = (self.height() - scaled_height) / 2
+        else:
+            y = min(0, max(self.height() - scaled_height, y))
+        self.origin = QPointF(x, y)
+
+    def displayTransform(self):
+        """Return the QTransform from display orientation to the widget."""
+        return QTransform.fromScale(self.zoom, self.zoom) * QTransform.fromTranslate(
+            self.origin.x(), self.origin.y())
+
+    def level(self):
+        """Return the level whose resolution is closest to the zoom factor
+        without being lower."""
+        return levelForZoom(self.loader.header, self.zoom, self.loader.budget_bytes)
+
+    def visibleTiles(self, level):
+        """Return the keys of the tiles of 'level' in view, nearest to the
+        center of the widget first."""
+        image_size = self.loader.header.size
+        transform, _ = (self.orientation * self.displayTransform()).inverted()
+        visible_rect = transform.mapRect(QRectF(self.rect())).intersected(
+            QRectF(0, 0, image_size.width(), image_size.height()))
+        if visible_rect.isEmpty():
+            return []
+        span = tileSpan(self.loader.header, level)
+        columns = range(int(visible_rect.left()) // span, int(visible_rect.right()) // span + 1)
+        rows = range(int(visible_rect.top()) // span, int(visible_rect.bottom()) // span + 1)
+        center = visible_rect.center() / span
+        return sorted(((level, column, row) for row in rows for column in columns),
+            key=lambda key: (key[1] + 0.5 - center.x()) ** 2 + (key[2] + 0.5 - center.y()) ** 2)
+
+    def updateTiles(self):
+        """Request the tiles in view and repaint."""
+        if self.display_size is not None:
+            self.loader.requestTiles(self.visibleTiles(self.level()))
+        self.update()
+
+    def paintEvent(self, event):
+        """Draw the thumbnail, then every decoded tile in view. Tiles that
+        are not ready yet are replaced by a coarser tile if one is cached."""
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().dark())
+        if self.display_size is None:
+            return
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        display_transform = self.displayTransform()
+        if self.preview is not None:
+            painter.setTransform(display_transform)
+            painter.drawPixmap(QRectF(0, 0, self.display_size.width(),
+                self.display_size.height()), self.preview, QRectF(self.preview.rect()))
+
+        painter.setTransform(self.orientation * display_transform)
+        level = self.level()
+        drawn, missing = [], []
+        for key in self.visibleTiles(level):
+            (drawn if self.loader.tile(key) is not None else missing).append(key)
+        coarser = []
+        for _, column, row in missing:
+            for coarser_level in range(level + 1, level + 4):
+                shift = coarser_level - level
+                key = (coarser_level, column >> shift, row >> shift)
+                if self.loader.tile(key) is not None:
+                    if key not in coarser:
+                        coarser.append(key)
+                    break
+        for key in coarser + drawn:
+            painter.drawPixmap(QRectF(tileRect(self.loader.header, key)), self.loader.tile(key),
+                QRectF(self.loader.tile(key).rect()))
+
+    def wheelEvent(self, event):
+        """Zoom in or out around the mouse pointer."""
+        steps = event.angleDelta().y() / 120
+        self.setZoom(self.zoom * 1.25 ** steps, event.position())
+
+    def mousePressEvent(self, event):
+        """Start panning the image."""
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag_position = event.position()
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        """Pan the image while the mouse button is held down."""
+        if self._drag_position is not None and self.display_size is not None:
+            self.origin += event.position() - self._drag_position
+            self._drag_position = event.position()
+            self.clampOrigin()
+            self.updateTiles()
+
+    def mouseReleaseEvent(self, event):
+        """Stop panning the image."""
+        self._drag_position = None
+        self.unsetCursor()
+
+    def mouseDoubleClickEvent(self, event):
+        """Switch between fitting the image and displaying it at 100%."""
+        if self.fit_mode:
+            self.setZoom(1.0, event.position())
+        else:
+            self.fitToView()
+
+    def resizeEvent(self, event):
+        """Keep the image fitted, or in view, as the widget is resized."""
+        if self.display_size is not None:
+            if self.fit_mode:
+                self.fitToView()
+            else:
+                self.clampOrigin()
+                self.updateTiles()
@@ -0,0 +1,329 @@
+"""Image Manager GUI, Part 2
+Parallel import engine that copies images on a pool of worker threads
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, threading
+from collections import deque, Counter
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QFile, pyqtSignal
+# Import relative modules
+from ..library.storage import (transferFile, numberedFileName, libraryPath,
+    COPY, SYMLINK)
+
+MAX_RENAMES = 1000 # Attempts at finding a free name for a file
+
+class ImportCancelled(Exception):
+    """Raised inside an ImportTask when the engine is cancelled."""
+
+class DuplicateCheckTask(QRunnable):
+
+    def __init__(self, engine, candidates):
+        """Runnable that checks a batch of files against the content-hash index"""
+        super().__init__()
+        self.engine = engine
+        self.candidates = candidates
+
+    def run(self):
+        """Split the batch into duplicates and files to import."""
+        duplicates, hashes = self.engine.hash_index.findDuplicates(self.candidates)
+        duplicate_paths = {path for path, _ in duplicates}
+        accepted = [(path, size, hashes.get(path)) for path, size in self.candidates
+            if path not in duplicate_paths]
+        skipped_bytes = sum(size for path, size in self.candidates if path in duplicate_paths)
+        self.engine.check_finished.emit(accepted, duplicates, skipped_bytes)
+
+class ImportTask(QRunnable):
+
+    def __init__(self, engine, source, size, destination_dir, mode=COPY, hashes=None):
+        """Runnable that copies or links a single file into the library"""
+        super().__init__()
+        self.engine = engine
+        self.source = source
+        self.size = size
+        self.destination_dir = destination_dir
+        self.mode = mode
+        self.hashes = hashes
+        self.copied = 0
+
+    def run(self):
+        """Transfer the file and report the result to the engine. The 
+        destination is created exclusively, so a file with the same name is
+        detected without a separate check that could race other tasks. Files
+        are placed in the library's subdirectory for their name."""
+        engine = self.engine
+        file_name = os.path.basename(self.source)
+        destination = libraryPath(self.destination_dir, file_name)
+        if engine.isCancelled():
+            engine.task_finished.emit(self.source, "cancelled", (self.size, 0))
+            return
+        try:
+            for number in range(1, MAX_RENAMES + 1):
+                try:
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    used_mode = transferFile(self.source, destination, self.mode, self.countChunk)
+                    break
+                except FileExistsError:
+                    # A file with the same name but different contents is imported
+                    # under a new name. Without an index, names decide duplicates
+                    if (engine.hash_index is None or 
+                        engine.hash_index.isSameFile(self.source, destination)):
+                        engine.task_finished.emit(self.source, "duplicate", destination)
+                        return
+                    destination = libraryPath(self.destination_dir, 
+                        numberedFileName(file_name, number))
+            else:
+                raise FileExistsError(f"No free name for {file_name}")
+        except ImportCancelled:
+            engine.task_finished.emit(self.source, "cancelled", (self.size, self.copied))
+            return
+        except OSError as error:
+            engine.task_finished.emit(self.source, "failed", error.strerror or str(error))
+            return
+
+        if used_mode != COPY:
+            # Links and clones are counted as if the data had been copied
+            engine.addCopiedBytes(self.size)
+        # A symbolic link points at the original, so it must not be deleted
+        if engine.delete_originals and used_mode != SYMLINK:
+            QFile.moveToTrash(self.source)
+        stat = os.stat(destination)
+        entry = (os.path.abspath(destination), stat.st_size, stat.st_mtime_ns)
+        if engine.hash_index is not None:
+            engine.hash_index.updateFiles([entry], 
+                {entry[0]: self.hashes} if self.hashes else None)
+        engine.task_finished.emit(self.source, "imported", entry + (used_mode,))
+
+    def countChunk(self, size):
+        """Count the bytes as they are copied and abort if cancelled."""
+        self.copied += size
+        self.engine.addCopiedBytes(size)
+        if self.engine.isCancelled():
+            raise ImportCancelled()
+
+class ImportEngine(QObject):
+
+    file_imported = pyqtSignal(str, tuple) # Source path, (path, size, mtime)
+    import_failed = pyqtSignal(str, str) # Source path, error message
+    state_changed = pyqtSignal()
+    finished = pyqtSignal(list) # List of (source path, original path) duplicates
+    # Internal signals emitted by the DuplicateCheckTask and ImportTask objects
+    check_finished = pyqtSignal(list, list, 'qint64')
+    task_finished = pyqtSignal(str, str, object)
+
+    def __init__(self, parent=None, max_workers=4, hash_index=None):
+        """Imports files on a bounded QThreadPool. Only a few more tasks than
+        there are threads are handed to the pool, the rest wait in a queue.
+        Cancelling stops handing out tasks and aborts running copies, and
+        the import finishes once the running tasks have stopped. The files
+        it didn't import are kept aside, so resume() carries on where the
+        import stopped; a new import forgets them. If a ContentHashIndex is given, every 
+        batch of files is checked for duplicate contents before copying."""
+        super().__init__(parent)
+        self.hash_index = hash_index
+        self._checking = 0 # Batches waiting for the duplicate check
+        self._unchecked = deque() # Batches not handed to the pool yet
+        self._check_running = False
+        self._holds = 0 # Sources that are still adding files, see hold()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.destination_dir = None
+        self.delete_originals = False
+        self.mode = COPY
+        self.duplicates = []
+        self.modes_used = Counter() # How many files were imported with each mode
+        self._pending = deque()
+        self._resumable = deque() # Files left over by a cancelled import
+        self._in_flight = 0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self.resetCounters()
+        self.check_finished.connect(self._handleCheckFinished)
+        self.task_finished.connect(self._handleTaskFinished)
+
+    def resetCounters(self):
+        """Reset the progress counters before a new import."""
+        with self._lock:
+            self.files_total = self.files_done = 0
+            self.bytes_total = self.bytes_done = 0
+
+    def setMaxWorkers(self, max_workers):
+        """Set the number of files that are copied concurrently."""
+        self.pool.setMaxThreadCount(max(1, max_workers))
+
+    def _startImport(self):
+        """Clear the results and the left over files of the previous import."""
+        self.resetCounters()
+        self.duplicates = []
+        self.modes_used.clear()
+        self._resumable.clear()
+        self._cancelled.clear()
+
+    def addFiles(self, sources, destination_dir, delete_originals=False, mode=COPY,
+        sizes=None):
+        """Queue 'sources' to be copied or linked into 'destination_dir' 
+        according to 'mode'. Files can be added while an import is running.
+        'sizes' can give the sizes of the files if they are already known, 
+        e.g. from a directory scan."""
+        if not self.isActive():
+            self._startImport()
+        self.destination_dir = destination_dir
+        self.delete_originals = delete_originals
+        self.mode = mode
+        candidates = []
+        for index, source in enumerate(sources):
+            if sizes is not None:
+                size = sizes[index]
+            else:
+                try:
+                    size = os.path.getsize(source)
+                except OSError:
+                    size = 0
+            candidates.append((source, size))
+            with self._lock:
+                self.files_total += 1
+                self.bytes_total += size
+
+        if self.hash_index is None:
+            self._queue([(source, size, None) for source, size in candidates])
+            self._dispatch()
+        else:
+            self._checking += 1
+            self._unchecked.append(candidates)
+            self._dispatchCheck()
+        self.state_changed.emit()
+
+    def hold(self):
+        """Keep the import active while files are still being found, e.g. by
+        a folder that is enumerated in the background. The files added in
+        the meantime belong to one import, and finished() is only emitted
+        once every hold has been released."""
+        if not self.isActive():
+            self._startImport()
+        self._holds += 1
+        self.state_changed.emit()
+
+    def release(self):
+        """Release a hold taken by hold()."""
+        self._holds -= 1
+        self.state_changed.emit()
+        self._checkFinished()
+
+    def cancel(self):
+        """Stop the import. Files that have been copied stay in the library;
+        the queued files are kept aside for resume()."""
+        if not self.isActive():
+            return
+        self._cancelled.set()
+        self._resumable.extend(self._pending)
+        self._pending.clear()
+        self.state_changed.emit()
+        self._checkFinished()
+
+    def resume(self):
+        """Continue a cancelled import with the files it didn't import."""
+        self._cancelled.clear()
+        self._pending.extend(self._resumable)
+        self._resumable.clear()
+        self.state_changed.emit()
+        self._dispatch()
+
+    def canResume(self):
+        """Return True if a cancelled import left files to import."""
+        return self.isCancelled() and len(self._resumable) > 0
+
+    def _queue(self, files, front=False):
+        """Queue (source, size, hashes) tuples to be imported. While the
+        import is cancelled they are kept aside for resume() instead."""
+        queue = self._resumable if self.isCancelled() else self._pending
+        if front:
+            queue.extendleft(reversed(files))
+        else:
+            queue.extend(files)
+
+    def isCancelled(self):
+        """Return True if the import has been cancelled."""
+        return self._cancelled.is_set()
+
+    def isActive(self):
+        """Return True while files are being found, checked, copied or are 
+        waiting to be."""
+        return (self._holds > 0 or self._checking > 0 or self._in_flight > 0 
+            or len(self._pending) > 0)
+
+    def addCopiedBytes(self, count):
+        """Called from the worker threads as data is written."""
+        with self._lock:
+            self.bytes_done += count
+
+    def progress(self):
+        """Return a dictionary with the progress counters."""
+        with self._lock:
+            return {"files_done": self.files_done, "files_total": self.files_total,
+                "bytes_done": self.bytes_done, "bytes_total": self.bytes_total}
+
+    def _dispatch(self):
+        """Hand queued files to the pool, keeping a few tasks in reserve for
+        each thread."""
+        while (not self.isCancelled() and self._pending and
+            self._in_flight < self.pool.maxThreadCount() * 2):
+            source, size, hashes = self._pending.popleft()
+            self._in_flight += 1
+            self.pool.start(ImportTask(self, source, size, self.destination_dir, 
+                self.mode, hashes))
+
+    def _dispatchCheck(self):
+        """Hand the next batch to the duplicate check. Checks take turns on
+        the index's lock, so running one at a time leaves the other threads
+        free to copy the files of the batches that were already checked."""
+        if self._unchecked and not self._check_running:
+            self._check_running = True
+            self.pool.start(DuplicateCheckTask(self, self._unchecked.popleft()))
+
+    def _handleCheckFinished(self, accepted, duplicates, skipped_bytes):
+        """Queue the files of a batch that aren't duplicates. Duplicates 
+        count as done and their bytes won't be copied."""
+        self._checking -= 1
+        self._check_running = False
+        self._dispatchCheck()
+        with self._lock:
+            self.files_done += len(duplicates)
+            self.bytes_total -= skipped_bytes
+        self.duplicates.extend(duplicates)
+        self._queue(accepted)
+        self._dispatch()
+        self.state_changed.emit()
+        self._checkFinished()
+
+    def _handleTaskFinished(self, source, result, value):
+        """Process the result of an ImportTask on the GUI thread."""
+        self._in_flight -= 1
+        if result == "cancelled":
+            # Roll back the bytes that were copied and queue the file again
+            size, copied = value
+            self.addCopiedBytes(-copied)
+            self._queue([(source, size, None)], front=True)
+        else:
+            with self._lock:
+                self.files_done += 1
+            if result == "imported":
+                self.modes_used[value[3]] += 1
+                self.file_imported.emit(source, value[:3])
+            elif result == "duplicate":
+                self.duplicates.append((source, value))
+            elif result == "failed":
+                self.import_failed.emit(source, value)
+        self._dispatch()
+        self.state_changed.emit()
+        self._checkFinished()
+
+    def _checkFinished(self):
+        """Emit finished() once every file has been handled."""
+        if not self.isActive():
+            if self.hash_index is not None:
+                self.hash_index.clearReserved()
+            duplicates, self.duplicates = self.duplicates, []
+            self.finished.emit(duplicates)
@@ -0,0 +1,50 @@
+"""Image Manager GUI, Part 2
+Watches the Images directory for changes made by other programs
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from PyQt6.QtCore import (QObject, QFileSystemWatcher, QTimer, QElapsedTimer,
+    pyqtSignal)
+
+SYNC_DELAY_MS = 500 # Quiet time after a change before the directory is scanned
+SYNC_MAX_DELAY_MS = 5000 # Longest wait while changes keep coming
+RECENT_FILE_NS = 2 * 10**9 # Files modified more recently may still be written
+
+class LibraryWatcher(QObject):
+
+    sync_requested = pyqtSignal()
+
+    def __init__(self, directories, parent=None, delay_ms=SYNC_DELAY_MS,
+        max_delay_ms=SYNC_MAX_DELAY_MS):
+        """Emits sync_requested once the files in 'directories' have stopped
+        changing for 'delay_ms'. Copying thousands of files produces a
+        burst of notifications, which are collapsed into a single request.
+        While the changes continue, a request is still emitted at least
+        every 'max_delay_ms', so the new files appear as they arrive."""
+        super().__init__(parent)
+        self.delay_ms = delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.watcher = QFileSystemWatcher(directories, self)
+        self.watcher.directoryChanged.connect(self.scheduleSync)
+        self.sync_timer = QTimer(self, singleShot=True, timeout=self.sync_requested)
+        self.first_change = QElapsedTimer() # Time since the oldest unsynced change
+
+    def scheduleSync(self):
+        """Restart the quiet period, unless the oldest change has waited for
+        'max_delay_ms' already."""
+        if not self.sync_timer.isActive():
+            self.first_change.start()
+        if self.first_change.elapsed() < self.max_delay_ms:
+            self.sync_timer.start(self.delay_ms)
+
+    def scheduleRecheck(self):
+        """Request another sync after 'max_delay_ms', e.g. to read the final
+        size of files that were still being written during a sync. Writing
+        to a file doesn't change its directory, so it isn't noticed."""
+        if not self.sync_timer.isActive():
+            self.first_change.start()
+            self.sync_timer.start(self.max_delay_ms)
@@ -0,0 +1,116 @@
+"""Image Manager GUI, Part 2
+Background extraction of EXIF metadata in worker processes
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, threading, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+# Import relative modules
+from ..library.exif import extractBatch, captureTime
+
+BATCH_SIZE = 256 # Number of files stored and reported at once
+CHUNK_SIZE = 32 # Number of files sent to a worker process at once
+
+class ExtractTask(QRunnable):
+
+    def __init__(self, extractor):
+        """Runnable that hands the extractor's queued images to the worker
+        processes and stores the results"""
+        super().__init__()
+        self.extractor = extractor
+
+    def run(self):
+        """Extract metadata until the queue is empty."""
+        extractor = self.extractor
+        while not extractor.isStopped():
+            batch = extractor.takeBatch()
+            if not batch:
+                break
+            chunks = [[image_path for image_path, _, _ in batch[start:start + CHUNK_SIZE]]
+                for start in range(0, len(batch), CHUNK_SIZE)]
+            try:
+                results = dict(result for chunk in extractor.executor().map(extractBatch, chunks)
+                    for result in chunk)
+            except RuntimeError: # The executor was shut down
+                break
+            records = [(image_path, size, mtime, captureTime(results[image_path]),
+                results[image_path]) for image_path, size, mtime in batch]
+            extractor.catalog.setMetadata(records)
+            extractor.metadata_ready.emit([(image_path, taken)
+                for image_path, _, _, taken, metadata in records if metadata])
+        extractor.task_done.emit()
+
+class MetadataExtractor(QObject):
+
+    metadata_ready = pyqtSignal(list) # List of (path, capture time or None) tuples
+    # Internal signal emitted by the ExtractTask
+    task_done = pyqtSignal()
+
+    def __init__(self, catalog, parent=None, max_processes=None):
+        """Reads the EXIF and XMP fields of (path, size, mtime) entries and
+        stores them in the catalog. Parsing runs in a pool of worker
+        processes, so it doesn't hold the GUI thread's interpreter lock; the
+        processes are only started once there is something to extract."""
+        super().__init__(parent)
+        self.catalog = catalog
+        self.max_processes = max_processes or min(4, os.cpu_count() or 1)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._executor = None
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._running = False
+        self.task_done.connect(self._handleTaskDone)
+
+    def executor(self):
+        """Return the pool of worker processes, starting it if needed. The
+        processes are spawned rather than forked, since forking a process
+        that runs Qt threads isn't safe."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_processes,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def addEntries(self, entries):
+        """Queue (path, size, mtime) entries to be read."""
+        if not entries:
+            return
+        with self._lock:
+            self._queue.extend(entries)
+        if not self._running:
+            self._running = True
+            self.pool.start(ExtractTask(self))
+
+    def takeBatch(self):
+        """Remove and return the next batch of queued entries."""
+        with self._lock:
+            return [self._queue.popleft() for _ in range(min(BATCH_SIZE, len(self._queue)))]
+
+    def isStopped(self):
+        """Return True once stop() has been called."""
+        return self._stopped.is_set()
+
+    def stop(self):
+        """Stop extracting, wait for the current batch and end the worker
+        processes."""
+        self._stopped.set()
+        self.pool.waitForDone()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    def _handleTaskDone(self):
+        """Start another task if entries were queued as the last one finished."""
+        self._running = False
+        with self._lock:
+            remaining = len(self._queue)
+        if remaining and not self.isStopped():
+            self._running = True
+            self.pool.start(ExtractTask(self))
@@ -0,0 +1,49 @@
+"""Image Manager GUI, Part 2
+Moves the files of an older library into subdirectories in the background
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+# Import relative modules
+from ..library.storage import migrateLibrary
+
+class MigrationTask(QRunnable):
+
+    def __init__(self, migrator):
+        """Runnable that migrates the migrator's library"""
+        super().__init__()
+        self.migrator = migrator
+
+    def run(self):
+        """Move the files and report the progress to the GUI thread."""
+        migrator = self.migrator
+        try:
+            moved = migrateLibrary(migrator.library, migrator.catalog, migrator.cache,
+                migrator.progress.emit)
+        except OSError as error:
+            migrator.failed.emit(error.strerror or str(error))
+            return
+        migrator.finished.emit(moved)
+
+class LibraryMigrator(QObject):
+
+    progress = pyqtSignal(int, int) # Files moved so far, total
+    finished = pyqtSignal(int) # Number of files moved
+    failed = pyqtSignal(str)
+
+    def __init__(self, library, catalog, cache=None, parent=None):
+        """Moves the files that a library from an older version keeps in one
+        directory into the subdirectories of the sharded layout, once, on a
+        worker thread."""
+        super().__init__(parent)
+        self.library = library
+        self.catalog = catalog
+        self.cache = cache
+
+    def start(self, pool=None):
+        """Start moving files on 'pool', or on the global thread pool."""
+        (pool or QThreadPool.globalInstance()).start(MigrationTask(self))
@@ -0,0 +1,121 @@
+"""Image Manager GUI, Part 2
+Incremental directory scanning on a worker thread
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, time, threading
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QElapsedTimer, pyqtSignal
+
+class ScanTask(QRunnable):
+
+    def __init__(self, scanner):
+        """Runnable that walks the scanner's directory"""
+        super().__init__()
+        self.scanner = scanner
+
+    def run(self):
+        """Walk the directory with os.scandir(), which returns the size and
+        modification time of each entry without extra system calls. Entries
+        are emitted in batches. The first batches are small so the view can
+        show images right away, later batches grow to reduce the number of
+        model updates. Hidden files, such as the temporary files of rsync,
+        are skipped."""
+        scanner = self.scanner
+        batch, batch_limit = [], scanner.first_batch_size
+        found, last_emit = 0, time.monotonic()
+        directories = [scanner.directory]
+        while directories and not scanner.isCancelled():
+            directory = directories.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if scanner.isCancelled():
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if scanner.recursive and not entry.name.startswith("."):
+                                directories.append(entry.path)
+                            continue
+                        if (not entry.is_file() or entry.name.startswith(".")
+                            or not scanner.acceptsFile(entry.name)):
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue # The file was removed while scanning
+                    batch.append((os.path.abspath(entry.path), stat.st_size, stat.st_mtime_ns))
+                    found += 1
+
+                    now = time.monotonic()
+                    if len(batch) >= batch_limit or now - last_emit >= scanner.batch_interval:
+                        scanner.batch_ready.emit(batch)
+                        scanner.progress.emit(found)
+                        batch, last_emit = [], now
+                        batch_limit = min(batch_limit * 2, scanner.batch_size)
+        if batch:
+            scanner.batch_ready.emit(batch)
+        scanner.progress.emit(found)
+        scanner.finished.emit(found, scanner.isCancelled())
+
+class DirectoryScanner(QObject):
+
+    batch_ready = pyqtSignal(list) # List of (path, size, mtime) tuples
+    progress = pyqtSignal(int) # Number of files found so far
+    finished = pyqtSignal(int, bool) # Number of files found, whether cancelled
+
+    def __init__(self, directory, parent=None, recursive=False, extensions=None,
+        batch_size=1024, first_batch_size=64, batch_interval=0.1):
+        """Scans 'directory' on a worker thread and reports its files in
+        batches. If 'extensions' is given, only files with one of those
+        lowercase extensions (e.g. '.jpg') are reported."""
+        super().__init__(parent)
+        self.directory = directory
+        self.recursive = recursive
+        self.extensions = extensions
+        self.batch_size = batch_size
+        self.first_batch_size = first_batch_size
+        self.batch_interval = batch_interval
+        self._cancelled = threading.Event()
+        self._running = False
+        self.scan_timer = QElapsedTimer()
+        self.scan_ms = None # Duration of the last scan that finished
+        self.found = 0 # Number of files found by the last scan that finished
+        self.finished.connect(self._handleFinished)
+
+    def start(self, pool=None):
+        """Start scanning on 'pool', or on the global thread pool."""
+        self._cancelled.clear()
+        self._running = True
+        self.scan_timer.start()
+        (pool or QThreadPool.globalInstance()).start(ScanTask(self))
+
+    def cancel(self):
+        """Ask the worker to stop. Batches that were already emitted stay
+        in the model."""
+        self._cancelled.set()
+
+    def isCancelled(self):
+        """Return True if cancel() has been called."""
+        return self._cancelled.is_set()
+
+    def isRunning(self):
+        """Return True while the worker is scanning."""
+        return self._running
+
+    def acceptsFile(self, file_name):
+        """Return True if the file should be reported."""
+        if self.extensions is None:
+            return True
+        return os.path.splitext(file_name)[1].lower() in self.extensions
+
+    def _handleFinished(self, found, cancelled):
+        """Track that the worker has stopped and how long the scan took."""
+        self._running = False
+        if not cancelled:
+            self.scan_ms, self.found = self.scan_timer.elapsed(), found
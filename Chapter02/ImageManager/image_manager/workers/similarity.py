@@ -0,0 +1,167 @@
+"""Image Manager GUI, Part 2
+Background computation of perceptual hashes and similarity queries
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import threading, time
+from collections import deque
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImage
+# Import relative modules
+from .thumbnails import thumbnailPyramid, decodeThumbnail, THUMBNAIL_SIZE
+from ..library.similarity import perceptualHash
+
+BATCH_SIZE = 64 # Number of hashes reported at once
+
+class HashTask(QRunnable):
+
+    def __init__(self, indexer):
+        """Runnable that hashes the indexer's queued images"""
+        super().__init__()
+        self.indexer = indexer
+
+    def run(self):
+        """Hash queued images until the queue is empty. Hashes are computed
+        from the cached thumbnails; an image is only decoded if it has no
+        thumbnail yet, and the new thumbnail is stored in the cache."""
+        indexer = self.indexer
+        while not indexer.isStopped():
+            batch = indexer.takeBatch()
+            if not batch:
+                break
+            found, missing = indexer.store.lookup(batch)
+            computed = []
+            for image_path, size, mtime in missing:
+                if indexer.isStopped():
+                    break
+                image = self.thumbnail(image_path, size, mtime)
+                if not image.isNull():
+                    computed.append((image_path, size, mtime, perceptualHash(image)))
+            indexer.store.store(computed)
+            found.update((image_path, image_hash) for image_path, _, _, image_hash in computed)
+            indexer.hashes_ready.emit(list(found.items()))
+        indexer.task_done.emit()
+
+    def thumbnail(self, image_path, size, mtime):
+        """Return the cached thumbnail of an image, decoding it if needed."""
+        cache = self.indexer.cache
+        cached = cache.get(image_path, size, mtime) if cache is not None else None
+        if cached is not None:
+            return cached[0]
+        pyramid, original_size = thumbnailPyramid(image_path)
+        if cache is not None and pyramid:
+            cache.put(image_path, size, mtime, pyramid, original_size)
+        return pyramid.get(THUMBNAIL_SIZE, QImage())
+
+class PerceptualHashIndexer(QObject):
+
+    hashes_ready = pyqtSignal(list) # List of (path, hash) tuples
+    finished = pyqtSignal()
+    # Internal signal emitted by the HashTask
+    task_done = pyqtSignal()
+
+    def __init__(self, store, cache=None, parent=None):
+        """Computes perceptual hashes for (path, size, mtime) entries on a
+        single background thread so it doesn't compete with the thumbnails
+        of the images on screen. Stored hashes are reused."""
+        super().__init__(parent)
+        self.store = store
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._running = False
+        self.task_done.connect(self._handleTaskDone)
+
+    def addEntries(self, entries):
+        """Queue (path, size, mtime) entries to be hashed."""
+        with self._lock:
+            self._queue.extend(entries)
+        if not self._running:
+            self._running = True
+            self.pool.start(HashTask(self))
+
+    def takeBatch(self):
+        """Remove and return the next batch of queued entries."""
+        with self._lock:
+            return [self._queue.popleft() for _ in range(min(BATCH_SIZE, len(self._queue)))]
+
+    def isStopped(self):
+        """Return True once stop() has been called."""
+        return self._stopped.is_set()
+
+    def isRunning(self):
+        """Return True while hashes are being computed."""
+        return self._running
+
+    def stop(self):
+        """Stop hashing and wait for the worker to finish."""
+        self._stopped.set()
+        self.pool.waitForDone()
+
+    def _handleTaskDone(self):
+        """Start another task if entries were queued as the last one finished."""
+        self._running = False
+        with self._lock:
+            remaining = len(self._queue)
+        if remaining and not self.isStopped():
+            self._running = True
+            self.pool.start(HashTask(self))
+        else:
+            self.finished.emit()
+
+class SimilarImagesTask(QRunnable):
+
+    def __init__(self, finder, entry, image_hash, count):
+        """Runnable that finds the images closest to the (path, size, mtime)
+        'entry'. 'image_hash' is None if the image hasn't been indexed yet."""
+        super().__init__()
+        self.finder = finder
+        self.entry = entry
+        self.image_hash = image_hash
+        self.count = count
+
+    def run(self):
+        """Hash the image if needed, then query the BK-tree."""
+        finder = self.finder
+        image_path, size, mtime = self.entry
+        image_hash = self.image_hash
+        if image_hash is None:
+            # Hash the thumbnail like the indexer does, so the distances compare
+            cached = finder.cache.get(image_path, size, mtime) if finder.cache is not None else None
+            image = (cached[0] if cached is not None
+                else decodeThumbnail(image_path, THUMBNAIL_SIZE)[0])
+            if image.isNull():
+                finder.failed.emit(image_path)
+                return
+            image_hash = perceptualHash(image)
+        start_time = time.perf_counter()
+        results = [(distance, path) for distance, path in
+            finder.tree.nearest(image_hash, self.count + 1) if path != image_path][:self.count]
+        finder.found.emit(image_path, results, (time.perf_counter() - start_time) * 1000)
+
+class SimilarImagesFinder(QObject):
+
+    found = pyqtSignal(str, list, float) # Path, (distance, path) tuples, milliseconds
+    failed = pyqtSignal(str) # Path of an image that can't be read
+
+    def __init__(self, tree, cache=None, parent=None):
+        """Finds the images closest to a selected one in the BKTree 'tree' on
+        a background thread, so a query over a large library doesn't block
+        the GUI. Queries run one at a time."""
+        super().__init__(parent)
+        self.tree = tree
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def find(self, entry, count=100):
+        """Queue a query for the 'count' images closest to the (path, size,
+        mtime) 'entry'. The result is reported by found() or failed()."""
+        self.pool.start(SimilarImagesTask(self, entry, self.tree.hashes.get(entry[0]), count))
@@ -0,0 +1,292 @@
+"""Image Manager GUI, Part 2
+Background thumbnail loading using a pool of worker threads
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os
+from collections import OrderedDict
+from PyQt6.QtCore import (Qt, QObject, QRunnable, QThread, QThreadPool,
+    QSize, QBuffer, pyqtSignal)
+from PyQt6.QtGui import QImage, QImageReader, QPixmap, QColor, QPainter
+# Import relative modules
+from ..library.exif import embeddedPreviews, readPreview
+from ..library.storage import RAW_EXTENSIONS
+from ..library.thumbnail_cache import PYRAMID_LEVELS, DEFAULT_LEVEL
+from .tiles import ORIENTATIONS, orientationTransform
+
+THUMBNAIL_SIZE = DEFAULT_LEVEL # Longest side of a decoded thumbnail, in pixels
+
+def readScaled(reader, size):
+    """Read an image from 'reader' so that its longest side is at most 'size'.
+    The header is read first, which lets the JPEG plugin decode directly
+    at a reduced scale instead of decoding every pixel."""
+    original_size = reader.size() # Only reads the header
+    if original_size.isValid():
+        if original_size.width() > size or original_size.height() > size:
+            reader.setScaledSize(original_size.scaled(size, size,
+                Qt.AspectRatioMode.KeepAspectRatio))
+    image = reader.read()
+    if not image.isNull() and (image.width() > size or image.height() > size):
+        # Some handlers ignore the scaled size, so scale the result instead
+        image = image.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation)
+    return image
+
+def decodePreview(image_path, size):
+    """Decode the smallest JPEG preview embedded in 'image_path' whose
+    longest side is at least 'size', scaled down to 'size'. RAW files
+    can't be decoded otherwise, so their largest preview is used if none
+    is big enough. Returns a tuple of the QImage, null if there is no
+    suitable preview, and the original QSize of RAW files."""
+    previews, orientation = embeddedPreviews(image_path)
+    is_raw = image_path.lower().endswith(RAW_EXTENSIONS)
+    preview = next((preview for preview in previews if max(preview.size) >= size),
+        previews[-1] if previews and is_raw else None)
+    if preview is None:
+        return QImage(), QSize()
+    try:
+        buffer = QBuffer()
+        buffer.setData(readPreview(image_path, preview))
+    except OSError:
+        return QImage(), QSize()
+    reader = QImageReader(buffer, b"jpeg")
+    # Previews are stored like the image, so its orientation applies
+    reader.setAutoTransform(orientation is None)
+    image = readScaled(reader, size)
+    if not image.isNull() and orientation not in (None, 1):
+        image = image.transformed(orientationTransform(ORIENTATIONS[orientation], image.size()))
+    # The largest preview of a RAW file usually has the size of the image
+    return image, QSize(*previews[-1].size) if is_raw else QSize()
+
+def decodeThumbnail(image_path, size=THUMBNAIL_SIZE):
+    """Decode 'image_path' so that its longest side is at most 'size'. The
+    JPEG preview embedded in camera files is tried first, since it is
+    much smaller than the image; otherwise the image is decoded at a
+    reduced scale. Returns a tuple of the QImage and the original QSize
+    of the image."""
+    image, original_size = decodePreview(image_path, size)
+    reader = QImageReader(image_path)
+    if not image.isNull():
+        return image, original_size if original_size.isValid() else reader.size()
+    reader.setAutoTransform(True)
+    original_size = reader.size() # Some handlers can't read it after decoding
+    return readScaled(reader, size), original_size
+
+def thumbnailPyramid(image_path, levels=PYRAMID_LEVELS):
+    """Decode 'image_path' once at the largest of 'levels' and scale each
+    smaller level down from the next larger one. Returns a tuple of a
+    dictionary mapping the levels to QImages, empty if the image can't be
+    read, and the original QSize of the image."""
+    image, original_size = decodeThumbnail(image_path, levels[-1])
+    pyramid = {}
+    if image.isNull():
+        return pyramid, original_size
+    for level in reversed(levels):
+        if image.width() > level or image.height() > level:
+            image = image.scaled(level, level, Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation)
+        pyramid[level] = image
+    return pyramid, original_size
+
+def nearestLevel(size, levels=PYRAMID_LEVELS):
+    """Return the smallest level that is at least 'size' pixels, so icons
+    are only ever scaled down, or the largest level."""
+    return next((level for level in levels if level >= size), levels[-1])
+
+def placeholderPixmap(size=THUMBNAIL_SIZE, failed=False):
+    """Create a neutral pixmap that is displayed until the real
+    thumbnail has been decoded. If 'failed' is True, it is crossed out
+    to show that the image can't be read."""
+    pixmap = QPixmap(size, size)
+    pixmap.fill(Qt.GlobalColor.transparent)
+    painter = QPainter(pixmap)
+    painter.setPen(QColor("#A0A0A0"))
+    painter.setBrush(QColor("#E4E4E4"))
+    painter.drawRoundedRect(4, 4, size - 8, size - 8, 6, 6)
+    if failed:
+        painter.setPen(QColor("#C04040"))
+        margin = size // 3
+        painter.drawLine(margin, margin, size - margin, size - margin)
+        painter.drawLine(margin, size - margin, size - margin, margin)
+    painter.end()
+    return pixmap
+
+class ThumbnailTask(QRunnable):
+
+    def __init__(self, loader, image_path, size, cache=None):
+        """Runnable that loads the thumbnail of pyramid level 'size' on a
+        worker thread"""
+        super().__init__()
+        self.loader = loader
+        self.image_path = image_path
+        self.size = size
+        self.cache = cache
+
+    def run(self):
+        """Look up the thumbnail in the cache, otherwise decode the image and
+        store every level of its pyramid, so other icon sizes don't need to
+        decode it again. Report back to the loader. Signals that are emitted 
+        from a worker thread are queued to the GUI thread."""
+        try:
+            stat = os.stat(self.image_path)
+        except OSError:
+            self.loader.task_failed.emit(self.image_path)
+            return
+
+        cached = None
+        if self.cache is not None:
+            # Only the file's metadata is needed, the original is not opened
+            cached = self.cache.get(self.image_path, stat.st_size, stat.st_mtime_ns, self.size)
+        if cached is not None:
+            image, original_size = cached
+        else:
+            pyramid, original_size = thumbnailPyramid(self.image_path)
+            image = pyramid.get(nearestLevel(self.size), QImage())
+            if self.cache is not None and pyramid:
+                self.cache.put(self.image_path, stat.st_size, stat.st_mtime_ns,
+                    pyramid, original_size)
+        if image.isNull():
+            self.loader.task_failed.emit(self.image_path)
+        else:
+            self.loader.task_finished.emit(self.image_path, image, original_size, self.size)
+
+class ThumbnailLoader(QObject):
+
+    thumbnail_ready = pyqtSignal(str, QImage, QSize)
+    thumbnail_failed = pyqtSignal(str)
+    queue_changed = pyqtSignal(int) # Number of thumbnails left to decode
+    # Internal signals emitted by the ThumbnailTask objects
+    task_finished = pyqtSignal(str, QImage, QSize, int)
+    task_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None, pool_size=0, queue_depth=0,
+        thumbnail_size=THUMBNAIL_SIZE, cache=None):
+        """Decodes thumbnails on a QThreadPool. Requests wait in a pending
+        queue and only 'queue_depth' tasks are handed to the pool at once,
+        so requests for visible items can still jump ahead of the others. 
+        If a ThumbnailCache is given, it is checked before decoding."""
+        super().__init__(parent)
+        self.thumbnail_size = thumbnail_size
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self._visible = OrderedDict() # Requests for items in the viewport
+        self._pending = OrderedDict() # All other requests
+        self._in_flight = set()
+        self.setPoolSize(pool_size)
+        self.setQueueDepth(queue_depth)
+
+        self.task_finished.connect(self._handleFinished)
+        self.task_failed.connect(self._handleFailed)
+
+    def setThumbnailSize(self, thumbnail_size):
+        """Load thumbnails of the pyramid level 'thumbnail_size' from now on.
+        Tasks that are already running for another level are requested 
+        again when they finish."""
+        self.thumbnail_size = thumbnail_size
+
+    def poolSize(self):
+        """Return the number of worker threads."""
+        return self.pool.maxThreadCount()
+
+    def setPoolSize(self, pool_size):
+        """Set the number of worker threads. A value of 0 uses the ideal
+        thread count for the system."""
+        if pool_size <= 0:
+            pool_size = max(1, QThread.idealThreadCount() - 1)
+        self.pool.setMaxThreadCount(pool_size)
+
+    def queueDepth(self):
+        """Return the maximum number of tasks handed to the pool at once."""
+        return self.queue_depth
+
+    def setQueueDepth(self, queue_depth):
+        """Set the maximum number of tasks handed to the pool at once.
+        A value of 0 uses twice the pool size."""
+        if queue_depth <= 0:
+            queue_depth = self.poolSize() * 2
+        self.queue_depth = queue_depth
+        self._dispatch()
+
+    def pendingCount(self):
+        """Return the number of thumbnails waiting to be or being decoded."""
+        return len(self._visible) + len(self._pending) + len(self._in_flight)
+
+    def requestThumbnail(self, image_path, visible=False):
+        """Queue 'image_path' for decoding. Duplicate requests are ignored."""
+        if image_path in self._in_flight:
+            return
+        if visible:
+            self._pending.pop(image_path, None)
+            self._visible[image_path] = None
+        elif image_path not in self._visible:
+            self._pending[image_path] = None
+        self._dispatch()
+
+    def prioritize(self, image_paths):
+        """Move the requests for 'image_paths', typically the items that are
+        currently visible in the viewport, to the front of the queue."""
+        # Items that scrolled out of view go back to the normal queue
+        for image_path in list(self._visible):
+            self._pending[image_path] = None
+            self._pending.move_to_end(image_path, last=False)
+        self._visible.clear()
+        for image_path in image_paths:
+            if image_path in self._pending:
+                del self._pending[image_path]
+                self._visible[image_path] = None
+        self._dispatch()
+
+    def cancel(self, image_path):
+        """Remove a request that has not been handed to the pool yet."""
+        self._visible.pop(image_path, None)
+        self._pending.pop(image_path, None)
+
+    def clear(self):
+        """Remove all requests that have not been handed to the pool yet."""
+        self._visible.clear()
+        self._pending.clear()
+        self.queue_changed.emit(self.pendingCount())
+
+    def _dispatch(self):
+        """Hand requests to the pool until the queue depth is reached."""
+        while len(self._in_flight) < self.queue_depth:
+            if self._visible:
+                image_path, _ = self._visible.popitem(last=False)
+            elif self._pending:
+                image_path, _ = self._pending.popitem(last=False)
+            else:
+                break
+            self._in_flight.add(image_path)
+            self.pool.start(self.createTask(image_path))
+
+    def createTask(self, image_path):
+        """Return the QRunnable used to produce the thumbnail for 'image_path'."""
+        return ThumbnailTask(self, image_path, self.thumbnail_size, self.cache)
+
+    def _handleFinished(self, image_path, image, original_size, size):
+        """Forward a decoded thumbnail and start the next request."""
+        self._in_flight.discard(image_path)
+        if size == self.thumbnail_size:
+            self.thumbnail_ready.emit(image_path, image, original_size)
+        else:
+            self.requestThumbnail(image_path)
+        self._dispatch()
+        self.queue_changed.emit(self.pendingCount())
+
+    def _handleFailed(self, image_path):
+        """Forward a failed request and start the next request."""
+        self._in_flight.discard(image_path)
+        self.thumbnail_failed.emit(image_path)
+        self._dispatch()
+        self.queue_changed.emit(self.pendingCount())
+
+    def shutdown(self):
+        """Drop queued requests and wait for running tasks to finish."""
+        self.clear()
+        self.pool.waitForDone()
+        if self.cache is not None:
+            self.cache.flush()
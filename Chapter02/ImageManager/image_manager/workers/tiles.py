@@ -0,0 +1,353 @@
+"""Image Manager GUI, Part 2
+Background decoding of image tiles for the preview
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import math
+from collections import OrderedDict, namedtuple
+from PyQt6.QtCore import (QObject, QRunnable, QThreadPool, QRect, QSize, QBuffer,
+    pyqtSignal)
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler, QPixmap, QTransform
+# Import relative modules
+from ..library.exif import embeddedPreviews, readPreview
+from ..library.storage import RAW_EXTENSIONS
+
+TILE_SIZE = 256 # Width and height of a decoded tile, in pixels
+TILE_BUDGET_MB = 128 # Memory that decoded tiles may use
+PREFETCH_DEPTH = 2 # Number of images prefetched on each side of the preview
+PREVIEW_HEADER_BYTES = 64 * 1024 # Read to find the orientation of a RAW preview
+
+# Header information of an image. 'tiled' is True if its format can decode
+# a region, otherwise the image is decoded whole, as a single tile per level
+ImageHeader = namedtuple("ImageHeader", "size transformation tiled")
+
+# QImageIOHandler.Transformation of each EXIF orientation
+ORIENTATIONS = {
+    1: QImageIOHandler.Transformation.TransformationNone,
+    2: QImageIOHandler.Transformation.TransformationMirror,
+    3: QImageIOHandler.Transformation.TransformationRotate180,
+    4: QImageIOHandler.Transformation.TransformationFlip,
+    5: QImageIOHandler.Transformation.TransformationFlipAndRotate90,
+    6: QImageIOHandler.Transformation.TransformationRotate90,
+    7: QImageIOHandler.Transformation.TransformationMirrorAndRotate90,
+    8: QImageIOHandler.Transformation.TransformationRotate270}
+
+def readRawPreview(image_path):
+    """Return the largest JPEG preview embedded in the RAW file 'image_path'
+    in a QBuffer, or None if there is none."""
+    previews, _ = embeddedPreviews(image_path)
+    if not previews:
+        return None
+    buffer = QBuffer()
+    try:
+        buffer.setData(readPreview(image_path, previews[-1]))
+    except OSError:
+        return None
+    return buffer
+
+def readHeader(image_path):
+    """Return the ImageHeader of 'image_path'. The size is invalid if the
+    image can't be read. RAW files can't be decoded, so the header
+    describes their largest embedded preview, which is decoded whole. Its
+    size is known from the file's header, so the preview isn't read."""
+    if image_path.lower().endswith(RAW_EXTENSIONS):
+        previews, orientation = embeddedPreviews(image_path)
+        transformation = ORIENTATIONS.get(orientation)
+        if not previews:
+            return ImageHeader(QSize(), QImageIOHandler.Transformation.TransformationNone, False)
+        if transformation is None:
+            # The preview has its own orientation, at the start of its data
+            preview = previews[-1]
+            buffer = QBuffer()
+            try:
+                buffer.setData(readPreview(image_path,
+                    preview._replace(length=min(preview.length, PREVIEW_HEADER_BYTES))))
+            except OSError:
+                return ImageHeader(QSize(), QImageIOHandler.Transformation.TransformationNone, False)
+            transformation = QImageReader(buffer, b"jpeg").transformation()
+        return ImageHeader(QSize(*previews[-1].size), transformation, False)
+    reader = QImageReader(image_path)
+    return ImageHeader(reader.size(), reader.transformation(),
+        reader.supportsOption(QImageIOHandler.ImageOption.ClipRect))
+
+def orientationTransform(transformation, size):
+    """Return the QTransform that maps the stored pixels of an image of
+    'size' to the way it should be displayed, according to the
+    QImageIOHandler.Transformation read from its metadata. Like Qt, the
+    image is mirrored and flipped first and rotated afterwards."""
+    flags = QImageIOHandler.Transformation
+    transform = QTransform()
+    if transformation & flags.TransformationMirror:
+        transform *= QTransform(-1, 0, 0, 1, size.width(), 0)
+    if transformation & flags.TransformationFlip:
+        transform *= QTransform(1, 0, 0, -1, 0, size.height())
+    if transformation & flags.TransformationRotate90:
+        transform *= QTransform(0, 1, -1, 0, size.height(), 0)
+    return transform
+
+def minimumLevel(header, budget_bytes):
+    """Return the most detailed level that can be decoded. Images that are
+    decoded whole are limited to levels that fit in half the budget."""
+    level = 0
+    if not header.tiled:
+        pixels = header.size.width() * header.size.height()
+        while pixels * 4 > budget_bytes // 2:
+            pixels //= 4
+            level += 1
+    return level
+
+def levelForZoom(header, zoom, budget_bytes):
+    """Return the level whose resolution is closest to 'zoom' without
+    being lower. Level n of an image is scaled down by 2**n."""
+    level = 0
+    if zoom < 1.0:
+        level = int(math.floor(math.log2(1.0 / zoom)))
+    return max(level, minimumLevel(header, budget_bytes))
+
+def fitZoom(header, view_size):
+    """Return the zoom factor that fits the image described by 'header' in
+    'view_size' without enlarging small images."""
+    display_size = orientationTransform(header.transformation, header.size).mapRect(
+        QRect(0, 0, header.size.width(), header.size.height())).size()
+    return min(view_size.width() / display_size.width(),
+        view_size.height() / display_size.height(), 1.0)
+
+def tileSpan(header, level):
+    """Return the width and height, in stored pixels, covered by a tile."""
+    if header.tiled:
+        return TILE_SIZE << level
+    return max(header.size.width(), header.size.height())
+
+def tileRect(header, key):
+    """Return the QRect of stored pixels that the tile 'key', a tuple of
+    (level, column, row), covers."""
+    level, column, row = key
+    span = tileSpan(header, level)
+    return QRect(column * span, row * span, span, span).intersected(
+        QRect(0, 0, header.size.width(), header.size.height()))
+
+def decodeTile(image_path, header, key):
+    """Decode only the pixels of a tile. The clip rectangle is applied
+    before scaling, so image formats that support both, such as JPEG,
+    never hold the full resolution image in memory."""
+    source_rect = tileRect(header, key)
+    scale = 1 << key[0]
+    if image_path.lower().endswith(RAW_EXTENSIONS):
+        buffer = readRawPreview(image_path)
+        if buffer is None:
+            return QImage()
+        reader = QImageReader(buffer, b"jpeg")
+    else:
+        reader = QImageReader(image_path)
+    reader.setAutoTransform(False) # The view applies the orientation
+    reader.setClipRect(source_rect)
+    reader.setScaledSize(QSize(max(1, source_rect.width() // scale),
+        max(1, source_rect.height() // scale)))
+    return reader.read()
+
+class TileTask(QRunnable):
+
+    def __init__(self, loader, image_path, header, key):
+        """Runnable that decodes one tile on a worker thread"""
+        super().__init__()
+        self.loader = loader
+        self.image_path = image_path
+        self.header = header
+        self.key = key
+
+    def run(self):
+        """Decode the tile and report back to the loader."""
+        image = decodeTile(self.image_path, self.header, self.key)
+        self.loader.task_finished.emit(self.image_path, self.key, image)
+
+class PrefetchTask(QRunnable):
+
+    def __init__(self, loader, image_path, view_size, budget_bytes):
+        """Runnable that decodes the tiles needed to show an image fitted to
+        'view_size', before the image is selected"""
+        super().__init__()
+        self.loader = loader
+        self.image_path = image_path
+        self.view_size = view_size
+        self.budget_bytes = budget_bytes
+
+    def run(self):
+        """Read the header and decode every tile of the fitted level."""
+        header = readHeader(self.image_path)
+        tiles = []
+        if header.size.isValid():
+            level = levelForZoom(header, fitZoom(header, self.view_size), self.budget_bytes)
+            span = tileSpan(header, level)
+            for row in range(math.ceil(header.size.height() / span)):
+                for column in range(math.ceil(header.size.width() / span)):
+                    key = (level, column, row)
+                    tiles.append((key, decodeTile(self.image_path, header, key)))
+        self.loader.prefetch_finished.emit(self.image_path, header, tiles)
+
+class TileLoader(QObject):
+
+    tile_ready = pyqtSignal(tuple) # Key of a tile of the current image
+    # Internal signals emitted by the TileTask and PrefetchTask objects
+    task_finished = pyqtSignal(str, tuple, QImage)
+    prefetch_finished = pyqtSignal(str, tuple, list)
+
+    def __init__(self, parent=None, budget_bytes=TILE_BUDGET_MB * 1024 * 1024,
+        max_threads=2):
+        """Decodes the tiles of the current image, and prefetches the tiles
+        of the images that are likely to be shown next, on a QThreadPool.
+        Tiles are kept in a least recently used cache that is limited to
+        'budget_bytes' and shared by all images. Requests for the current
+        image always start before prefetches."""
+        super().__init__(parent)
+        self.budget_bytes = budget_bytes
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.image_path = None
+        self.header = ImageHeader(QSize(),
+            QImageIOHandler.Transformation.TransformationNone, True)
+        self._headers = OrderedDict() # Maps recently used paths to ImageHeaders
+        self._tiles = OrderedDict() # Maps (path, level, column, row) to QPixmaps
+        self._tile_bytes = 0
+        self._queue = [] # Keys of the current image, most wanted last
+        self._wanted = [] # Keys last requested for the current image
+        self._prefetch_queue = [] # (path, view size) tuples, most wanted last
+        self._in_flight = set() # (path, key) tuples
+        self._prefetching = set() # Paths
+        self.task_finished.connect(self._handleFinished)
+        self.prefetch_finished.connect(self._handlePrefetchFinished)
+
+    def setImage(self, image_path):
+        """Make 'image_path' the current image and return its ImageHeader.
+        The header is read unless the image was recently prefetched."""
+        self._queue = []
+        self._wanted = []
+        self.image_path = image_path
+        header = self._headers.get(image_path)
+        if header is None:
+            header = readHeader(image_path)
+        self._storeHeader(image_path, header)
+        self.header = header
+        return header
+
+    def clear(self):
+        """Stop displaying the current image. Its tiles stay cached."""
+        self.image_path = None
+        self.header = self.header._replace(size=QSize())
+        self._queue = []
+        self._wanted = []
+
+    def setBudget(self, budget_bytes):
+        """Change the memory limit and evict tiles that no longer fit."""
+        self.budget_bytes = budget_bytes
+        self._evict()
+
+    def tile(self, key):
+        """Return the cached QPixmap for 'key' of the current image, or None."""
+        cache_key = (self.image_path,) + key
+        pixmap = self._tiles.get(cache_key)
+        if pixmap is not None:
+            self._tiles.move_to_end(cache_key)
+        return pixmap
+
+    def requestTiles(self, keys):
+        """Replace the queue with the keys that are not cached yet. Tiles that
+        scrolled out of view before their task started are never decoded.
+        While the current image is being prefetched, its tiles are requested
+        once the prefetch is done, so they aren't decoded twice."""
+        self._wanted = keys
+        if self.image_path in self._prefetching:
+            keys = []
+        self._queue = [key for key in reversed(keys)
+            if (self.image_path,) + key not in self._tiles
+            and (self.image_path, key) not in self._in_flight]
+        self._dispatch()
+
+    def prefetch(self, image_paths, view_size):
+        """Replace the prefetch queue with 'image_paths', most wanted first.
+        Their tiles are decoded for 'view_size' once the threads are idle."""
+        self._prefetch_queue = [(image_path, view_size) for image_path in
+            reversed(image_paths) if image_path not in self._prefetching
+            and not self._isPrefetched(image_path, view_size)]
+        self._dispatch()
+
+    def _isPrefetched(self, image_path, view_size):
+        """Return True if the fitted tiles of 'image_path' are cached, or if
+        the image is known to be unreadable."""
+        header = self._headers.get(image_path)
+        if header is None or not header.size.isValid():
+            return header is not None
+        level = levelForZoom(header, fitZoom(header, view_size), self.budget_bytes)
+        return (image_path, level, 0, 0) in self._tiles
+
+    def _dispatch(self):
+        """Hand tiles of the current image to the pool, one task per thread.
+        Prefetches only start when there are no tiles left to decode."""
+        busy = lambda: len(self._in_flight) + len(self._prefetching)
+        while self._queue and busy() < self.pool.maxThreadCount():
+            key = self._queue.pop()
+            self._in_flight.add((self.image_path, key))
+            self.pool.start(TileTask(self, self.image_path, self.header, key))
+        while self._prefetch_queue and busy() < self.pool.maxThreadCount():
+            image_path, view_size = self._prefetch_queue.pop()
+            self._prefetching.add(image_path)
+            self.pool.start(PrefetchTask(self, image_path, view_size, self.budget_bytes))
+
+    def _handleFinished(self, image_path, key, image):
+        """Cache a decoded tile of the current image."""
+        self._in_flight.discard((image_path, key))
+        if image_path == self.image_path and not image.isNull():
+            self._storeTile((image_path,) + key, image)
+            self.tile_ready.emit(key)
+        self._dispatch()
+
+    def _handlePrefetchFinished(self, image_path, header, tiles):
+        """Cache the header and tiles of a prefetched image. If it became the
+        current image in the meantime, request the tiles that are missing."""
+        self._prefetching.discard(image_path)
+        self._storeHeader(image_path, ImageHeader(*header))
+        for key, image in tiles:
+            if not image.isNull():
+                self._storeTile((image_path,) + key, image)
+        if image_path == self.image_path:
+            if tiles:
+                self.tile_ready.emit(tiles[0][0])
+            self.requestTiles(self._wanted)
+        else:
+            self._dispatch()
+
+    def _storeHeader(self, image_path, header):
+        """Remember the header of a recently used image."""
+        self._headers[image_path] = header
+        self._headers.move_to_end(image_path)
+        while len(self._headers) > 256:
+            self._headers.popitem(last=False)
+
+    def _storeTile(self, cache_key, image):
+        """Add a tile to the cache and evict the least recently used tiles."""
+        pixmap = QPixmap.fromImage(image)
+        replaced = self._tiles.pop(cache_key, None)
+        if replaced is not None:
+            self._tile_bytes -= replaced.width() * replaced.height() * 4
+        self._tiles[cache_key] = pixmap
+        self._tile_bytes += pixmap.width() * pixmap.height() * 4
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used tiles until the cache fits."""
+        while self._tile_bytes > self.budget_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self._tile_bytes -= evicted.width() * evicted.height() * 4
+
+    def memoryUsage(self):
+        """Return the number of bytes used by cached tiles."""
+        return self._tile_bytes
+
+    def shutdown(self):
+        """Drop pending requests and wait for running tasks."""
+        self._queue = []
+        self._prefetch_queue = []
+        self.pool.waitForDone()
@@ -0,0 +1,98 @@
+"""Image Manager GUI, Part 2
+Queue that moves deleted images to the trash in the background
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 2 - Building the Foundation for GUIs
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+from collections import deque
+from PyQt6.QtCore import (QObject, QRunnable, QThreadPool, QTimer, QFile,
+    pyqtSignal)
+
+UNDO_SECONDS = 10 # Time a deletion can be undone before files are trashed
+
+class TrashTask(QRunnable):
+
+    def __init__(self, queue, batches):
+        """Runnable that moves the files of one or more batches to the trash"""
+        super().__init__()
+        self.queue = queue
+        self.batches = batches
+
+    def run(self):
+        """Move each file to the trash and report the results."""
+        trashed, failed = [], []
+        for batch in self.batches:
+            for row, entry in batch:
+                image_path = entry[0]
+                if QFile.moveToTrash(image_path):
+                    trashed.append(image_path)
+                else:
+                    failed.append(image_path)
+        self.queue.task_done.emit(trashed, failed)
+
+class TrashQueue(QObject):
+
+    flushed = pyqtSignal(list, list) # Trashed paths, paths that couldn't be trashed
+    changed = pyqtSignal()
+    # Internal signal emitted by the TrashTask
+    task_done = pyqtSignal(list, list)
+
+    def __init__(self, parent=None, undo_seconds=UNDO_SECONDS):
+        """Holds batches of deleted images for 'undo_seconds' before moving the
+        files to the trash on a worker thread. Each batch is the list of
+        (row, entry) tuples returned by ImageLibraryModel.removeRowList(), so
+        an undone batch can be put back. Deleting again restarts the timer."""
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._batches = []
+        self._trashing = deque() # Batches handed to each task that hasn't finished
+        self.flush_timer = QTimer(self, singleShot=True, interval=undo_seconds * 1000,
+            timeout=self.flush)
+        self.task_done.connect(self._handleTaskDone)
+
+    def enqueue(self, batch):
+        """Add a batch of deleted images."""
+        self._batches.append(batch)
+        self.flush_timer.start()
+        self.changed.emit()
+
+    def canUndo(self):
+        """Return True if a batch is still waiting to be trashed."""
+        return len(self._batches) > 0
+
+    def pendingPaths(self):
+        """Return the set of paths that are waiting to be or being trashed.
+        Their files are still on disk but are no longer in the library."""
+        return {entry[0] for batches in (self._batches, *self._trashing)
+            for batch in batches for row, entry in batch}
+
+    def undo(self):
+        """Remove and return the most recent batch, or None."""
+        if not self._batches:
+            return None
+        batch = self._batches.pop()
+        if not self._batches:
+            self.flush_timer.stop()
+        self.changed.emit()
+        return batch
+
+    def flush(self, wait=False):
+        """Hand every waiting batch to the worker thread. If 'wait' is True,
+        block until the files have been trashed, e.g. when closing."""
+        self.flush_timer.stop()
+        if self._batches:
+            batches, self._batches = self._batches, []
+            self._trashing.append(batches)
+            self.pool.start(TrashTask(self, batches))
+            self.changed.emit()
+        if wait:
+            self.pool.waitForDone()
+
+    def _handleTaskDone(self, trashed, failed):
+        """Forward the results of the oldest task, which ran first."""
+        self._trashing.popleft()
+        self.flushed.emit(trashed, failed)
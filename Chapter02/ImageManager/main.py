@@ -6,12 +6,17 @@ Chapter 2 - Building the Foundation for GUIs
 Created by: Joshua Willman
 """
 
-import sys
+import sys, locale
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
 from image_manager.main_window import MainWindow
 
 if __name__ == "__main__":
+    # Sort file names the way the user's language expects
+    try:
+        locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error:
+        pass # Fall back to comparing characters
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon("icons/images_icon.png")) 
     window = MainWindow()
@@ -9,9 +9,11 @@ Created by: Joshua Willman
 import os, sys, json
 from PyQt6.QtWidgets import (QApplication, QMainWindow, 
     QWidget, QVBoxLayout)
+from PyQt6.QtCore import Qt
 # Import relative modules 
 from .model_view.views import (SpendingsTableView, 
     TotalTableView)
+from .profiling import profiler, ProfilerDock
 
 class MainWindow(QMainWindow):
 
@@ -54,6 +56,11 @@ class MainWindow(QMainWindow):
         self.main_container.setLayout(tables_v_box)
         self.setCentralWidget(self.main_container)
 
+        # Display the slot timings when profiling is turned on
+        if profiler.enabled:
+            self.profiler_dock = ProfilerDock(profiler, self)
+            self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.profiler_dock)
+
     def loadBudgetData(self):
         """Load the budget data from a file."""
         if os.path.exists(self.file_name):
@@ -13,6 +13,7 @@ from PyQt6.QtCore import Qt, pyqtSignal, QModelIndex
 # Import relative modules 
 from .models import TableModel
 from .delegates import IncomeSpinBox
+from ..profiling import profiler
 
 class TableHeaderView(QHeaderView):
 
@@ -57,6 +58,10 @@ class SpendingsTableView(QTableView):
 
         self.model = TableModel(headers, data)
         self.setModel(self.model)
+        # Time the model and the slot that updates the totals when profiling
+        # is turned on, labelled with the table's title
+        profiler.instrument(self.model, ("data", "setData"), f"{headers[0]} model")
+        profiler.instrument(self, ("updateTotalValues",), headers[0])
         # Use the built-in QAbstractItemView method scrollToBottom() to 
         # ensure newly added rows are immediately visible in the view
         self.model.rowsInserted.connect(self.scrollToBottom)
@@ -121,6 +126,8 @@ class TotalTableView(QTableView):
      
         self.model = TableModel(headers=headers, data=[["", "$0.00"]]) 
         self.setModel(self.model) 
+        profiler.instrument(self.model, ("data", "setData"), f"{headers[0]} model")
+        profiler.instrument(self, ("updateTotalsRow",), headers[0])
 
         # Set up the view's header
         self.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
@@ -14,6 +14,7 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow,
 from PyQt6.QtCore import (Qt, QSortFilterProxyModel, QRegularExpression)
 from PyQt6.QtSql import (QSqlRelation, QSqlRelationalTableModel)
 # Import relative modules
+from .profiling import profiler, ProfilerDock
 from .model_view.delegates import (PhoneDelegate, 
     DateDelegate, SqlProxyDelegate, ReadOnlyDelegate)
 
@@ -30,6 +31,10 @@ class MainWindow(QMainWindow):
         """Set up the GUI's main window."""
         self.setWindowTitle("Database Manager") 
         self.setMinimumSize(800, 400)
+        # Time the filtering slots when profiling is turned on. Slots have 
+        # to be replaced before they are connected
+        profiler.instrument(self, ("filterRegExpChanged", "selectTableColumn", 
+            "toggleCaseSensitivity", "updateWidgetsAndStates"))
         self.setUpMainWindow()
 
     def setUpMainWindow(self):
@@ -117,9 +122,14 @@ class MainWindow(QMainWindow):
         # Create status bar
         self.setStatusBar(QStatusBar()) 
 
+        if profiler.enabled:
+            self.profiler_dock = ProfilerDock(profiler, self)
+            self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.profiler_dock)
+
     def createStaffTab(self):
         """Create the page to view the Staff table from the database."""
         staff_sql_model = QSqlRelationalTableModel()
+        profiler.instrument(staff_sql_model, ("data", "setData", "select"), "Staff")
         staff_sql_model.setTable("Staff")  
         staff_sql_model.select() # Populate the model with data
 
@@ -140,6 +150,7 @@ class MainWindow(QMainWindow):
     def createCustomersTab(self):
         """Create the page to view the Customers table from the database."""
         cust_sql_model = QSqlRelationalTableModel()
+        profiler.instrument(cust_sql_model, ("data", "setData", "select"), "Customers")
         cust_sql_model.setTable("Customers")  
         cust_sql_model.setRelation(
             cust_sql_model.fieldIndex("staff_id"), 
@@ -169,6 +180,7 @@ class MainWindow(QMainWindow):
     def createOrdersTab(self):
         """Create the page to view the Orders table from the database."""
         ord_sql_model = QSqlRelationalTableModel()
+        profiler.instrument(ord_sql_model, ("data", "setData", "select"), "Orders")
         ord_sql_model.setTable("Orders") 
         ord_sql_model.setRelation(ord_sql_model.fieldIndex("product_id"), QSqlRelation("Products", "product_id", "product_name"))
         ord_sql_model.setRelation(ord_sql_model.fieldIndex("customer_id"), QSqlRelation("Customers", "customer_id", "first_name"))
@@ -196,6 +208,7 @@ class MainWindow(QMainWindow):
     def createCategoriesTab(self):
         """Create the page to view the Categories table from the database."""
         cat_sql_model = QSqlRelationalTableModel()
+        profiler.instrument(cat_sql_model, ("data", "setData", "select"), "Categories")
         cat_sql_model.setTable("Categories")  
         cat_sql_model.select() # Populate the model with data
 
@@ -218,6 +231,7 @@ class MainWindow(QMainWindow):
     def createProductsTab(self):
         """Create the page to view the Products table from the database."""
         prod_sql_model = QSqlRelationalTableModel()
+        profiler.instrument(prod_sql_model, ("data", "setData", "select"), "Products")
         prod_sql_model.setTable("Products")  
         prod_sql_model.setRelation(
             prod_sql_model.fieldIndex("category_id"), 
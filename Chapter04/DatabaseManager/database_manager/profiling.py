@@ -0,0 +1,201 @@
+"""Database Manager GUI
+Opt-in timing of slots and model methods, shown in a debug dock. Turn it
+on with 'SLOT_PROFILER=1 python3 main.py'.
+
+This is a copy of Chapter02/ImageManager/image_manager/profiling.py, which
+documents it. Change that module and copy it here, so the copies stay the
+same.
+
+Building Custom UIs with PyQt with Packt Publishing
+Chapter 4 - Handling Data with PyQt
+Created by: Joshua Willman
+"""
+
+# Import necessary modules
+import os, json, time, atexit, inspect, threading
+from collections import deque
+from functools import wraps
+from PyQt6.QtWidgets import (QDockWidget, QWidget, QTableWidget, QTableWidgetItem,
+    QPushButton, QFileDialog, QHeaderView, QHBoxLayout, QVBoxLayout)
+from PyQt6.QtCore import Qt, QTimer
+
+SAMPLE_LIMIT = 10000 # Durations kept per name for the percentiles
+TRACE_LIMIT = 200000 # Calls kept for the Chrome trace
+
+class SlotProfiler:
+
+    def __init__(self, enabled=False):
+        """Records how often instrumented slots and methods are called and
+        how long they take. When it is disabled, instrument() leaves the
+        methods untouched, so there is no cost at all."""
+        self.enabled = enabled
+        self._stats = {} # Maps names to [count, total_ns, durations]
+        self._trace = deque(maxlen=TRACE_LIMIT) # (name, start_ns, duration_ns, thread id)
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def instrument(self, target, names, label=None):
+        """Replace the methods 'names' of 'target', an object or a class,
+        with versions that record their durations. Slots must be
+        instrumented before they are connected, since a connection keeps
+        the method it was given."""
+        if not self.enabled:
+            return
+        label = label or (target.__name__ if isinstance(target, type)
+            else type(target).__name__)
+        for name in names:
+            setattr(target, name, self.wrap(getattr(target, name), f"{label}.{name}"))
+
+    def wrap(self, function, name):
+        """Return a version of 'function' that records its durations under
+        'name'. Signals pass all of their arguments, so the extra ones are
+        dropped for slots that take fewer, as PyQt does."""
+        if not self.enabled:
+            return function
+        limit = None
+        try:
+            parameters = inspect.signature(function).parameters.values()
+            if not any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+                limit = sum(1 for parameter in parameters if parameter.kind in
+                    (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD))
+        except (TypeError, ValueError):
+            pass # Built-in methods without a signature get every argument
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0, deque(maxlen=SAMPLE_LIMIT)])
+        record = self._trace.append
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args[:limit], **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - start
+                stats[0] += 1
+                stats[1] += duration
+                stats[2].append(duration)
+                record((name, start, duration, threading.get_ident()))
+        return timed
+
+    def reset(self):
+        """Forget the recorded calls."""
+        with self._lock:
+            for stats in self._stats.values():
+                stats[0] = stats[1] = 0
+                stats[2].clear()
+        self._trace.clear()
+
+    def statistics(self):
+        """Return a dictionary mapping names to their call count and total,
+        mean, p50 and p99 durations in milliseconds."""
+        results = {}
+        with self._lock:
+            items = list(self._stats.items())
+        for name, (count, total, samples) in items:
+            samples = sorted(samples)
+            if not samples:
+                continue
+            percentile = lambda fraction: samples[min(len(samples) - 1,
+                int(fraction * len(samples)))] / 1e6
+            results[name] = {"calls": count, "total_ms": total / 1e6,
+                "mean_ms": total / count / 1e6, "p50_ms": percentile(0.5),
+                "p99_ms": percentile(0.99), "max_ms": samples[-1] / 1e6}
+        return results
+
+    def saveStatistics(self, file_name):
+        """Write the statistics to 'file_name' as JSON."""
+        with open(file_name, "w") as stats_file:
+            json.dump(self.statistics(), stats_file, indent=2)
+
+    def saveTrace(self, file_name):
+        """Write the recorded calls to 'file_name' in the Chrome trace event
+        format. Calls made by a slot are nested inside it."""
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": thread,
+            "ts": (start - self._origin) / 1000, "dur": duration / 1000}
+            for name, start, duration, thread in list(self._trace)]
+        with open(file_name, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+    def saveOnExit(self, stats_file=None, trace_file=None):
+        """Write the statistics and the trace when the application quits."""
+        if stats_file:
+            atexit.register(self.saveStatistics, stats_file)
+        if trace_file:
+            atexit.register(self.saveTrace, trace_file)
+
+class ProfilerDock(QDockWidget):
+
+    COLUMNS = ("Name", "Calls", "Total (ms)", "Mean (ms)", "p50 (ms)", "p99 (ms)", "Max (ms)")
+
+    def __init__(self, profiler, parent=None):
+        """Dock widget that lists the profiler's statistics, slowest total
+        first. The table is refreshed every second while it is visible."""
+        super().__init__("Slot Timings", parent)
+        self.setObjectName("ProfilerDock")
+        self.profiler = profiler
+
+        self.stats_table = QTableWidget(0, len(self.COLUMNS))
+        self.stats_table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.stats_table.horizontalHeader().setSectionResizeMode(0,
+            QHeaderView.ResizeMode.Stretch)
+        self.stats_table.verticalHeader().hide()
+        self.stats_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+
+        reset_button = QPushButton("Reset", clicked=self.resetStatistics)
+        save_button = QPushButton("Save JSON...", clicked=self.saveStatistics)
+        trace_button = QPushButton("Save Trace...", clicked=self.saveTrace)
+        buttons_h_box = QHBoxLayout()
+        buttons_h_box.addStretch()
+        for button in (reset_button, save_button, trace_button):
+            buttons_h_box.addWidget(button)
+
+        dock_v_box = QVBoxLayout()
+        dock_v_box.addWidget(self.stats_table)
+        dock_v_box.addLayout(buttons_h_box)
+        container = QWidget()
+        container.setLayout(dock_v_box)
+        self.setWidget(container)
+
+        self.refresh_timer = QTimer(self, interval=1000, timeout=self.refresh)
+        self.visibilityChanged.connect(lambda visible: self.refresh_timer.start()
+            if visible else self.refresh_timer.stop())
+
+    def refresh(self):
+        """Display the current statistics."""
+        statistics = sorted(self.profiler.statistics().items(),
+            key=lambda item: item[1]["total_ms"], reverse=True)
+        self.stats_table.setRowCount(len(statistics))
+        for row, (name, stats) in enumerate(statistics):
+            values = (stats["calls"], stats["total_ms"], stats["mean_ms"],
+                stats["p50_ms"], stats["p99_ms"], stats["max_ms"])
+            self.stats_table.setItem(row, 0, QTableWidgetItem(name))
+            for column, value in enumerate(values, 1):
+                item = QTableWidgetItem(f"{value:,}" if column == 1 else f"{value:,.3f}")
+                item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.stats_table.setItem(row, column, item)
+
+    def resetStatistics(self):
+        """Forget the recorded calls and clear the table."""
+        self.profiler.reset()
+        self.refresh()
+
+    def saveStatistics(self):
+        """Write the statistics to a JSON file the user selects."""
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Slot Timings",
+            "slot_timings.json", "JSON Files (*.json)")
+        if file_name:
+            self.profiler.saveStatistics(file_name)
+
+    def saveTrace(self):
+        """Write the recorded calls to a Chrome trace file the user selects."""
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Trace",
+            "slot_trace.json", "Trace Files (*.json)")
+        if file_name:
+            self.profiler.saveTrace(file_name)
+
+# The profiler shared by the application, configured from the environment
+profiler = SlotProfiler(os.environ.get("SLOT_PROFILER", "") not in ("", "0"))
+if profiler.enabled:
+    profiler.saveOnExit(os.environ.get("SLOT_PROFILER_OUTPUT"),
+        os.environ.get("SLOT_PROFILER_TRACE"))